@@ -0,0 +1,78 @@
+"""
+benchmarks/compact_html.py - Насколько compact_html ужимает страницу перед запросом к Claude
+
+Страницы:
+  fixture - записанная выдача Mercari (fixtures/mercari_search.html)
+  bloated - та же выдача, раздутая как живая: __NEXT_DATA__, стили, SVG-иконки,
+            трекинговые атрибуты и параметры в ссылках
+Для каждой: байты и оценка токенов до/после, во сколько раз меньше, сколько
+карточек вошло в бюджет и сколько товаров встроенный парсер находит в сжатой
+разметке (содержимое карточек не должно теряться).
+
+Запуск: python benchmarks/compact_html.py [--budget 3000] [--repeat 5]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import load_fixture  # noqa: E402
+from simple_parsers import compact_html, estimate_tokens, parse_mercari_html  # noqa: E402
+
+def bloat(html, rng):
+    """Добавляет то, чем живые страницы тяжелее фикстуры"""
+    next_data = json.dumps({"props": {"pageProps": {"items": [
+        {"id": f"m{rng.randint(10 ** 10, 10 ** 11)}", "name": "x" * 40, "price": rng.randint(300, 99999),
+         "thumbnails": [f"https://static.mercdn.net/thumb/{i}.jpg"] * 4, "status": "on_sale"}
+        for i in range(300)]}}})
+    style = "<style>" + "".join(f".sc-{i}-0{{display:flex;margin:{i}px}}" for i in range(2000)) + "</style>"
+    icon = '<svg viewBox="0 0 24 24"><path d="' + "M12 2L2 7l10 5 10-5-10-5z" * 8 + '"/></svg>'
+    html = html.replace("<head>", "<head>" + style)
+    html = html.replace("</body>", f'<script id="__NEXT_DATA__" type="application/json">{next_data}</script></body>')
+    html = html.replace('<li data-testid="item-cell">',
+                        '<li data-testid="item-cell" class="sc-bcXHqe sc-gswNZR" data-track="impression" '
+                        'style="--cell-w:33%" tabindex="-1"><button aria-label="like">' + icon + '</button>')
+    return html.replace('" data-location=', '?ref=search&amp;utm_source=web" data-location=')
+
+def measure(name, html, budget, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        compact = compact_html(html, budget)
+    elapsed = (time.perf_counter() - start) / repeat
+    raw_tokens = estimate_tokens(html)
+    compact_tokens = estimate_tokens(compact)
+    return {
+        "page": name,
+        "raw_bytes": len(html.encode()),
+        "raw_tokens": raw_tokens,
+        "compact_bytes": len(compact.encode()),
+        "compact_tokens": compact_tokens,
+        "reduction": round(raw_tokens / compact_tokens, 1),
+        "cards_in_page": len(parse_mercari_html(html, 10 ** 6)),
+        "cards_kept": compact.count('data-testid="item-cell"'),
+        "items_parsed_from_compact": len(parse_mercari_html(compact, 10 ** 6)),
+        "ms": round(elapsed * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fixture = load_fixture("mercari_search.html", "r")
+    pages = {"fixture": fixture, "bloated": bloat(fixture, random.Random(3))}
+    results = [measure(name, html, args.budget, args.repeat) for name, html in pages.items()]
+    print(json.dumps({"benchmark": "compact_html", "budget": args.budget, "results": results},
+                     ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
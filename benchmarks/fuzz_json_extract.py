@@ -0,0 +1,150 @@
+"""
+benchmarks/fuzz_json_extract.py - Фаззинг json_extract на случайных ответах LLM
+
+Генерирует ответы: проза + массивы товаров (в ```json блоках, обёртках
+{"items": ...}, с лишними скобками и кавычками вокруг), обрезает их в
+случайном месте и портит случайные символы. Проверяет свойства:
+  - extract_items никогда не падает и не тратит непропорционально много времени;
+  - из целого ответа извлекаются ровно сгенерированные товары;
+  - из обрезанного - все товары, чей объект целиком попал до точки обрезки;
+  - всё извлечённое проходит validate_item.
+
+Запуск: python benchmarks/fuzz_json_extract.py [--iterations 2000] [--seed 1]
+Код выхода 1 и первый упавший пример в JSON, если свойство нарушено.
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_extract import extract_items, validate_item  # noqa: E402
+
+PROSE = ["Вот что я нашёл", "see [note 1]", "цена {примерно}", 'он сказал "ok', "массив: [",
+         "}", "]]", "{not json}", "```", "[1, 2, 3]", '{"total": 3}', "\\", "…"]
+
+def random_text(rng, n):
+    alphabet = string.ascii_letters + "ёжик ¥$€ " + '[]{}",:\\'
+    return "".join(rng.choice(alphabet) for _ in range(n))
+
+def random_item(rng, i):
+    item = {"title": f"{random_text(rng, rng.randint(1, 30)).strip() or 'x'} #{i}",
+            "price": rng.choice([f"¥{rng.randint(1, 99999):,}", rng.randint(1, 10 ** 6), 12.5])}
+    if rng.random() < 0.8:
+        item["url"] = f"https://jp.mercari.com/item/m{rng.randint(10 ** 9, 10 ** 10)}"
+    for field in ("image", "location", "condition"):
+        if rng.random() < 0.5:
+            item[field] = random_text(rng, rng.randint(0, 20))
+    return item
+
+def build_response(rng):
+    """Ответ и список (товар, позиция конца его объекта в тексте)"""
+    parts = []
+    expected = []
+    offset = 0
+
+    def emit(chunk):
+        nonlocal offset
+        parts.append(chunk)
+        offset += len(chunk)
+
+    for _ in range(rng.randint(1, 3)):
+        emit(rng.choice(PROSE) + "\n")
+        items = [random_item(rng, len(expected) + k) for k in range(rng.randint(0, 12))]
+        indent = rng.choice([None, 2])
+        wrapper = rng.choice(["plain", "fenced", "object"])
+        if wrapper == "fenced":
+            emit("```json\n")
+        if wrapper == "object":
+            emit('{"items": ')
+        emit("[")
+        for k, item in enumerate(items):
+            if k:
+                emit(", ")
+            if indent:
+                emit("\n  ")
+            emit(json.dumps(item, ensure_ascii=rng.random() < 0.5))
+            expected.append((item, offset))
+        emit("]")
+        if wrapper == "object":
+            emit(', "total": %d}' % len(items))
+        if wrapper == "fenced":
+            emit("\n```")
+        emit("\n" + rng.choice(PROSE) + "\n")
+    return "".join(parts), expected
+
+def key(item):
+    return (item["title"], item.get("url"), str(item.get("price")))
+
+def check(text, expected_keys, exact):
+    start = time.perf_counter()
+    items = extract_items(text)
+    elapsed = time.perf_counter() - start
+    got = [key(i) for i in items]
+    if any(validate_item(i) is None for i in items):
+        return "извлечён невалидный товар"
+    if exact and got != expected_keys:
+        return f"ожидалось {len(expected_keys)} товаров, извлечено {len(got)}"
+    if not exact and not set(expected_keys) <= set(got):
+        return f"потеряны товары: ожидалось ⊇{len(expected_keys)}, извлечено {len(got)}"
+    # Линейность: ~1 мс на 10 КБ с большим запасом
+    if elapsed > 0.05 + len(text) / 10_000 * 0.01:
+        return f"слишком медленно: {elapsed:.3f}с на {len(text)} символов"
+    return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    stats = {"whole": 0, "truncated": 0, "mutated": 0}
+    for iteration in range(args.iterations):
+        text, expected = build_response(rng)
+        failures = []
+
+        # Целый ответ: ровно сгенерированные товары в исходном порядке
+        error = check(text, [key(item) for item, _ in expected], exact=True)
+        stats["whole"] += 1
+        if error:
+            failures.append(("whole", text, error))
+
+        # Обрезанный ответ: спасены все объекты, закончившиеся до обреза
+        cut = rng.randint(0, len(text))
+        survivors = [key(item) for item, end in expected if end <= cut]
+        error = check(text[:cut], survivors, exact=False)
+        stats["truncated"] += 1
+        if error:
+            failures.append(("truncated", text[:cut], error))
+
+        # Порча: только не падаем, не зависаем и не выдаём невалидное
+        mutated = list(text)
+        for _ in range(rng.randint(1, 10)):
+            if mutated:
+                mutated[rng.randrange(len(mutated))] = rng.choice('[]{}",\\\n x')
+        mutated = "".join(mutated)
+        try:
+            error = check(mutated, [], exact=False)
+        except Exception as e:
+            error = f"исключение {type(e).__name__}: {e}"
+        stats["mutated"] += 1
+        if error:
+            failures.append(("mutated", mutated, error))
+
+        if failures:
+            kind, sample, error = failures[0]
+            print(json.dumps({"ok": False, "iteration": iteration, "seed": args.seed,
+                              "kind": kind, "error": error, "input": sample[:5000]},
+                             ensure_ascii=False, indent=2))
+            sys.exit(1)
+
+    print(json.dumps({"ok": True, "seed": args.seed, "cases": stats}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+benchmarks/json_extract_bench.py - Разбор больших ответов LLM: json_extract против старой регулярки
+
+Старый _parse_response искал r'\\[\\s*\\{.*\\}\\s*\\]' с DOTALL - на длинных
+ответах это откат по всему тексту для каждого "[{". Ответы по 100-800 КБ:
+  clean       - чистый JSON-массив
+  prose       - массивы вперемешку с прозой и посторонними скобками
+  truncated   - массив, обрезанный на середине объекта
+  adversarial - много "[{" без закрывающих "}]"
+
+Запуск: python benchmarks/json_extract_bench.py [--sizes 100,300,800] [--repeat 3]
+Печатает JSON: время (мс), МБ/с и число товаров для обоих вариантов.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_extract import extract_items  # noqa: E402
+
+LEGACY_PATTERN = re.compile(r'\[\s*\{.*\}\s*\]', re.DOTALL)
+
+def legacy_parse(content):
+    """Прежняя логика _parse_response (без построчного запасного варианта)"""
+    match = LEGACY_PATTERN.search(content)
+    try:
+        if match:
+            data = json.loads(match.group(0))
+            return data if isinstance(data, list) else []
+        data = json.loads(content)
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            return data.get("items", [])
+    except ValueError:
+        pass
+    return []
+
+def make_items(rng, size_kb):
+    items, total = [], 0
+    while total < size_kb * 1024:
+        item = {"title": f"Vintage leather jacket {rng.randint(0, 10 ** 6)} レザー",
+                "price": f"¥{rng.randint(1, 999) * 100:,}",
+                "url": f"https://jp.mercari.com/item/m{rng.randint(10 ** 9, 10 ** 10)}",
+                "image": "https://static.mercdn.net/item/detail/orig/photos/x.jpg",
+                "location": "東京都", "condition": "目立った傷や汚れなし"}
+        items.append(item)
+        total += len(json.dumps(item, ensure_ascii=False)) + 2
+    return items
+
+def make_response(shape, size_kb, rng):
+    if shape == "adversarial":
+        chunk = "Смотри [{ вариант без закрытия, цена {~100} и ещё [ ссылка\n"
+        return chunk * (size_kb * 1024 // len(chunk))
+    items = make_items(rng, size_kb)
+    if shape == "clean":
+        return json.dumps(items, ensure_ascii=False)
+    if shape == "truncated":
+        text = json.dumps(items, ensure_ascii=False, indent=2)
+        return text[:int(len(text) * 0.7)]
+    # prose: массивы по 20 товаров, между ними текст со скобками
+    parts = []
+    for i in range(0, len(items), 20):
+        parts.append(f"Партия {i // 20} [см. примечание] {{черновик}}:\n```json\n")
+        parts.append(json.dumps(items[i:i + 20], ensure_ascii=False, indent=2))
+        parts.append("\n```\n")
+    return "".join(parts)
+
+def timed(fn, text, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(result)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,300,800", help="размеры ответов, КБ")
+    parser.add_argument("--shapes", default="clean,prose,truncated,adversarial")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--legacy-timeout-kb", type=int, default=300,
+                        help="adversarial для старой регулярки квадратичен - выше этого размера пропускаем")
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    results = []
+    for shape in args.shapes.split(","):
+        for size_kb in (int(s) for s in args.sizes.split(",")):
+            text = make_response(shape, size_kb, rng)
+            mb = len(text.encode()) / 1024 / 1024
+            new_time, new_items = timed(extract_items, text, args.repeat)
+            row = {"shape": shape, "size_kb": round(len(text.encode()) / 1024),
+                   "scanner_ms": round(new_time * 1000, 2),
+                   "scanner_mb_per_s": round(mb / new_time, 1) if new_time else None,
+                   "scanner_items": new_items}
+            if shape != "adversarial" or size_kb <= args.legacy_timeout_kb:
+                old_time, old_items = timed(legacy_parse, text, 1)
+                row.update(legacy_ms=round(old_time * 1000, 2), legacy_items=old_items)
+            results.append(row)
+
+    print(json.dumps({"benchmark": "json_extract", "results": results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+benchmarks/load_test.py - Нагрузочный тест simple_bot: N пользователей одновременно делают /search
+
+Апдейты (сообщение "/search ..." и нажатие кнопки площадки) синтезируются и
+подаются прямо в Dispatcher.feed_update. Исходящие вызовы Bot API уходят на
+поддельный сервер (отдельный поток со своим event loop), площадка - заглушка
+stub_server.py, БД - временный файл.
+
+Отчёт (JSON): перцентили времени обработчиков и полного поиска (до итогового
+отчёта в чате), лаг event loop, глубина очередей (исходящие сообщения,
+пул потоков парсера) и конкуренция за db_lock.
+
+Запуск: python benchmarks/load_test.py [--users 500] [--concurrency 500]
+                                       [--tg-rate 25] [--request-delay 0]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web  # noqa: E402
+
+from stub_server import start_stub_server  # noqa: E402
+
+BOT_ID = 424242
+DONE_MARKERS = ("Парсинг завершен", "❌ Ошибка")
+
+# ==================== ПОДДЕЛЬНЫЙ BOT API ====================
+class FakeBotAPI:
+    """
+    Отвечает на вызовы Bot API как Telegram и запоминает, когда в какой
+    чат пришёл итоговый отчёт поиска.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.finished = {}
+        self.message_ids = defaultdict(int)
+        self.lock = threading.Lock()
+        self.url = None
+
+    def _message(self, chat_id, text, message_id=None):
+        with self.lock:
+            if message_id is None:
+                self.message_ids[chat_id] += 1
+                message_id = self.message_ids[chat_id]
+        return {"message_id": int(message_id), "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "bot"},
+                "text": text or ""}
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        data = await request.post()
+        with self.lock:
+            self.calls[method] += 1
+
+        if method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "bot", "username": "load_test_bot"}
+        elif method == "sendMessage":
+            result = self._message(data["chat_id"], data.get("text"))
+        elif method == "editMessageText":
+            text = data.get("text", "")
+            if any(marker in text for marker in DONE_MARKERS):
+                with self.lock:
+                    self.finished.setdefault(int(data["chat_id"]), time.monotonic())
+            result = self._message(data["chat_id"], text, data.get("message_id"))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def start(self):
+        """Сервер в отдельном потоке, чтобы не мерить его вместе с ботом"""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            app = web.Application()
+            app.router.add_post("/bot{token}/{method}", self.handle)
+            runner = web.AppRunner(app, access_log=None)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+            self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self.url
+
+# ==================== ОКРУЖЕНИЕ ====================
+def prepare_env(args):
+    """Заглушки и настройки до импорта бота - Config читает окружение при импорте"""
+    stub, stub_url = start_stub_server(latency=args.site_latency)
+    fake_api = FakeBotAPI()
+    api_url = fake_api.start()
+    tmp = tempfile.mkdtemp(prefix="load-")
+    os.environ.update({
+        "BOT_TOKEN": f"{BOT_ID}:LOAD-TEST-TOKEN",
+        "TELEGRAM_API_URL": api_url,
+        "DB_PATH": os.path.join(tmp, "items.db"),
+        "MERCARI_BASE_URL": stub_url,
+        "CLAUDE_API_URL": stub_url,
+        "REQUEST_DELAY_MIN": str(args.request_delay),
+        "REQUEST_DELAY_MAX": str(args.request_delay),
+        "TG_GLOBAL_RATE": str(args.tg_rate),
+        "PARSE_WORKERS": "0",
+        "LIVENESS_ENABLED": "false",
+        "IMAGE_HASH_ENABLED": "false",
+        "MEDIA_CACHE_ENABLED": "false",
+        "TRACE_ENABLED": "false",
+        "PROGRESS_INTERVAL": "0.5",
+    })
+    return stub, fake_api
+
+# ==================== МЕТРИКИ ====================
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(int(len(values) * p), len(values) - 1)] * 1000, 2)
+
+    return {"count": len(values), "p50_ms": pct(0.5), "p90_ms": pct(0.9), "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99), "max_ms": round(values[-1] * 1000, 2)}
+
+def depth_stats(values):
+    if not values:
+        return {}
+    return {"max": max(values), "mean": round(sum(values) / len(values), 2)}
+
+async def sample(stop, simple_bot, samples, interval=0.05):
+    """Лаг event loop и глубина очередей с периодом interval"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        samples["loop_lag"].append(max(time.monotonic() - start - interval, 0))
+        samples["outbox_queue"].append(simple_bot.outbox.queue.qsize())
+        samples["outbox_pending"].append(len(simple_bot.outbox.pending))
+        executor = getattr(loop, "_default_executor", None)
+        samples["executor_queue"].append(executor._work_queue.qsize() if executor else 0)
+
+def db_lock_stats(metrics, before):
+    """Ожидание db_lock за время теста (разница снимков гистограммы)"""
+    after = metrics.registry.snapshot()["db_lock_wait_seconds"]
+    a = dict((tuple(k), v) for k, v in after["values"]).get((), [[0] * (len(after["buckets"]) + 1), 0, 0])
+    b = dict((tuple(k), v) for k, v in before["values"]).get((), [[0] * (len(after["buckets"]) + 1), 0, 0])
+    counts = [x - y for x, y in zip(a[0], b[0])]
+    total, count = a[1] - b[1], a[2] - b[2]
+    slow = sum(c for bound, c in zip(after["buckets"] + [float("inf")], counts) if bound > 0.01)
+    return {"acquisitions": count,
+            "total_wait_s": round(total, 4),
+            "mean_wait_ms": round(total / count * 1000, 3) if count else 0,
+            "waits_over_10ms": slow}
+
+# ==================== СЦЕНАРИЙ ====================
+def make_update(update_id, payload, bot):
+    from aiogram import types
+    return types.Update.model_validate({"update_id": update_id, **payload}, context={"bot": bot})
+
+async def user_session(user_id, simple_bot, fake_api, results, query):
+    bot, dp = simple_bot.bot, simple_bot.dp
+    chat = {"id": user_id, "type": "private"}
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    now = int(datetime.now().timestamp())
+
+    # 1. /search <запрос>
+    update = make_update(user_id * 10, {"message": {
+        "message_id": 1, "date": now, "chat": chat, "from": user, "text": f"/search {query}"}}, bot)
+    start = time.monotonic()
+    await dp.feed_update(bot, update)
+    results["search_command"].append(time.monotonic() - start)
+
+    # 2. выбор площадки - запускает парсинг в фоне
+    update = make_update(user_id * 10 + 1, {"callback_query": {
+        "id": str(user_id), "from": user, "chat_instance": str(user_id), "data": "platform_mercari",
+        "message": {"message_id": 2, "date": now, "chat": chat,
+                    "from": {"id": BOT_ID, "is_bot": True, "first_name": "bot"}, "text": "Выбери площадку"}}}, bot)
+    start = time.monotonic()
+    await dp.feed_update(bot, update)
+    results["platform_callback"].append(time.monotonic() - start)
+    return start
+
+async def run(args, fake_api):
+    import simple_bot
+    import metrics
+    from database import init_db
+
+    # Логи бота на каждый поиск заглушили бы отчёт
+    logging.getLogger().setLevel(logging.WARNING)
+
+    init_db()
+    await simple_bot.setup_bot()
+    lock_before = metrics.registry.snapshot()["db_lock_wait_seconds"]
+
+    results = defaultdict(list)
+    samples = defaultdict(list)
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample(stop, simple_bot, samples))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = {}
+
+    async def limited(user_id):
+        async with semaphore:
+            started[user_id] = await user_session(user_id, simple_bot, fake_api, results, f"load {user_id % 50}")
+
+    test_start = time.monotonic()
+    await asyncio.gather(*(limited(1000 + i) for i in range(args.users)))
+
+    # Ждём итоговых отчётов по всем поискам
+    deadline = time.monotonic() + args.timeout
+    while len(fake_api.finished) < args.users and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    elapsed = time.monotonic() - test_start
+
+    stop.set()
+    await sampler
+    await simple_bot.outbox.stop()
+
+    end_to_end = [fake_api.finished[u] - started[u] for u in started if u in fake_api.finished]
+    return {
+        "benchmark": "load_test",
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "searches_completed": len(end_to_end),
+        "searches_per_s": round(len(end_to_end) / elapsed, 2) if elapsed else None,
+        "handler_latency": {name: percentiles(values) for name, values in results.items()},
+        "search_end_to_end": percentiles(end_to_end),
+        "loop_lag": percentiles(samples["loop_lag"]),
+        "queue_depth": {name: depth_stats(samples[name])
+                        for name in ("outbox_queue", "outbox_pending", "executor_queue")},
+        "db_lock": db_lock_stats(metrics, lock_before),
+        "bot_api_calls": dict(fake_api.calls),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--tg-rate", type=float, default=25, help="глобальный лимит Bot API, запросов/с")
+    parser.add_argument("--request-delay", type=float, default=0, help="пауза парсера перед запросом, с")
+    parser.add_argument("--site-latency", type=float, default=0.05, help="задержка заглушки площадки, с")
+    parser.add_argument("--timeout", type=float, default=300, help="сколько ждать завершения поисков, с")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    stub, fake_api = prepare_env(args)
+    report = asyncio.run(run(args, fake_api))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    stub.shutdown()
+
+if __name__ == "__main__":
+    main()
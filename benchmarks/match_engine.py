@@ -0,0 +1,108 @@
+"""
+benchmarks/match_engine.py - Сопоставление новых товаров с подписками: индекс против перебора
+
+Синтетические подписки (бренды из brands.py, слова из fixtures/titles.txt,
+часть с площадкой и диапазоном цен) и пачка товаров с названиями из фикстуры.
+MatchEngine.match сравнивается с полным перебором подписки × товары:
+совпадения должны быть те же, время - расти с числом совпадений, а не подписок.
+
+Запуск: python benchmarks/match_engine.py [--users 1000,5000,20000] [--items 40]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import load_fixture  # noqa: E402
+from brands import BRAND_MAIN_NAMES, find_brand  # noqa: E402
+from subscriptions import MatchEngine, Subscription, title_keys  # noqa: E402
+from utils import parse_price  # noqa: E402
+
+def make_subscriptions(rng, users, words):
+    subscriptions = []
+    for user_id in range(users):
+        for _ in range(rng.randint(1, 3)):
+            brand = rng.choice(BRAND_MAIN_NAMES) if rng.random() < 0.7 else None
+            keywords = tuple(rng.sample(words, rng.randint(0 if brand else 1, 2)))
+            price_min, price_max = 0, None
+            if rng.random() < 0.3:
+                price_min = rng.choice([0, 3000, 10000])
+                price_max = price_min + rng.choice([5000, 20000, 50000])
+            subscriptions.append(Subscription(
+                id=len(subscriptions) + 1, user_id=user_id, brand=brand, keywords=keywords,
+                platform="mercari" if rng.random() < 0.2 else None,
+                price_min=price_min, price_max=price_max))
+    return subscriptions
+
+def make_items(rng, titles, count):
+    return [{"id": f"i{i}", "title": rng.choice(titles), "price": f"¥{rng.randint(5, 600) * 100:,}",
+             "source": "Mercari JP"} for i in range(count)]
+
+def brute_force(subscriptions, items):
+    """Эталон: каждая подписка против каждого товара"""
+    matches = set()
+    for item in items:
+        title_lower = item["title"].lower()
+        keys = title_keys(title_lower)
+        found = find_brand(title_lower)
+        brand = found[0] if found else None
+        price = parse_price(item["price"])
+        notified = set()
+        for subscription in subscriptions:
+            if subscription.user_id not in notified and \
+                    subscription.matches(brand, item["source"], title_lower, keys, price):
+                notified.add(subscription.user_id)
+                matches.add((subscription.user_id, item["id"]))
+    return matches
+
+def timed(fn, repeat=3):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="1000,5000,20000")
+    parser.add_argument("--items", type=int, default=40)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(11)
+    titles = load_fixture("titles.txt", "r").splitlines()
+    words = sorted({word for title in titles for word in title.lower().split()
+                    if not any(word in brand.lower().split() for brand in BRAND_MAIN_NAMES)})
+
+    results, ok = [], True
+    for users in (int(u) for u in args.users.split(",")):
+        subscriptions = make_subscriptions(rng, users, words)
+        items = make_items(rng, titles, args.items)
+        engine = MatchEngine(subscriptions)
+
+        engine_time, engine_matches = timed(lambda: engine.match(items))
+        brute_time, brute_matches = timed(lambda: brute_force(subscriptions, items), repeat=1)
+        same = {(sub.user_id, item["id"]) for sub, item in engine_matches} == brute_matches
+        ok = ok and same
+        results.append({"users": users, "subscriptions": len(subscriptions), "items": len(items),
+                        "matches": len(engine_matches), "same_as_brute_force": same,
+                        "engine_ms": round(engine_time * 1000, 2),
+                        "brute_force_ms": round(brute_time * 1000, 2),
+                        "speedup": round(brute_time / engine_time, 1)})
+
+    print(json.dumps({"benchmark": "match_engine", "ok": ok, "results": results},
+                     ensure_ascii=False, indent=2))
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+benchmarks/parse_pool.py - Пропускная способность разбора HTML Mercari в пуле процессов
+
+Запуск: python benchmarks/parse_pool.py [--pages 200] [--workers 1,2,4,8]
+Печатает JSON: страниц/с и товаров/с для инлайн-разбора и каждого размера пула.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_parsers import parse_mercari_html, _warm_parse_worker  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "mercari_search.html")
+
+def run_inline(pages, html, limit):
+    start = time.perf_counter()
+    items = sum(len(parse_mercari_html(html, limit)) for _ in range(pages))
+    return time.perf_counter() - start, items
+
+def run_pool(workers, pages, html, limit):
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_parse_worker) as pool:
+        # Прогреваем все процессы, чтобы не мерить их запуск
+        list(pool.map(parse_mercari_html, [html] * workers, [limit] * workers))
+        start = time.perf_counter()
+        futures = [pool.submit(parse_mercari_html, html, limit) for _ in range(pages)]
+        items = sum(len(f.result()) for f in futures)
+        return time.perf_counter() - start, items
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--limit", type=int, default=120)
+    args = parser.parse_args()
+
+    with open(FIXTURE, "rb") as f:
+        html = f.read()
+
+    results = []
+    elapsed, items = run_inline(args.pages, html, args.limit)
+    results.append({"workers": 0, "seconds": round(elapsed, 3),
+                    "pages_per_s": round(args.pages / elapsed, 1),
+                    "items_per_s": round(items / elapsed, 1)})
+
+    for workers in (int(w) for w in args.workers.split(",")):
+        elapsed, items = run_pool(workers, args.pages, html, args.limit)
+        results.append({"workers": workers, "seconds": round(elapsed, 3),
+                        "pages_per_s": round(args.pages / elapsed, 1),
+                        "items_per_s": round(items / elapsed, 1)})
+
+    print(json.dumps({"benchmark": "parse_pool", "pages": args.pages,
+                      "page_bytes": len(html), "cpus": os.cpu_count(),
+                      "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+benchmarks/stages.py - Пропускная способность и задержки по этапам конвейера
+
+Все внешние сайты заменены заглушкой (stub_server.py) и записанными фикстурами,
+БД - временный файл. Этапы:
+  parse_html        - parse_mercari_html по фикстуре, товаров/с
+  fetch_parse       - parse_mercari против заглушки (HTTP + разбор), товаров/с
+  upsert            - add_item_with_brand (новые и повторные товары), upsert/с
+  save_batch        - Database.save_items пачками (с дедупликацией), товаров/с
+  brand_match       - detect_brand_from_title, заголовков/с
+  llm_parse         - ClaudeComputerUse._parse_response, ответов/с
+  claude_roundtrip  - ClaudeComputerUse.run_task против заглушки free-api, ответов/с
+  claude_batch      - одновременные run_task, склеенные в микро-пачки, задач/с
+                      (+ сколько запросов дошло до заглушки)
+
+Запуск: python benchmarks/stages.py [--stages parse_html,upsert] [--output bench.json]
+                                    [--compare baseline.json --tolerance 0.2]
+Печатает JSON; с --compare выходит с кодом 1, если какой-то этап медленнее
+базового больше чем на tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import start_stub_server, load_fixture  # noqa: E402
+
+# Окружение задаём до импорта модулей бота: Config читает его при импорте
+STUB, STUB_URL = start_stub_server()
+TMP_DIR = tempfile.mkdtemp(prefix="bench-")
+os.environ.update({
+    "DB_PATH": os.path.join(TMP_DIR, "items.db"),
+    "MERCARI_BASE_URL": STUB_URL,
+    "CLAUDE_API_URL": STUB_URL,
+    "REQUEST_DELAY_MIN": "0",
+    "REQUEST_DELAY_MAX": "0",
+    "IMAGE_HASH_ENABLED": "false",
+    "TRACE_ENABLED": "false",
+})
+
+import database  # noqa: E402
+from brands import detect_brand_from_title  # noqa: E402
+from claude_controller import ClaudeComputerUse, ComputerUseTask  # noqa: E402
+from simple_parsers import parse_mercari, parse_mercari_html  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# ==================== ЗАМЕРЫ ====================
+def summarize(latencies, units, seconds):
+    latencies = sorted(latencies)
+
+    def pct(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 3)
+
+    return {
+        "calls": len(latencies),
+        "units": units,
+        "seconds": round(seconds, 4),
+        "units_per_s": round(units / seconds, 1) if seconds else None,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+    }
+
+def measure(fn, inputs, count_units=lambda result: 1):
+    """Вызывает fn на каждом входе, считает задержку каждого вызова и единицы результата"""
+    latencies, units = [], 0
+    start = time.perf_counter()
+    for value in inputs:
+        t0 = time.perf_counter()
+        result = fn(value)
+        latencies.append(time.perf_counter() - t0)
+        units += count_units(result)
+    return summarize(latencies, units, time.perf_counter() - start)
+
+# ==================== ЭТАПЫ ====================
+def bench_parse_html(scale):
+    page = load_fixture("mercari_search.html")
+    return measure(lambda html: parse_mercari_html(html, 1000), [page] * (20 * scale), len)
+
+def bench_fetch_parse(scale):
+    return measure(parse_mercari, [f"bench {i}" for i in range(10 * scale)], len)
+
+def _synthetic_items(n, prefix):
+    titles = load_fixture("titles.txt", "r").splitlines()
+    return [{
+        "id": f"{prefix}{i}",
+        "title": titles[i % len(titles)],
+        "price": f"¥{1000 + i * 10:,}",
+        "url": f"{STUB_URL}/item/{prefix}{i}",
+        "img_url": "",
+        "source": "Mercari JP",
+    } for i in range(n)]
+
+def bench_upsert(scale):
+    items = _synthetic_items(200 * scale, "u")
+    inserts = measure(lambda item: database.add_item_with_brand(item, "bench"), items)
+    updates = measure(lambda item: database.add_item_with_brand(item, "bench"), items)
+    # Итог по обоим проходам, детали - отдельно
+    total = inserts["seconds"] + updates["seconds"]
+    return {"units": inserts["units"] + updates["units"],
+            "seconds": round(total, 4),
+            "units_per_s": round((inserts["units"] + updates["units"]) / total, 1),
+            "insert": inserts, "update": updates}
+
+def bench_save_batch(scale):
+    db = database.Database()
+    items = _synthetic_items(200 * scale, "b")
+    batches = [items[i:i + 20] for i in range(0, len(items), 20)]
+    loop = asyncio.new_event_loop()
+    try:
+        return measure(lambda batch: loop.run_until_complete(db.save_items(batch, "mercari", "bench")) or 0,
+                       batches, lambda _: 20)
+    finally:
+        loop.close()
+
+def bench_brand_match(scale):
+    titles = load_fixture("titles.txt", "r").splitlines()
+    return measure(detect_brand_from_title, titles * (5 * scale))
+
+def bench_llm_parse(scale):
+    claude = ClaudeComputerUse(api_url=STUB_URL)
+    responses = json.loads(load_fixture("claude_responses.json"))
+    result = measure(claude._parse_response, [r["content"] for r in responses] * (20 * scale))
+    result["items_by_shape"] = {r["shape"]: len(claude._parse_response(r["content"])) for r in responses}
+    return result
+
+def bench_claude_roundtrip(scale):
+    claude = ClaudeComputerUse(api_url=STUB_URL, batch_window=0)
+    loop = asyncio.new_event_loop()
+    try:
+        def run(i):
+            return loop.run_until_complete(claude.run_task(ComputerUseTask(query=f"bench {i}", user_id=0)))
+        return measure(run, range(10 * scale), lambda result: 1 if result.success else 0)
+    finally:
+        loop.run_until_complete(claude.close())
+        loop.close()
+
+def bench_claude_batch(scale):
+    claude = ClaudeComputerUse(api_url=STUB_URL, batch_window=0.05, batch_max=5)
+    loop = asyncio.new_event_loop()
+
+    async def wave(i):
+        tasks = [ComputerUseTask(query=f"bench {i}-{k}", user_id=k) for k in range(10)]
+        return await asyncio.gather(*(claude.run_task(task) for task in tasks))
+
+    try:
+        before = STUB.RequestHandlerClass.completions_served
+        result = measure(lambda i: loop.run_until_complete(wave(i)), range(5 * scale),
+                         lambda results: sum(1 for r in results if r.success and r.items))
+        result["upstream_calls"] = STUB.RequestHandlerClass.completions_served - before
+        return result
+    finally:
+        loop.run_until_complete(claude.close())
+        loop.close()
+
+STAGES = {
+    "parse_html": bench_parse_html,
+    "fetch_parse": bench_fetch_parse,
+    "upsert": bench_upsert,
+    "save_batch": bench_save_batch,
+    "brand_match": bench_brand_match,
+    "llm_parse": bench_llm_parse,
+    "claude_roundtrip": bench_claude_roundtrip,
+    "claude_batch": bench_claude_batch,
+}
+
+# ==================== СРАВНЕНИЕ ====================
+def compare(report, baseline, tolerance):
+    """Этапы, у которых units_per_s упал больше чем на tolerance"""
+    regressions = []
+    for stage, result in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or not base.get("units_per_s") or not result.get("units_per_s"):
+            continue
+        change = result["units_per_s"] / base["units_per_s"] - 1
+        if change < -tolerance:
+            regressions.append({"stage": stage, "baseline": base["units_per_s"],
+                                "current": result["units_per_s"], "change": round(change, 3)})
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--scale", type=int, default=1, help="множитель объёма работы")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    database.init_db()
+    report = {
+        "benchmark": "stages",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": int(time.time()),
+        "stages": {},
+    }
+    for name in args.stages.split(","):
+        report["stages"][name] = STAGES[name](args.scale)
+
+    if args.compare:
+        with open(args.compare) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    STUB.shutdown()
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
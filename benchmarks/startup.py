@@ -0,0 +1,88 @@
+"""
+benchmarks/startup.py - Время импорта simple_bot (то, что платит каждый перезапуск под main.py)
+
+Запуск: python benchmarks/startup.py [--budget 0.5] [--runs 5]
+Импортирует бота в чистом процессе с -X importtime и печатает JSON: время
+импорта aiogram (без него бота не запустить), собственные накладные расходы
+simple_bot сверх него и самые тяжёлые модули. Код выхода 1, если накладные
+расходы вышли за бюджет или при старте загрузились модули, которые должны
+грузиться лениво.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Эти модули нужны только при первом парсинге / обращении к Claude
+LAZY_MODULES = ("simple_parsers", "claude_controller", "bs4", "lxml", "requests")
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import aiogram, aiogram.types, aiogram.client.bot
+base = time.perf_counter() - start
+start = time.perf_counter()
+import simple_bot
+elapsed = time.perf_counter() - start
+loaded = [m for m in {lazy!r} if m in sys.modules]
+print("RESULT", base, elapsed, ",".join(loaded))
+"""
+
+def run_once(db_file):
+    env = os.environ.copy()
+    env.setdefault("BOT_TOKEN", "123456:TEST-startup-benchmark-token")
+    env["DB_PATH"] = db_file
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(lazy=LAZY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    result = next((l for l in proc.stdout.splitlines() if l.startswith("RESULT")), None)
+    if not result:
+        raise RuntimeError(f"импорт simple_bot упал:\n{proc.stderr[-2000:]}")
+    _, base, elapsed, loaded = (result.split(" ", 3) + [""])[:4]
+
+    # Строки importtime: "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if m and not m.group(3):
+            modules.append((int(m.group(2)), m.group(4)))
+    modules.sort(reverse=True)
+    return float(base), float(elapsed), [m for m in loaded.split(",") if m], modules[:10]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("STARTUP_BUDGET", 0.5)))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [run_once(os.path.join(tmp, "items.db")) for _ in range(args.runs)]
+
+    base = statistics.median(r[0] for r in runs)
+    times = [r[1] for r in runs]
+    loaded = sorted(set(m for r in runs for m in r[2]))
+    median = statistics.median(times)
+    report = {
+        "benchmark": "startup",
+        "aiogram_s": round(base, 3),
+        "median_s": round(median, 3),
+        "min_s": round(min(times), 3),
+        "budget_s": args.budget,
+        "eager_lazy_modules": loaded,
+        "top_imports_ms": [{"module": name, "ms": round(us / 1000, 1)} for us, name in runs[-1][3]],
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if median > args.budget or loaded:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+benchmarks/stub_server.py - Локальная заглушка маркетплейсов и прокси free-api для бенчмарков
+
+Отдаёт записанные фикстуры вместо живых сайтов:
+  GET  /search?keyword=...      - страница выдачи Mercari (fixtures/mercari_search.html)
+  GET|HEAD /item/<id>           - карточка товара (для liveness); id с "gone" -> 404,
+                                  id с "sold" -> 200 с отметкой о продаже
+  GET  /health                  - как у free-api
+  POST /v1/chat/completions     - ответы Claude по кругу из fixtures/claude_responses.json;
+                                  на промпт пачки (ID "...") - объект {ID: товары} для каждой задачи
+
+Запуск отдельно: python benchmarks/stub_server.py [--port 8765] [--latency 0.05]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_fixture(name, mode="rb"):
+    with open(os.path.join(FIXTURES, name), mode) as f:
+        return f.read()
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    search_page = load_fixture("mercari_search.html")
+    claude_responses = itertools.cycle(json.loads(load_fixture("claude_responses.json")))
+    batch_items = next(json.loads(r["content"]) for r in json.loads(load_fixture("claude_responses.json"))
+                       if r["shape"] == "plain_array")
+    latency = 0.0
+    requests_served = 0
+    completions_served = 0
+
+    def _reply(self, status, body=b"", content_type="text/html; charset=utf-8"):
+        if self.latency:
+            time.sleep(self.latency)
+        StubHandler.requests_served += 1
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/search":
+            self._reply(200, self.search_page)
+        elif path.startswith("/item/"):
+            if "gone" in path:
+                self._reply(404, b"not found")
+            elif "sold" in path:
+                self._reply(200, '<html><body>売り切れました</body></html>'.encode())
+            else:
+                self._reply(200, b"<html><body>item</body></html>")
+        elif path == "/health":
+            self._reply(200, b'{"status":"ok"}', "application/json")
+        else:
+            self._reply(404, b"not found")
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = self.rfile.read(length)
+        if urlparse(self.path).path != "/v1/chat/completions":
+            self._reply(404, b"not found")
+            return
+        StubHandler.completions_served += 1
+        prompt = json.loads(request)["messages"][-1]["content"]
+        task_ids = re.findall(r'^- ID "([^"]+)"', prompt, re.MULTILINE)
+        if task_ids:
+            content = json.dumps({task_id: self.batch_items for task_id in task_ids}, ensure_ascii=False)
+        else:
+            content = next(self.claude_responses)["content"]
+        body = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]})
+        self._reply(200, body.encode(), "application/json")
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_server(port=0, latency=0.0):
+    """Поднимает заглушку в фоновом потоке, возвращает (server, base_url)"""
+    StubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    server, url = start_stub_server(args.port, args.latency)
+    print(f"stub server: {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
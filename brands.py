@@ -2,6 +2,8 @@
 brands.py - Бренды для поиска
 """
 
+import re
+
 # ==================== БРЕНДЫ ====================
 
 BRAND_GROUPS_SIMPLE = [
@@ -65,4 +67,20 @@ def detect_brand_from_title(title):
         if brand_main in title_lower:
             return group["main"]
     
-    return None
\ No newline at end of file
+    return None
+# Бренд как отдельное слово: по краям не латиница/цифра ("blaze" не в "blazer",
+# но "gongen" в "gongenリング" - японские названия идут без пробелов)
+_BRAND_PATTERNS = [
+    (group["main"], re.compile(r"(?<![a-z0-9])" + re.escape(group["main"].lower()) + r"(?![a-z0-9])"))
+    for group in BRAND_GROUPS_SIMPLE
+]
+
+def find_brand(text_lower):
+    """Первый бренд, встреченный целым словом: (бренд, начало, конец) или None"""
+    if not text_lower:
+        return None
+    for brand, pattern in _BRAND_PATTERNS:
+        match = pattern.search(text_lower)
+        if match:
+            return brand, match.start(), match.end()
+    return None
@@ -5,11 +5,16 @@ claude_controller.py - Клиент для Claude Computer Use
 import asyncio
 import aiohttp
 import json
+import re
 import uuid
 import time
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass, asdict
 
+from config import Config
+from json_extract import extract_items, items_from_values, iter_json_values
+from metrics import CLAUDE_SECONDS, CLAUDE_REQUESTS, CLAUDE_BATCH_SIZE
+
 @dataclass
 class ComputerUseTask:
     """Задача для Computer Use"""
@@ -37,37 +42,134 @@ class ComputerUseResult:
     screenshots: List[str] = None
     task_id: str = None
 
+SYSTEM_PROMPT = "Ты — помощник для парсинга сайтов. Твоя задача — заходить на сайты, искать товары и возвращать структурированные данные в JSON."
+
+ITEM_FORMAT = '{"title": "...", "price": "...", "url": "...", "image": "...", "location": "...", "condition": "..."}'
+
+# Поля выученных селекторов страницы выдачи
+SELECTOR_FIELDS = ("card", "title", "price", "link", "image")
+
 class ClaudeComputerUse:
     """Клиент для Claude Computer Use"""
     
-    def __init__(self, api_url: str = "http://localhost:3032"):
+    def __init__(self, api_url: str = "http://localhost:3032",
+                 batch_window: Optional[float] = None, batch_max: Optional[int] = None):
         self.api_url = api_url
         self.session = None
+        # Микро-пачки: окно сбора задач (0 - без пачек) и максимум задач в запросе
+        self.batch_window = Config.CLAUDE_BATCH_WINDOW if batch_window is None else batch_window
+        self.batch_max = batch_max or Config.CLAUDE_BATCH_MAX
+        # Ответ пачки должен уместиться в выход модели: ограничиваем сумму запрошенных товаров
+        self.batch_items = Config.CLAUDE_BATCH_MAX_ITEMS
+        self._pending = []
+        self._pending_items = 0
+        self._flush_handle = None
+        self._dispatches = set()
         print(f"✅ Claude Computer Use инициализирован (API: {api_url})")
     
     async def _get_session(self):
-        if not self.session:
+        if not self.session or self.session.closed:
             self.session = aiohttp.ClientSession()
         return self.session
     
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+    
     async def run_task(self, task: ComputerUseTask) -> ComputerUseResult:
-        """Запуск задачи"""
+        """Запуск задачи: она ждёт окно пачки и уходит вместе с соседями"""
+        if self.batch_window <= 0 or self.batch_max <= 1:
+            return (await self._run_batch([task]))[0]
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._pending and self._pending_items + task.max_items > self.batch_items:
+            self._flush()
+        self._pending.append((task, future))
+        self._pending_items += task.max_items
+        
+        if len(self._pending) >= self.batch_max:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        """Отправляет накопленную пачку"""
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        self._pending_items = 0
+        if batch:
+            dispatch = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, batch):
+        results = await self._run_batch([task for task, _ in batch])
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    async def _run_batch(self, tasks: List[ComputerUseTask]) -> List[ComputerUseResult]:
+        """Один запрос к прокси на все задачи; ответ раскладывается по ID задач"""
         start_time = time.time()
+        CLAUDE_BATCH_SIZE.observe(len(tasks))
+        
+        try:
+            if len(tasks) == 1:
+                content = await self._complete(self._build_prompt(tasks[0]))
+                items_by_id = {tasks[0].id: self._parse_response(content)}
+            else:
+                content = await self._complete(self._build_batch_prompt(tasks))
+                items_by_id = self._demultiplex(content, tasks)
+        except Exception as e:
+            print(f"❌ Ошибка Computer Use: {e}")
+            return [ComputerUseResult(success=False, items=[], error=str(e), task_id=task.id)
+                    for task in tasks]
+        
+        duration = time.time() - start_time
+        results = {
+            task_id: ComputerUseResult(
+                success=True,
+                items=items,
+                duration=duration,
+                tokens=0,
+                screenshots=[],
+                task_id=task_id
+            )
+            for task_id, items in items_by_id.items()
+        }
+        
+        # Задачи, которых нет в ответе пачки, переспрашиваем по одной
+        missing = [task for task in tasks if task.id not in results]
+        if missing:
+            print(f"⚠️ В ответе пачки нет {len(missing)} из {len(tasks)} задач, повторяем по одной")
+            retried = await asyncio.gather(*(self._run_batch([task]) for task in missing))
+            for task, (result,) in zip(missing, retried):
+                result.duration += duration
+                results[task.id] = result
+        
+        return [results[task.id] for task in tasks]
+    
+    async def _complete(self, prompt: str) -> str:
+        """Запрос к /v1/chat/completions, возвращает текст ответа"""
+        start_time = time.time()
+        messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
         
         try:
-            prompt = self._build_prompt(task)
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": "Ты — помощник для парсинга сайтов. Твоя задача — заходить на сайты, искать товары и возвращать структурированные данные в JSON."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-            
             session = await self._get_session()
             
             async with session.post(
@@ -77,7 +179,7 @@ class ClaudeComputerUse:
                     "messages": messages,
                     "stream": False
                 },
-                timeout=120
+                timeout=aiohttp.ClientTimeout(total=120)
             ) as response:
                 
                 if response.status != 200:
@@ -85,43 +187,27 @@ class ClaudeComputerUse:
                     raise Exception(f"API вернул {response.status}: {error_text}")
                 
                 data = await response.json()
-                
-                # Парсим ответ
-                content = data.get('content', '')
-                if not content and 'choices' in data:
-                    content = data['choices'][0].get('message', {}).get('content', '')
-                
-                items = self._parse_response(content)
-                
-                duration = time.time() - start_time
-                
-                return ComputerUseResult(
-                    success=True,
-                    items=items,
-                    duration=duration,
-                    tokens=0,
-                    screenshots=[],
-                    task_id=task.id
-                )
-            
-        except Exception as e:
-            print(f"❌ Ошибка Computer Use: {e}")
-            return ComputerUseResult(
-                success=False,
-                items=[],
-                error=str(e),
-                task_id=task.id
-            )
-        finally:
-            if self.session:
-                await self.session.close()
-                self.session = None
+        except Exception:
+            CLAUDE_SECONDS.labels(outcome="error").observe(time.time() - start_time)
+            CLAUDE_REQUESTS.labels(outcome="error").inc()
+            raise
+        
+        CLAUDE_SECONDS.labels(outcome="success").observe(time.time() - start_time)
+        CLAUDE_REQUESTS.labels(outcome="success").inc()
+        
+        content = data.get('content', '')
+        if not content and 'choices' in data:
+            content = data['choices'][0].get('message', {}).get('content', '')
+        return content
     
-    def _build_prompt(self, task: ComputerUseTask) -> str:
-        platform_info = ""
+    def _platform_info(self, task: ComputerUseTask) -> str:
         if task.platform and task.platforms and task.platform in task.platforms:
             platform = task.platforms.get(task.platform, {})
-            platform_info = f"Сайт: {platform.get('url')} ({platform.get('name')})"
+            return f"Сайт: {platform.get('url')} ({platform.get('name')})"
+        return ""
+    
+    def _build_prompt(self, task: ComputerUseTask) -> str:
+        platform_info = self._platform_info(task)
         
         prompt = f"""
 ЗАДАЧА: {task.query}
@@ -142,29 +228,124 @@ class ClaudeComputerUse:
    - Напиши "НУЖНА ПОМОЩЬ: [описание]"
 5. Собери минимум {task.max_items} товаров
 6. Верни результат строго в формате JSON-массива:
-   [{{"title": "...", "price": "...", "url": "...", "image": "...", "location": "...", "condition": "..."}}]
+   [{ITEM_FORMAT}]
+"""
+        return prompt
+    
+    def _build_batch_prompt(self, tasks: List[ComputerUseTask]) -> str:
+        """Общие инструкции один раз, задачи списком с ID"""
+        lines = []
+        for task in tasks:
+            platform_info = self._platform_info(task)
+            line = f'- ID "{task.id}": {task.query} (минимум {task.max_items} товаров)'
+            lines.append(f"{line}. {platform_info}" if platform_info else line)
+        queries = "\n".join(lines)
+        
+        prompt = f"""
+ЗАДАЧИ (выполни каждую отдельно):
+{queries}
+
+ИНСТРУКЦИИ:
+1. Открой сайт в браузере
+2. Для каждой задачи найди товары по её запросу
+3. Для каждого товара собери:
+   - Название
+   - Цену
+   - Ссылку
+   - Фото (ссылку)
+   - Локацию продавца
+   - Состояние (новый/б/у)
+4. Если появится капча или запрос на подтверждение:
+   - Напиши "НУЖНА ПОМОЩЬ: [описание]"
+5. Верни результат строго одним JSON-объектом: ключ - ID задачи, значение - массив её товаров:
+   {{"{tasks[0].id}": [{ITEM_FORMAT}], ...}}
+"""
+        return prompt
+    
+    def _demultiplex(self, content: str, tasks: List[ComputerUseTask]) -> Dict[str, List[Dict]]:
+        """Товары по ID задач из ответа пачки: {"id": [...]} или [{"id": ..., "items": [...]}]"""
+        task_ids = {task.id for task in tasks}
+        items_by_id = {}
+        
+        def take(task_id, value):
+            task_id = str(task_id)
+            if task_id in task_ids and task_id not in items_by_id:
+                items_by_id[task_id] = items_from_values([value])
+        
+        try:
+            for value in iter_json_values(content):
+                if isinstance(value, dict):
+                    value = value.get("results", value)
+                if isinstance(value, dict):
+                    for key, element in value.items():
+                        take(key, element)
+                elif isinstance(value, list):
+                    for element in value:
+                        if isinstance(element, dict) and ("id" in element or "task_id" in element):
+                            take(element.get("id", element.get("task_id")), element.get("items", []))
+            if len(items_by_id) < len(task_ids):
+                self._salvage_truncated(content, task_ids, items_by_id)
+        except Exception as e:
+            print(f"Ошибка разбора ответа пачки: {e}")
+        return items_by_id
+    
+    def _salvage_truncated(self, content: str, task_ids: set, items_by_id: Dict[str, List[Dict]]):
+        """
+        Обрезанный ответ: внешний объект не закрыт, и его массивы приходят без ключей.
+        Ищем в тексте ключи задач ('"ID": [' или '"id": "ID"') и разбираем кусок до следующего
+        """
+        ids = "|".join(re.escape(task_id) for task_id in task_ids)
+        marks = [(match.start(), match.group(1) or match.group(2)) for match in
+                 re.finditer(rf'"({ids})"\s*:\s*\[|"(?:id|task_id)"\s*:\s*"({ids})"', content)]
+        for (start, task_id), (end, _) in zip(marks, marks[1:] + [(len(content), None)]):
+            if task_id not in items_by_id:
+                items = extract_items(content[start:end])
+                if items:
+                    items_by_id[task_id] = items
+    
+    async def learn_layout(self, platform_name: str, platform_url: str, excerpt: str) -> Dict[str, Any]:
+        """
+        Разбор выдержки страницы, которую не осилил HTML-парсер:
+        {"selectors": {card, title, price, link, image} или None, "items": [...]}
+        """
+        content = await self._complete(self._build_layout_prompt(platform_name, platform_url, excerpt))
+        
+        selectors = None
+        for value in iter_json_values(content):
+            candidate = value.get("selectors") if isinstance(value, dict) else None
+            if isinstance(candidate, dict) and isinstance(candidate.get("card"), str) and candidate["card"].strip():
+                selectors = {field: candidate[field].strip() for field in SELECTOR_FIELDS
+                             if isinstance(candidate.get(field), str) and candidate[field].strip()}
+                break
+        
+        return {"selectors": selectors, "items": extract_items(content)}
+    
+    def _build_layout_prompt(self, platform_name: str, platform_url: str, excerpt: str) -> str:
+        prompt = f"""
+Страница выдачи {platform_name} ({platform_url}). Наш HTML-парсер не нашёл на ней товары -
+похоже, изменилась вёрстка. Ниже разметка страницы без скриптов, стилей и лишних атрибутов.
+
+ИНСТРУКЦИИ:
+1. Найди карточки товаров и для каждой собери название, цену, ссылку и фото
+2. Подбери CSS-селекторы:
+   - card - карточка товара (на странице их много)
+   - title, price, link, image - элементы внутри карточки
+3. Верни результат строго одним JSON-объектом:
+   {{"selectors": {{"card": "...", "title": "...", "price": "...", "link": "...", "image": "..."}},
+    "items": [{ITEM_FORMAT}]}}
+
+РАЗМЕТКА:
+{excerpt}
 """
         return prompt
     
     def _parse_response(self, content: str) -> List[Dict]:
         items = []
         try:
-            import re
-            json_match = re.search(r'\[\s*\{.*\}\s*\]', content, re.DOTALL)
-            
-            if json_match:
-                data = json.loads(json_match.group(0))
-                if isinstance(data, list):
-                    items = data
-            else:
-                try:
-                    data = json.loads(content)
-                    if isinstance(data, list):
-                        items = data
-                    elif isinstance(data, dict) and 'items' in data:
-                        items = data['items']
-                except:
-                    items = self._extract_items_from_text(content)
+            # Все корректные JSON-фрагменты ответа (включая целые объекты из обрезанного массива)
+            items = extract_items(content)
+            if not items:
+                items = self._extract_items_from_text(content)
         except Exception as e:
             print(f"Ошибка парсинга ответа: {e}")
         return items
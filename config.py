@@ -26,17 +26,127 @@ class Config:
         logger.error("❌ ТОКЕН БОТА НЕ НАЙДЕН!")
         logger.error("Добавь BOT_TOKEN или TELEGRAM_BOT_TOKEN в переменные окружения!")
     
+    # Режим получения апдейтов: polling или webhook
+    BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+    WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+    # Реплика при старте регистрирует вебхук, только если он ещё не указывает на WEBHOOK_URL
+    # (0 - не трогать, регистрировать командой `python simple_bot.py set-webhook`)
+    WEBHOOK_REGISTER = os.environ.get("WEBHOOK_REGISTER", "1") == "1"
+    PORT = int(os.environ.get("PORT", 8080))
+    
+    # Свой сервер Bot API (локальный telegram-bot-api или заглушка для нагрузочных тестов)
+    TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "")
+    
     # ID чата для уведомлений
     CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
     
     # Настройки Claude
     CLAUDE_ENABLED = os.environ.get("CLAUDE_ENABLED", "true").lower() == "true"
     CLAUDE_API_URL = os.environ.get("CLAUDE_API_URL", "http://localhost:3032")
+    # Микро-пачки: задачи, пришедшие за CLAUDE_BATCH_WINDOW секунд, уходят одним запросом
+    CLAUDE_BATCH_WINDOW = float(os.environ.get("CLAUDE_BATCH_WINDOW", 0.3))
+    CLAUDE_BATCH_MAX = int(os.environ.get("CLAUDE_BATCH_MAX", 5))
+    # ...и пока сумма запрошенных товаров не больше этой: длинный ответ обрезается
+    CLAUDE_BATCH_MAX_ITEMS = int(os.environ.get("CLAUDE_BATCH_MAX_ITEMS", 100))
     
     # Настройки парсинга
     REQUEST_TIMEOUT = int(os.environ.get("REQUEST_TIMEOUT", 30))
     ITEMS_PER_PAGE = int(os.environ.get("ITEMS_PER_PAGE", 10))
-    
+    MERCARI_BASE_URL = os.environ.get("MERCARI_BASE_URL", "https://jp.mercari.com")
+    # Случайная пауза перед запросом к площадке, секунды
+    REQUEST_DELAY_MIN = float(os.environ.get("REQUEST_DELAY_MIN", 1))
+    REQUEST_DELAY_MAX = float(os.environ.get("REQUEST_DELAY_MAX", 3))
+
+    # Проверка актуальности объявлений (проданные/снятые)
+    # Выключено по умолчанию: полный обход выдачи брендов - много запросов к площадке
+    LIVENESS_ENABLED = os.environ.get("LIVENESS_ENABLED", "false").lower() == "true"
+    LIVENESS_INTERVAL = int(os.environ.get("LIVENESS_INTERVAL", 3600))
+    LIVENESS_BATCH = int(os.environ.get("LIVENESS_BATCH", 30))
+    # Сколько страниц выдачи бренда обходить; не дошли до конца - отставших не проверяем
+    LIVENESS_PAGES = int(os.environ.get("LIVENESS_PAGES", 10))
+    LIVENESS_RATE = float(os.environ.get("LIVENESS_RATE", 2))
+
+    # Склейка почти-дубликатов (перевыставленные и кросс-постнутые объявления)
+    DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.8))
+    DEDUP_PRICE_TOLERANCE = float(os.environ.get("DEDUP_PRICE_TOLERANCE", 0.15))
+
+    # Перцептивные хеши фото
+    IMAGE_HASH_ENABLED = os.environ.get("IMAGE_HASH_ENABLED", "true").lower() == "true"
+    IMAGE_DOWNLOAD_WORKERS = int(os.environ.get("IMAGE_DOWNLOAD_WORKERS", 4))
+    IMAGE_HASH_PROCESSES = int(os.environ.get("IMAGE_HASH_PROCESSES", 2))
+    # Порог расстояния Хэмминга по pHash: индекс по 4 кускам находит всё только до 3
+    IMAGE_HASH_DISTANCE = int(os.environ.get("IMAGE_HASH_DISTANCE", 3))
+
+    # Кеш превью и отправка фото альбомами
+    MEDIA_CACHE_ENABLED = os.environ.get("MEDIA_CACHE_ENABLED", "true").lower() == "true"
+    MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", "thumbs")
+    MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+    SEND_PHOTOS_LIMIT = int(os.environ.get("SEND_PHOTOS_LIMIT", 10))
+
+    # Лимиты исходящих сообщений Telegram (сообщений в секунду)
+    TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", 25))
+    TG_CHAT_RATE = float(os.environ.get("TG_CHAT_RATE", 1))
+
+    # Хранилище состояний диалогов: sqlite (переживает перезапуск) или memory
+    FSM_STORAGE = os.environ.get("FSM_STORAGE", "sqlite").lower()
+    FSM_DIALOG_TTL = int(os.environ.get("FSM_DIALOG_TTL", 24 * 3600))
+    FSM_CACHE_SIZE = int(os.environ.get("FSM_CACHE_SIZE", 1000))
+    # Кеш чтений диалогов (секунды). 0 - без кеша: обязательно, если процессов бота несколько
+    FSM_CACHE_TTL = float(os.environ.get("FSM_CACHE_TTL", 0))
+
+    # Процессы для разбора HTML (0 - разбирать в текущем процессе)
+    PARSE_PROCESSES = int(os.environ.get("PARSE_PROCESSES", 0))
+    # Запасной разбор через Claude при сломанной разметке: повтор обучения не чаще раза в интервал
+    LAYOUT_RELEARN_INTERVAL = int(os.environ.get("LAYOUT_RELEARN_INTERVAL", 6 * 3600))
+    # Выученные селекторы перечитываются из БД не чаще раза в LAYOUT_RULES_TTL секунд
+    LAYOUT_RULES_TTL = int(os.environ.get("LAYOUT_RULES_TTL", 60))
+    # Сколько поиск ждёт обучения Claude; дольше - отвечаем без него, обучение идёт в фоне
+    LAYOUT_LEARN_WAIT = float(os.environ.get("LAYOUT_LEARN_WAIT", 8))
+    # Бюджет токенов на разметку страницы в одном запросе к Claude (см. compact_html)
+    LLM_PAGE_TOKEN_BUDGET = int(os.environ.get("LLM_PAGE_TOKEN_BUDGET", 3000))
+
+    # Подписки пользователей и оповещения о новых товарах
+    SUBSCRIPTIONS_ENABLED = os.environ.get("SUBSCRIPTIONS_ENABLED", "true").lower() == "true"
+    SUBSCRIPTIONS_PER_USER = int(os.environ.get("SUBSCRIPTIONS_PER_USER", 20))
+    # Как часто процесс проверяет, не изменились ли подписки (секунды)
+    SUBSCRIPTIONS_REFRESH = float(os.environ.get("SUBSCRIPTIONS_REFRESH", 10))
+    ALERT_POLL_INTERVAL = float(os.environ.get("ALERT_POLL_INTERVAL", 5))
+    # Дайджест: оповещения копятся до DIGEST_INTERVAL секунд или DIGEST_MAX_ITEMS товаров
+    DIGEST_INTERVAL = float(os.environ.get("DIGEST_INTERVAL", 300))
+    DIGEST_MAX_ITEMS = int(os.environ.get("DIGEST_MAX_ITEMS", 50))
+    DIGEST_PAGE_SIZE = int(os.environ.get("DIGEST_PAGE_SIZE", 5))
+    # Дайджесты и отправленные оповещения хранятся ALERT_RETENTION секунд (листание кнопками,
+    # защита от повторов); чистка - не чаще раза в ALERT_PURGE_INTERVAL
+    ALERT_RETENTION = int(os.environ.get("ALERT_RETENTION", 7 * 24 * 3600))
+    ALERT_PURGE_INTERVAL = int(os.environ.get("ALERT_PURGE_INTERVAL", 3600))
+
+    # Воркер-процессы парсинга (0 - парсить в процессе бота)
+    PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", 0))
+    JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+    JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", 300))
+    JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.5))
+
+    # Как часто обновлять сообщение с прогрессом парсинга (секунды)
+    PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 1.5))
+
+    # Метрики: как часто процесс сбрасывает снимок
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 10))
+
+    # Сторож event loop: пульс каждые INTERVAL, стек логируется при блокировке дольше THRESHOLD
+    LOOP_MONITOR_ENABLED = os.environ.get("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+    LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", 0.1))
+    LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD", 0.5))
+
+    # Трассировка поиска: JSONL-файл и/или OTLP/HTTP коллектор (http://host:4318)
+    TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "false").lower() == "true"
+    TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+    TRACE_OTLP_URL = os.environ.get("TRACE_OTLP_URL", "")
+    TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "parser-bot")
+
     # Доступные платформы
     PLATFORMS = {
         "mercari": {
@@ -2,19 +2,27 @@
 database.py - Работа с SQLite базой данных для хранения товаров и статистики
 """
 
+import asyncio
+import json
+import os
+import re
 import sqlite3
 import time
 import logging
-from threading import Lock
 from datetime import datetime, timedelta
 
+from config import Config
+from metrics import TimedLock, DB_UPSERT_SECONDS, DB_UPSERT_ITEMS
+from tracing import span, traced, in_context
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 # ==================== КОНФИГУРАЦИЯ ====================
-DB_FILE = "items.db"
-db_lock = Lock()
+DB_FILE = os.environ.get("DB_PATH", "items.db")
+# Время ожидания блокировки попадает в метрику db_lock_wait_seconds
+db_lock = TimedLock()
 
 # ==================== ИНИЦИАЛИЗАЦИЯ БАЗЫ ====================
 def init_db():
@@ -25,6 +33,9 @@ def init_db():
             conn = sqlite3.connect(DB_FILE)
             c = conn.cursor()
             
+            # WAL: читатели не блокируют писателя - нужно для нескольких процессов
+            c.execute("PRAGMA journal_mode=WAL")
+            
             # Проверяем существующие колонки
             c.execute("PRAGMA table_info(items)")
             columns = [col[1] for col in c.fetchall()]
@@ -70,7 +81,14 @@ def init_db():
                         (user_id INTEGER PRIMARY KEY,
                          username TEXT,
                          first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                         last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+                         last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         priority_price INTEGER)''')
+            
+            # Порог цены, ниже которого оповещения идут сразу, мимо дайджеста
+            c.execute("PRAGMA table_info(users)")
+            if 'priority_price' not in [col[1] for col in c.fetchall()]:
+                c.execute("ALTER TABLE users ADD COLUMN priority_price INTEGER")
+                logger.info("✅ Добавлена колонка users.priority_price")
             
             # Таблица задач Claude
             c.execute('''CREATE TABLE IF NOT EXISTS claude_tasks
@@ -83,11 +101,115 @@ def init_db():
                          items_found INTEGER DEFAULT 0,
                          error TEXT)''')
             
+            # MinHash-сигнатуры и кластеры почти-дубликатов
+            c.execute('''CREATE TABLE IF NOT EXISTS item_signatures
+                        (item_id TEXT PRIMARY KEY,
+                         cluster_id TEXT,
+                         signature BLOB,
+                         price INTEGER,
+                         source TEXT)''')
+            
+            # Площадка задаёт валюту цены: цены разных площадок не сравниваем
+            c.execute("PRAGMA table_info(item_signatures)")
+            if 'source' not in [col[1] for col in c.fetchall()]:
+                c.execute("ALTER TABLE item_signatures ADD COLUMN source TEXT")
+                logger.info("✅ Добавлена колонка item_signatures.source")
+
+            # LSH-корзины: (полоса, хеш полосы) -> товар
+            c.execute('''CREATE TABLE IF NOT EXISTS item_lsh
+                        (band INTEGER,
+                         bucket INTEGER,
+                         item_id TEXT)''')
+
+            # Перцептивные хеши фото: 64 бита + четыре 16-битных куска для multi-index поиска
+            c.execute('''CREATE TABLE IF NOT EXISTS image_hashes
+                        (item_id TEXT PRIMARY KEY,
+                         dhash INTEGER,
+                         phash INTEGER,
+                         p0 INTEGER, p1 INTEGER, p2 INTEGER, p3 INTEGER,
+                         match_of TEXT)''')
+
+            # Кеш превью: файлы по sha256 содержимого и их Telegram file_id
+            c.execute('''CREATE TABLE IF NOT EXISTS media_files
+                        (sha256 TEXT PRIMARY KEY,
+                         size INTEGER DEFAULT 0,
+                         file_id TEXT,
+                         last_used REAL)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS media_urls
+                        (url TEXT PRIMARY KEY,
+                         sha256 TEXT)''')
+
+            # Сохранённые поиски пользователей (см. subscriptions.py)
+            c.execute('''CREATE TABLE IF NOT EXISTS subscriptions
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         user_id INTEGER,
+                         brand TEXT,
+                         keywords TEXT,
+                         platform TEXT,
+                         price_min INTEGER DEFAULT 0,
+                         price_max INTEGER,
+                         created_at REAL)''')
+            # Совпадения новых товаров с подписками, ждущие отправки
+            c.execute('''CREATE TABLE IF NOT EXISTS alerts
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         user_id INTEGER,
+                         item_id TEXT,
+                         subscription_id INTEGER,
+                         created_at REAL,
+                         sent_at REAL,
+                         UNIQUE (user_id, item_id))''')
+
+            # Отправленные дайджесты: товары для листания кнопками
+            c.execute('''CREATE TABLE IF NOT EXISTS digests
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         user_id INTEGER,
+                         items TEXT,
+                         created_at REAL)''')
+
+            # Выученные селекторы площадок по хешу разметки (см. simple_parsers.parse_mercari_adaptive)
+            c.execute('''CREATE TABLE IF NOT EXISTS layout_rules
+                        (platform TEXT,
+                         layout_hash TEXT,
+                         status TEXT,
+                         selectors TEXT,
+                         updated_at REAL,
+                         PRIMARY KEY (platform, layout_hash))''')
+
+            # Очередь задач парсинга для воркер-процессов (см. job_queue.py)
+            c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         kind TEXT,
+                         payload TEXT,
+                         status TEXT DEFAULT 'queued',
+                         attempts INTEGER DEFAULT 0,
+                         worker TEXT,
+                         lease_until REAL,
+                         progress TEXT,
+                         result TEXT,
+                         error TEXT,
+                         created_at REAL,
+                         updated_at REAL)''')
+
             # Индексы
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions(user_id)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_alerts_pending ON alerts(sent_at, id)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_digests_created ON digests(created_at)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_media_lru ON media_files(last_used)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_phash_p0 ON image_hashes(p0)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_phash_p1 ON image_hashes(p1)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_phash_p2 ON image_hashes(p2)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_phash_p3 ON image_hashes(p3)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON item_lsh(band, bucket)''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_signature_cluster ON item_signatures(cluster_id)''')
             c.execute('''CREATE INDEX IF NOT EXISTS idx_source_time ON items(source, found_at)''')
             c.execute('''CREATE INDEX IF NOT EXISTS idx_brand ON items(brand_main)''')
             c.execute('''CREATE INDEX IF NOT EXISTS idx_active ON items(is_active)''')
-            
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_brand_seen ON items(brand_main, source, is_active, last_seen)''')
+
+            # Полнотекстовый индекс по названию и бренду
+            init_fts(c)
+
             conn.commit()
             logger.info(f"✅ База данных SQLite обновлена: {DB_FILE}")
         except Exception as e:
@@ -96,6 +218,57 @@ def init_db():
             if conn:
                 conn.close()
 
+def init_fts(c):
+    """
+    Создаёт FTS5-таблицу items_fts поверх items (external content)
+    и триггеры, которые держат её в синхроне при вставке/обновлении.
+    Токенизатор trigram: японские названия идут без пробелов, и unicode61
+    сделал бы из них один длинный токен - слово внутри не нашлось бы.
+    Связь идёт по неявному rowid, поэтому после VACUUM индекс нужно
+    перестроить: INSERT INTO items_fts(items_fts) VALUES ('rebuild').
+    """
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+    row = c.fetchone()
+    if row and 'trigram' not in row[0]:
+        # Индекс со старым токенизатором - пересоздаём
+        c.execute("DROP TABLE items_fts")
+        row = None
+    exists = row is not None
+
+    for tokenize in ("trigram", "unicode61 remove_diacritics 2"):
+        try:
+            c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+                            title, brand_main,
+                            content='items', content_rowid='rowid',
+                            tokenize='{tokenize}')''')
+            break
+        except sqlite3.OperationalError as e:
+            # trigram есть с SQLite 3.34
+            logger.warning(f"⚠️ FTS5 с токенизатором {tokenize} недоступен: {e}")
+    else:
+        logger.warning("⚠️ FTS5 недоступен, поиск /find отключен")
+        return
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+                    INSERT INTO items_fts(rowid, title, brand_main)
+                    VALUES (new.rowid, new.title, new.brand_main);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+                    INSERT INTO items_fts(items_fts, rowid, title, brand_main)
+                    VALUES ('delete', old.rowid, old.title, old.brand_main);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF title, brand_main ON items BEGIN
+                    INSERT INTO items_fts(items_fts, rowid, title, brand_main)
+                    VALUES ('delete', old.rowid, old.title, old.brand_main);
+                    INSERT INTO items_fts(rowid, title, brand_main)
+                    VALUES (new.rowid, new.title, new.brand_main);
+                 END''')
+
+    if not exists:
+        # Индексируем уже накопленные товары
+        c.execute("INSERT INTO items_fts(items_fts) VALUES ('rebuild')")
+        logger.info(f"✅ Полнотекстовый индекс items_fts создан ({tokenize})")
+
 # ==================== КЛАСС DATABASE ====================
 class Database:
     """Класс-обертка для работы с БД"""
@@ -126,12 +299,45 @@ class Database:
                     conn.close()
     
     async def save_items(self, items, platform, query):
-        """Сохранение товаров"""
+        """
+        Сохранение товаров. Новые получают item['is_new'] = True,
+        почти-дубликаты уже известных - item['duplicate_of'].
+        Новые уникальные товары сопоставляются с подписками пользователей.
+        Возвращает число новых уникальных товаров.
+        """
+        count = 0
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        with span("db.save_items", platform=platform, items=len(items)) as attrs:
+            # Запись, MinHash и LSH - синхронные, в пул потоков, чтобы не стоял event loop
+            count = await loop.run_in_executor(None, in_context(self._save_batch), items)
+            attrs["new"] = count
+        DB_UPSERT_SECONDS.observe(time.perf_counter() - start)
+        DB_UPSERT_ITEMS.inc(len(items))
+        
+        if Config.IMAGE_HASH_ENABLED:
+            from image_hash import submit_items
+            await submit_items([item for item in items if item.get('is_new')])
+        if Config.SUBSCRIPTIONS_ENABLED:
+            from subscriptions import notify_new_items
+            fresh = [item for item in items if item.get('is_new') and not item.get('duplicate_of')]
+            if fresh:
+                await loop.run_in_executor(None, in_context(notify_new_items), fresh)
+        return count
+    
+    def _save_batch(self, items):
         count = 0
         for item in items:
             brand = item.get('brand', 'Unknown')
-            if add_item_with_brand(item, brand):
-                count += 1
+            if not add_item_with_brand(item, brand):
+                continue
+            item['is_new'] = True
+            if Config.DEDUP_ENABLED:
+                from dedup import assign_cluster
+                item['cluster_id'], item['duplicate_of'] = assign_cluster(item)
+                if item['duplicate_of']:
+                    continue
+            count += 1
         return count
     
     async def get_user_tasks(self, user_id, task_type=None):
@@ -178,6 +384,7 @@ class Database:
         return len(items)
 
 # ==================== РАБОТА С ТОВАРАМИ ====================
+@traced("db.add_item")
 def add_item_with_brand(item, brand_main):
     """
     Добавляет товар в базу с указанием основного бренда.
@@ -267,6 +474,675 @@ def get_items_by_brand_main(brand_main, limit=50, include_sold=False):
             if conn:
                 conn.close()
 
+def _fts_query(text, trigram=True):
+    """
+    Пользовательский ввод -> (безопасный FTS5-запрос, слова для LIKE).
+    trigram ищет подстроки от 3 символов; слова короче (指輪, sz)
+    проверяются через LIKE по найденным строкам или всей таблице.
+    """
+    words = re.findall(r"\w+", text.lower())[:10]
+    if not trigram:
+        return " ".join(f'"{w}"*' for w in words), []
+    match = " ".join(f'"{w}"' for w in words if len(w) >= 3)
+    short = [w for w in words if len(w) < 3]
+    return match, short
+
+def _fts_tokenizer(c):
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+    row = c.fetchone()
+    return row and ('trigram' if 'trigram' in row[0] else 'unicode61')
+
+def search_items(text, limit=10, include_sold=False):
+    """Полнотекстовый поиск по сохранённым товарам, лучшие совпадения первыми"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            match, short = _fts_query(text, trigram=_fts_tokenizer(c) == 'trigram')
+            if not match and not short:
+                return []
+            where = [] if include_sold else ["items.is_active = 1"]
+            params = []
+            for word in short:
+                pattern = "%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                where.append("(items.title LIKE ? ESCAPE '\\' OR items.brand_main LIKE ? ESCAPE '\\')")
+                params += [pattern, pattern]
+            if match:
+                c.execute(f'''SELECT items.* FROM items_fts
+                             JOIN items ON items.rowid = items_fts.rowid
+                             WHERE items_fts MATCH ? {"".join(" AND " + w for w in where)}
+                             ORDER BY bm25(items_fts, 1.0, 0.5), items.last_seen DESC
+                             LIMIT ?''',
+                         [match] + params + [limit])
+            else:
+                # Только короткие слова: индекс не поможет, просматриваем items
+                c.execute(f'''SELECT items.* FROM items
+                             WHERE {" AND ".join(where)}
+                             ORDER BY items.last_seen DESC
+                             LIMIT ?''',
+                         params + [limit])
+            return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка полнотекстового поиска '{text}': {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def get_tracked_brands():
+    """Бренды, по которым в базе есть активные товары"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''SELECT DISTINCT brand_main FROM items
+                        WHERE is_active = 1 AND brand_main IS NOT NULL
+                          AND brand_main != 'Unknown' ''')
+            return [row[0] for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения брендов: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def get_unseen_items(brand_main, source, since, limit=50):
+    """
+    Активные товары бренда, которые не попадались в выдаче с момента `since`.
+    Сначала отдаёт те, что дольше всего не проверялись.
+    """
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            c.execute('''SELECT id, url, last_seen, last_checked FROM items
+                        WHERE brand_main = ? AND source = ? AND is_active = 1
+                          AND last_seen < ?
+                        ORDER BY last_checked ASC
+                        LIMIT ?''',
+                     (brand_main, source, since, limit))
+            return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения непросмотренных товаров {brand_main}: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def mark_items_inactive(item_ids):
+    """Помечает товары проданными/снятыми"""
+    if not item_ids:
+        return 0
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.executemany('''UPDATE items
+                            SET is_active = 0, last_checked = CURRENT_TIMESTAMP
+                            WHERE id = ?''',
+                         [(item_id,) for item_id in item_ids])
+            conn.commit()
+            return c.rowcount
+        except Exception as e:
+            logger.error(f"❌ Ошибка пометки товаров неактивными: {e}")
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+def touch_items_checked(item_ids):
+    """Обновляет last_checked у товаров, которые подтвердили, что живы"""
+    if not item_ids:
+        return 0
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.executemany("UPDATE items SET last_checked = CURRENT_TIMESTAMP WHERE id = ?",
+                         [(item_id,) for item_id in item_ids])
+            conn.commit()
+            return c.rowcount
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления last_checked: {e}")
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+# ==================== ПОЧТИ-ДУБЛИКАТЫ ====================
+def find_lsh_candidates(band_keys, limit=200):
+    """
+    Товары, у которых совпала хотя бы одна LSH-полоса. Не больше limit,
+    первыми - совпавшие по большему числу полос (они ближе по Жаккару).
+    Возвращает список (item_id, cluster_id, signature, price, source).
+    """
+    if not band_keys:
+        return []
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            where = " OR ".join(["(l.band = ? AND l.bucket = ?)"] * len(band_keys))
+            params = [v for key in band_keys for v in key]
+            c.execute(f'''SELECT s.item_id, s.cluster_id, s.signature, s.price, s.source
+                         FROM item_lsh l
+                         JOIN item_signatures s ON s.item_id = l.item_id
+                         WHERE {where}
+                         GROUP BY s.item_id
+                         ORDER BY COUNT(*) DESC
+                         LIMIT ?''',
+                     params + [limit])
+            return c.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска LSH-кандидатов: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def save_item_signature(item_id, cluster_id, signature, price, band_keys, source=None):
+    """Сохраняет сигнатуру товара, его кластер и LSH-корзины"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''INSERT OR REPLACE INTO item_signatures (item_id, cluster_id, signature, price, source)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (item_id, cluster_id, signature, price, source))
+            c.execute("DELETE FROM item_lsh WHERE item_id = ?", (item_id,))
+            c.executemany("INSERT INTO item_lsh (band, bucket, item_id) VALUES (?, ?, ?)",
+                         [(band, bucket, item_id) for band, bucket in band_keys])
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения сигнатуры {item_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def get_cluster_items(cluster_id):
+    """Все товары одного кластера дубликатов"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            c.execute('''SELECT items.* FROM item_signatures s
+                        JOIN items ON items.id = s.item_id
+                        WHERE s.cluster_id = ?
+                        ORDER BY items.found_at''', (cluster_id,))
+            return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения кластера {cluster_id}: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def set_item_cluster(item_id, cluster_id):
+    """Переносит товар в другой кластер дубликатов"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("UPDATE item_signatures SET cluster_id = ? WHERE item_id = ?",
+                     (cluster_id, item_id))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ Ошибка смены кластера {item_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def get_item_cluster(item_id):
+    """Кластер товара или None"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("SELECT cluster_id FROM item_signatures WHERE item_id = ?", (item_id,))
+            row = c.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения кластера {item_id}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+# ==================== ХЕШИ ФОТО ====================
+def save_image_hash(item_id, dhash, phash, chunks, match_of=None):
+    """Сохраняет dHash/pHash фото товара (значения - знаковые 64-битные)"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''INSERT OR REPLACE INTO image_hashes
+                        (item_id, dhash, phash, p0, p1, p2, p3, match_of)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (item_id, dhash, phash, *chunks, match_of))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения хеша фото {item_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def find_image_hash_candidates(chunks, limit=500):
+    """
+    Товары, у которых совпал хотя бы один 16-битный кусок pHash. Не больше
+    limit, первыми - совпавшие по большему числу кусков (они ближе)
+    """
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''SELECT item_id, dhash, phash FROM image_hashes
+                        WHERE p0 = ? OR p1 = ? OR p2 = ? OR p3 = ?
+                        ORDER BY (p0 = ?) + (p1 = ?) + (p2 = ?) + (p3 = ?) DESC
+                        LIMIT ?''',
+                     (*chunks, *chunks, limit))
+            return c.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска похожих фото: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+# ==================== ПОДПИСКИ ====================
+def add_subscription(user_id, brand, keywords, platform, price_min=0, price_max=None):
+    """Сохраняет подписку, возвращает её id или None"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''INSERT INTO subscriptions
+                        (user_id, brand, keywords, platform, price_min, price_max, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (user_id, brand, keywords, platform, price_min, price_max, time.time()))
+            conn.commit()
+            return c.lastrowid
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения подписки {user_id}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def get_subscriptions(user_id=None):
+    """Подписки пользователя (или все, если user_id не задан)"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            if user_id is None:
+                c.execute("SELECT * FROM subscriptions ORDER BY id")
+            else:
+                c.execute("SELECT * FROM subscriptions WHERE user_id = ? ORDER BY id", (user_id,))
+            return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения подписок: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def delete_subscription(user_id, subscription_id):
+    """Удаляет подписку пользователя, True если она была"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("DELETE FROM subscriptions WHERE id = ? AND user_id = ?", (subscription_id, user_id))
+            conn.commit()
+            return c.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления подписки {subscription_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def get_subscriptions_version():
+    """(число подписок, последний id) - меняется при любом добавлении или удалении"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM subscriptions")
+            return c.fetchone()
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения версии подписок: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def add_alerts(rows):
+    """rows: (user_id, item_id, subscription_id). Повторы по (user_id, item_id) пропускаются"""
+    if not rows:
+        return 0
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            now = time.time()
+            c.executemany('''INSERT OR IGNORE INTO alerts (user_id, item_id, subscription_id, created_at)
+                            VALUES (?, ?, ?, ?)''',
+                         [(user_id, item_id, sub_id, now) for user_id, item_id, sub_id in rows])
+            conn.commit()
+            return c.rowcount
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи оповещений: {e}")
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+def get_pending_alerts(limit=5000):
+    """Неотправленные оповещения с данными товара и порогом срочности пользователя, старые первыми"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            c.execute('''SELECT a.id AS alert_id, a.user_id, a.subscription_id, a.created_at,
+                               i.id, i.title, i.price, i.url, i.img_url, i.source,
+                               u.priority_price
+                        FROM alerts a
+                        JOIN items i ON i.id = a.item_id
+                        LEFT JOIN users u ON u.user_id = a.user_id
+                        WHERE a.sent_at IS NULL
+                        ORDER BY a.id
+                        LIMIT ?''', (limit,))
+            return [dict(row) for row in c.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения оповещений: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+def mark_alerts_sent(alert_ids):
+    """Помечает оповещения отправленными"""
+    if not alert_ids:
+        return
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            now = time.time()
+            c.executemany("UPDATE alerts SET sent_at = ? WHERE id = ?", [(now, i) for i in alert_ids])
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка отметки оповещений: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+def set_priority_price(user_id, price):
+    """Порог срочных оповещений (None - выключить)"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''INSERT INTO users (user_id, priority_price) VALUES (?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET priority_price = excluded.priority_price''',
+                     (user_id, price))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения порога цены {user_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def get_priority_price(user_id):
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("SELECT priority_price FROM users WHERE user_id = ?", (user_id,))
+            row = c.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения порога цены {user_id}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def save_digest(user_id, items):
+    """Сохраняет товары дайджеста для листания, возвращает id"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("INSERT INTO digests (user_id, items, created_at) VALUES (?, ?, ?)",
+                     (user_id, json.dumps(items, ensure_ascii=False), time.time()))
+            conn.commit()
+            return c.lastrowid
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения дайджеста {user_id}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def get_digest(digest_id, user_id):
+    """Товары дайджеста пользователя или None"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("SELECT items FROM digests WHERE id = ? AND user_id = ?", (digest_id, user_id))
+            row = c.fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения дайджеста {digest_id}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def purge_alerts(retention):
+    """Удаляет дайджесты и отправленные оповещения старше retention секунд"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            cutoff = time.time() - retention
+            digests = c.execute("DELETE FROM digests WHERE created_at < ?", (cutoff,)).rowcount
+            alerts = c.execute("DELETE FROM alerts WHERE sent_at < ?", (cutoff,)).rowcount
+            conn.commit()
+            if digests or alerts:
+                logger.info(f"🧹 Удалено дайджестов: {digests}, отправленных оповещений: {alerts}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки оповещений: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+# ==================== ПРАВИЛА РАЗБОРА ====================
+def get_layout_rules(platform):
+    """{layout_hash: (status, selectors, updated_at)} для площадки"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''SELECT layout_hash, status, selectors, updated_at FROM layout_rules
+                        WHERE platform = ?''', (platform,))
+            return {layout: (status, json.loads(selectors or "null"), updated_at)
+                    for layout, status, selectors, updated_at in c.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения правил разбора: {e}")
+            return {}
+        finally:
+            if conn:
+                conn.close()
+
+def save_layout_rule(platform, layout_hash, status, selectors=None):
+    """Запоминает итог обучения для разметки: status 'selectors' или 'failed'"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''INSERT OR REPLACE INTO layout_rules
+                        (platform, layout_hash, status, selectors, updated_at)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (platform, layout_hash, status, json.dumps(selectors, ensure_ascii=False), time.time()))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи правил разбора: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+# ==================== КЕШ ПРЕВЬЮ ====================
+def get_media_by_url(url):
+    """(sha256, size, file_id) для URL картинки или None"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''SELECT f.sha256, f.size, f.file_id FROM media_urls u
+                        JOIN media_files f ON f.sha256 = u.sha256
+                        WHERE u.url = ?''', (url,))
+            return c.fetchone()
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кеша превью: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def save_media(url, sha256, size):
+    """Запоминает файл превью и привязывает к нему URL"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''INSERT INTO media_files (sha256, size, last_used)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(sha256) DO UPDATE SET
+                            size = excluded.size,
+                            last_used = excluded.last_used''',
+                     (sha256, size, time.time()))
+            c.execute("INSERT OR REPLACE INTO media_urls (url, sha256) VALUES (?, ?)", (url, sha256))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи кеша превью: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def touch_media(sha256, file_id=None):
+    """Обновляет время использования и, если передан, Telegram file_id"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            if file_id:
+                c.execute("UPDATE media_files SET last_used = ?, file_id = ? WHERE sha256 = ?",
+                         (time.time(), file_id, sha256))
+            else:
+                c.execute("UPDATE media_files SET last_used = ? WHERE sha256 = ?",
+                         (time.time(), sha256))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления кеша превью: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+def get_media_usage():
+    """Суммарный размер превью на диске"""
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute("SELECT COALESCE(SUM(size), 0) FROM media_files")
+            return c.fetchone()[0]
+        except Exception as e:
+            logger.error(f"❌ Ошибка подсчёта кеша превью: {e}")
+            return 0
+        finally:
+            if conn:
+                conn.close()
+
+def evict_lru_media(bytes_to_free):
+    """
+    Выбирает самые давно использованные файлы на диске общим размером
+    не меньше bytes_to_free и обнуляет их size. file_id остаётся,
+    чтобы повторная отправка не требовала загрузки. Возвращает sha256 файлов.
+    """
+    with db_lock:
+        conn = None
+        try:
+            conn = sqlite3.connect(DB_FILE)
+            c = conn.cursor()
+            c.execute('''SELECT sha256, size FROM media_files
+                        WHERE size > 0
+                        ORDER BY last_used ASC''')
+            evicted = []
+            for sha256, size in c.fetchall():
+                if bytes_to_free <= 0:
+                    break
+                evicted.append(sha256)
+                bytes_to_free -= size
+            c.executemany("UPDATE media_files SET size = 0 WHERE sha256 = ?",
+                         [(sha,) for sha in evicted])
+            conn.commit()
+            return evicted
+        except Exception as e:
+            logger.error(f"❌ Ошибка вытеснения кеша превью: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
 def get_stats():
     """Общая статистика"""
     with db_lock:
@@ -0,0 +1,121 @@
+"""
+dedup.py - Поиск почти-дубликатов объявлений (MinHash + LSH по шинглам названия)
+"""
+
+import hashlib
+import re
+import struct
+import unicodedata
+from array import array
+
+from config import Config, logger
+from database import find_lsh_candidates, save_item_signature
+from utils import parse_price
+
+# ==================== ПАРАМЕТРЫ ====================
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+
+# Заглушки парсеров вместо названия: по ним товары не сравниваем
+PLACEHOLDER_TITLES = {"", "без названия"}
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Фиксированные коэффициенты перестановок: сигнатуры должны совпадать между запусками
+_PERMS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE)
+    for i in range(NUM_PERM)
+]
+
+# ==================== СИГНАТУРЫ ====================
+def normalize_title(title):
+    """Нормализует название: NFKC, нижний регистр, без пунктуации и лишних пробелов"""
+    text = unicodedata.normalize("NFKC", title or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def shingles(title, k=SHINGLE_SIZE):
+    """Символьные k-граммы нормализованного названия (работают и для японского)"""
+    text = normalize_title(title)
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+def minhash(shingle_set):
+    """MinHash-сигнатура из NUM_PERM 32-битных значений"""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in shingle_set
+    ]
+    if not hashes:
+        return array("I", [_MAX_HASH] * NUM_PERM)
+    return array("I", [
+        min(((a * h + b) % _MERSENNE) & _MAX_HASH for h in hashes)
+        for a, b in _PERMS
+    ])
+
+def band_keys(signature):
+    """Ключи LSH: по одному (полоса, хеш) на каждую из BANDS полос"""
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        bucket = struct.unpack(">q", hashlib.blake2b(chunk, digest_size=8).digest())[0]
+        keys.append((band, bucket))
+    return keys
+
+def similarity(sig_a, sig_b):
+    """Оценка коэффициента Жаккара по двум сигнатурам"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+def _prices_close(price_a, price_b, tolerance, same_currency=True):
+    """
+    Цены совпадают с допуском; неизвестная цена не мешает склейке.
+    Цены в разных валютах (товары разных площадок) не сравниваются.
+    """
+    if price_a is None or price_b is None or tolerance is None or not same_currency:
+        return True
+    high = max(price_a, price_b)
+    return high == 0 or abs(price_a - price_b) / high <= tolerance
+
+# ==================== КЛАСТЕРЫ ====================
+def assign_cluster(item, threshold=None, price_tolerance=None):
+    """
+    Находит для товара кластер почти-дубликатов и записывает его.
+    Возвращает (cluster_id, duplicate_of): duplicate_of - id похожего
+    товара, если он нашёлся, иначе None (товар открывает новый кластер).
+    Товары без названия не кластеризуются: у них одна сигнатура на всех.
+    """
+    threshold = Config.DEDUP_THRESHOLD if threshold is None else threshold
+    price_tolerance = Config.DEDUP_PRICE_TOLERANCE if price_tolerance is None else price_tolerance
+
+    title = normalize_title(item.get('title'))
+    if title in PLACEHOLDER_TITLES:
+        return item['id'], None
+
+    signature = minhash(shingles(title))
+    keys = band_keys(signature)
+    price = parse_price(item.get('price'))
+    source = item.get('source')
+
+    best = None
+    best_score = 0.0
+    for other_id, cluster_id, other_sig, other_price, other_source in find_lsh_candidates(keys):
+        if other_id == item['id']:
+            continue
+        score = similarity(signature, array("I", other_sig))
+        if score >= threshold and score > best_score and _prices_close(
+                price, other_price, price_tolerance, same_currency=source == other_source):
+            best, best_score = (other_id, cluster_id), score
+
+    if best:
+        duplicate_of, cluster_id = best
+        logger.debug(f"🔁 {item['id']} похож на {duplicate_of} ({best_score:.2f})")
+    else:
+        duplicate_of, cluster_id = None, item['id']
+
+    save_item_signature(item['id'], cluster_id, signature.tobytes(), price, keys, source)
+    return cluster_id, duplicate_of
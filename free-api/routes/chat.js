@@ -3,19 +3,151 @@ const axios = require('axios');
 const router = express.Router();
 
 // ============================================
-// СОСТОЯНИЕ
+// НАСТРОЙКИ
 // ============================================
-let puterToken = null;
-let duckVqd = null;
-let tokenRefreshInProgress = false;
+// Хедж: если первый провайдер не прислал первый байт за HEDGE_DELAY_MS,
+// параллельно запускаем следующий; проигравший запрос отменяется
+const HEDGE_ENABLED = (process.env.HEDGE_ENABLED || 'true').toLowerCase() === 'true';
+const HEDGE_DELAY_MS = parseInt(process.env.HEDGE_DELAY_MS || '8000', 10);
+// Общий дедлайн запроса к прокси
+const REQUEST_DEADLINE_MS = parseInt(process.env.REQUEST_DEADLINE_MS || '60000', 10);
+// Сглаживание EWMA задержки и доли ошибок
+const EWMA_ALPHA = 0.2;
+// После FAILURE_THRESHOLD ошибок подряд провайдер отдыхает (удваивается до COOLDOWN_MAX_MS)
+const FAILURE_THRESHOLD = 3;
+const COOLDOWN_BASE_MS = 10000;
+const COOLDOWN_MAX_MS = 5 * 60 * 1000;
+// Повтор неудачного фонового обновления токена
+const REFRESH_RETRY_MS = 30000;
 
 // ============================================
-// PUTER - ПОЛУЧЕНИЕ ТОКЕНА
+// СТАТИСТИКА ПРОВАЙДЕРА
 // ============================================
-async function getPuterToken() {
+function createStats() {
+  return {
+    latencyMs: null,      // EWMA задержки успешных ответов
+    firstByteMs: null,    // EWMA времени до первого байта
+    errorRate: 0,         // EWMA доли ошибок
+    requests: 0,
+    failures: 0,
+    consecutiveFailures: 0,
+    cooldownUntil: 0,
+    lastError: null
+  };
+}
+
+function ewma(current, value) {
+  return current === null ? value : current + EWMA_ALPHA * (value - current);
+}
+
+function recordSuccess(provider, latencyMs) {
+  const stats = provider.stats;
+  stats.requests++;
+  stats.latencyMs = ewma(stats.latencyMs, latencyMs);
+  stats.errorRate = ewma(stats.errorRate, 0);
+  stats.consecutiveFailures = 0;
+  stats.cooldownUntil = 0;
+}
+
+function recordFailure(provider, error) {
+  const stats = provider.stats;
+  stats.requests++;
+  stats.failures++;
+  stats.errorRate = ewma(stats.errorRate, 1);
+  stats.consecutiveFailures++;
+  stats.lastError = error;
+  if (stats.consecutiveFailures >= FAILURE_THRESHOLD) {
+    const cooldown = Math.min(
+      COOLDOWN_BASE_MS * 2 ** (stats.consecutiveFailures - FAILURE_THRESHOLD),
+      COOLDOWN_MAX_MS
+    );
+    stats.cooldownUntil = Date.now() + cooldown;
+    console.log(`🧊 ${provider.name}: ${stats.consecutiveFailures} ошибок подряд, пауза ${cooldown}ms`);
+  }
+}
+
+// Вес здоровья: доля успехов / задержка. Без токена или на паузе - 0
+function healthWeight(provider) {
+  if (!provider.credential) return 0;
+  if (provider.stats.cooldownUntil > Date.now()) return 0;
+  const latency = Math.max(provider.stats.latencyMs ?? provider.expectedLatencyMs, 100);
+  return (1 - provider.stats.errorRate) / latency;
+}
+
+// ============================================
+// HTTP С ОТМЕТКОЙ ПЕРВОГО БАЙТА
+// ============================================
+// responseType 'stream': первый байт - первый кусок тела, а не заголовки
+// (их отдают сразу). При stream: true это первое SSE-событие модели
+async function postJson({ url, headers, data, timeout, signal, onFirstByte }) {
+  const response = await axios({
+    method: 'post',
+    url,
+    headers,
+    data,
+    timeout,
+    signal,
+    responseType: 'stream'
+  });
+
+  const chunks = [];
+  for await (const chunk of response.data) {
+    if (!chunks.length) onFirstByte();
+    chunks.push(chunk);
+  }
+  return { headers: response.headers, text: Buffer.concat(chunks).toString('utf8') };
+}
+
+function parseJson(text) {
   try {
+    return JSON.parse(text);
+  } catch (error) {
+    return null;
+  }
+}
+
+// Ответ duckchat приходит событиями "data: {...}" - склеиваем message
+function parseDuckText(text) {
+  const json = parseJson(text);
+  if (json) return json.message || '';
+  return text
+    .split('\n')
+    .filter(line => line.startsWith('data: ') && line !== 'data: [DONE]')
+    .map(line => parseJson(line.slice(6))?.message || '')
+    .join('');
+}
+
+// Ответ OpenAI-совместимого API при stream: true - события "data: {...}" с delta;
+// если сервер всё же ответил одним JSON, берём message из него
+function parseChatStream(text) {
+  const json = parseJson(text);
+  if (json) {
+    return { content: json.choices?.[0]?.message?.content || '', usage: json.usage };
+  }
+  let content = '';
+  let usage;
+  for (const line of text.split('\n')) {
+    if (!line.startsWith('data: ') || line === 'data: [DONE]') continue;
+    const event = parseJson(line.slice(6));
+    content += event?.choices?.[0]?.delta?.content || '';
+    usage = event?.usage || usage;
+  }
+  return { content, usage };
+}
+
+// ============================================
+// PUTER
+// ============================================
+const puter = {
+  name: 'puter',
+  credential: null,
+  expectedLatencyMs: 5000,
+  timeoutMs: parseInt(process.env.PUTER_TIMEOUT_MS || '60000', 10),
+  refreshEveryMs: 30 * 60 * 1000,
+  stats: createStats(),
+
+  async acquire() {
     console.log('🔄 Получаем Puter токен...');
-    
     const response = await axios({
       method: 'post',
       url: 'https://api.puter.com/auth/token',
@@ -28,158 +160,271 @@ async function getPuterToken() {
       },
       timeout: 10000
     });
+    return response.data?.access_token || null;
+  },
 
-    const token = response.data?.access_token;
-    if (token) {
-      console.log('✅ Puter токен получен');
-      return token;
-    }
-    return null;
-  } catch (error) {
-    console.log('⚠️ Puter token error:', error.message);
-    return null;
-  }
-}
-
-// ============================================
-// DUCKDUCKGO - ПОЛУЧЕНИЕ VQD
-// ============================================
-async function getDuckVqd() {
-  try {
-    console.log('🔄 Получаем DuckDuckGo VQD...');
-    
-    const response = await axios({
-      method: 'get',
-      url: 'https://duckduckgo.com/duckchat/v1/status',
-      headers: {
-        'x-vqd-accept': '1',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-      },
-      timeout: 10000
-    });
-    
-    const vqd = response.headers['x-vqd-4'];
-    if (vqd) {
-      console.log('✅ DuckDuckGo VQD получен');
-      return vqd;
-    }
-    return null;
-  } catch (error) {
-    console.log('⚠️ Duck VQD error:', error.message);
-    return null;
-  }
-}
-
-// ============================================
-// PUTER - ЗАПРОС К CLAUDE
-// ============================================
-async function callPuter(messages, model = 'claude3.5') {
-  if (!puterToken) return null;
-  
-  try {
+  async call(messages, model, signal, onFirstByte) {
     const modelMap = {
       'claude3.5': 'claude-3-5-sonnet',
       'claude3.7': 'claude-3-7-sonnet'
     };
-    
-    const response = await axios({
-      method: 'post',
+
+    const response = await postJson({
       url: 'https://api.puter.com/chat/completions',
       headers: {
-        'Authorization': `Bearer ${puterToken}`,
+        'Authorization': `Bearer ${this.credential}`,
         'Content-Type': 'application/json',
         'Origin': 'https://puter.com'
       },
       data: {
         model: modelMap[model] || 'claude-3-5-sonnet',
         messages: messages,
-        stream: false
+        // Потоком - иначе первый байт приходит вместе со всем ответом и хедж бесполезен
+        stream: true
       },
-      timeout: 60000
+      timeout: this.timeoutMs,
+      signal,
+      onFirstByte
     });
-    
+
+    const { content, usage } = parseChatStream(response.text);
     return {
-      content: response.data?.choices?.[0]?.message?.content || '',
-      usage: response.data?.usage || { total_tokens: 0 }
+      content,
+      usage: usage || { total_tokens: 0 }
     };
-    
-  } catch (error) {
-    console.log('⚠️ Puter API error:', error.message);
-    if (error.response?.status === 401) {
-      puterToken = null;
-    }
-    return null;
   }
-}
+};
 
 // ============================================
-// DUCKDUCKGO - ЗАПРОС К CLAUDE HAIKU
+// DUCKDUCKGO (CLAUDE HAIKU)
 // ============================================
-async function callDuck(messages, retryCount = 0) {
-  if (!duckVqd) return null;
-  
-  try {
+const duck = {
+  name: 'duckai',
+  credential: null,
+  expectedLatencyMs: 3000,
+  timeoutMs: parseInt(process.env.DUCK_TIMEOUT_MS || '30000', 10),
+  refreshEveryMs: 5 * 60 * 1000,
+  stats: createStats(),
+
+  async acquire() {
+    console.log('🔄 Получаем DuckDuckGo VQD...');
     const response = await axios({
-      method: 'post',
+      method: 'get',
+      url: 'https://duckduckgo.com/duckchat/v1/status',
+      headers: {
+        'x-vqd-accept': '1',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+      },
+      timeout: 10000
+    });
+    return response.headers['x-vqd-4'] || null;
+  },
+
+  async call(messages, model, signal, onFirstByte) {
+    const response = await postJson({
       url: 'https://duckduckgo.com/duckchat/v1/chat',
       headers: {
         'Content-Type': 'application/json',
-        'x-vqd-4': duckVqd,
+        'x-vqd-4': this.credential,
         'User-Agent': 'Mozilla/5.0'
       },
       data: {
         model: 'claude-3-haiku-20240307',
         messages: messages
       },
-      timeout: 30000
+      timeout: this.timeoutMs,
+      signal,
+      onFirstByte
     });
-    
+
+    // VQD меняется с каждым ответом
     if (response.headers['x-vqd-4']) {
-      duckVqd = response.headers['x-vqd-4'];
+      this.credential = response.headers['x-vqd-4'];
     }
-    
+
     return {
-      content: response.data?.message || '',
+      content: parseDuckText(response.text),
       usage: { total_tokens: 0 }
     };
-  } catch (error) {
-    if (error.response?.status === 401 && retryCount < 2) {
-      duckVqd = await getDuckVqd();
-      if (duckVqd) {
-        return callDuck(messages, retryCount + 1);
+  }
+};
+
+const providers = [puter, duck];
+
+// ============================================
+// ФОНОВОЕ ОБНОВЛЕНИЕ ТОКЕНОВ
+// ============================================
+// Запросы никогда не ждут получения токена: без токена провайдер просто
+// получает вес 0, а обновление идёт в фоне по расписанию или по 401
+async function refreshCredential(provider) {
+  if (provider.refreshing) return provider.refreshing;
+
+  provider.refreshing = (async () => {
+    clearTimeout(provider.refreshTimer);
+    let nextRefreshMs = provider.refreshEveryMs;
+    try {
+      const credential = await provider.acquire();
+      if (credential) {
+        provider.credential = credential;
+        console.log(`✅ ${provider.name}: токен получен`);
+      } else {
+        nextRefreshMs = REFRESH_RETRY_MS;
       }
+    } catch (error) {
+      console.log(`⚠️ ${provider.name}: ошибка получения токена:`, error.message);
+      nextRefreshMs = REFRESH_RETRY_MS;
+    } finally {
+      provider.refreshing = null;
+      provider.refreshTimer = setTimeout(() => refreshCredential(provider), nextRefreshMs);
+      provider.refreshTimer.unref();
+    }
+  })();
+  return provider.refreshing;
+}
+
+// ============================================
+// ВЫЗОВ ПРОВАЙДЕРА СО СТАТИСТИКОЙ
+// ============================================
+async function invoke(provider, messages, model, signal, onFirstByte) {
+  const startTime = Date.now();
+  try {
+    const result = await provider.call(messages, model, signal, () => {
+      provider.stats.firstByteMs = ewma(provider.stats.firstByteMs, Date.now() - startTime);
+      onFirstByte();
+    });
+    if (!result?.content) {
+      throw new Error('пустой ответ');
+    }
+    recordSuccess(provider, Date.now() - startTime);
+    return result;
+  } catch (error) {
+    // Проигравший в гонке запрос отменён нами - это не ошибка провайдера
+    if (axios.isCancel(error) || signal.aborted) {
+      return null;
+    }
+    console.log(`⚠️ ${provider.name} API error:`, error.message);
+    recordFailure(provider, error.message);
+    if (error.response?.status === 401 || error.response?.status === 418) {
+      provider.credential = null;
+      refreshCredential(provider);
     }
     return null;
   }
 }
 
+// Порядок: по убыванию веса здоровья; первым ставим случайно, пропорционально
+// весу, чтобы статистика медленного провайдера тоже обновлялась
+function rankProviders() {
+  const healthy = providers
+    .map(provider => ({ provider, weight: healthWeight(provider) }))
+    .filter(entry => entry.weight > 0)
+    .sort((a, b) => b.weight - a.weight);
+
+  if (healthy.length > 1) {
+    const total = healthy.reduce((sum, entry) => sum + entry.weight, 0);
+    let pick = Math.random() * total;
+    const index = healthy.findIndex(entry => (pick -= entry.weight) <= 0);
+    if (index > 0) {
+      healthy.unshift(...healthy.splice(index, 1));
+    }
+  }
+
+  // Все на паузе - пробуем тех, у кого есть токен, лишь бы не отказывать сразу
+  if (!healthy.length) {
+    return providers
+      .filter(provider => provider.credential)
+      .sort((a, b) => a.stats.cooldownUntil - b.stats.cooldownUntil);
+  }
+  return healthy.map(entry => entry.provider);
+}
+
 // ============================================
-// ПЕРИОДИЧЕСКОЕ ОБНОВЛЕНИЕ
+// ГОНКА ПРОВАЙДЕРОВ
 // ============================================
-setInterval(async () => {
-  puterToken = await getPuterToken();
-}, 30 * 60 * 1000);
+// Следующий провайдер стартует, когда текущий упал или (с хеджем) не прислал
+// первый байт за HEDGE_DELAY_MS. Побеждает первый непустой ответ, остальные отменяются
+function routeRequest(messages, model) {
+  const queue = rankProviders();
+
+  return new Promise(resolve => {
+    const inFlight = new Set();
+    let finished = false;
+
+    const finish = (result) => {
+      if (finished) return;
+      finished = true;
+      clearTimeout(deadline);
+      for (const attempt of inFlight) {
+        clearTimeout(attempt.hedgeTimer);
+        attempt.controller.abort();
+      }
+      resolve(result);
+    };
+
+    const deadline = setTimeout(() => {
+      console.log(`⏱️ Дедлайн ${REQUEST_DEADLINE_MS}ms истёк`);
+      finish(null);
+    }, REQUEST_DEADLINE_MS);
+
+    const launchNext = () => {
+      if (finished) return;
+      const provider = queue.shift();
+      if (!provider) {
+        if (!inFlight.size) finish(null);
+        return;
+      }
+
+      const attempt = { controller: new AbortController(), hedgeTimer: null };
+      inFlight.add(attempt);
+
+      if (HEDGE_ENABLED && queue.length) {
+        attempt.hedgeTimer = setTimeout(() => {
+          console.log(`🏁 ${provider.name}: нет первого байта за ${HEDGE_DELAY_MS}ms, хеджируем`);
+          launchNext();
+        }, HEDGE_DELAY_MS);
+      }
+
+      const onFirstByte = () => clearTimeout(attempt.hedgeTimer);
 
-setInterval(async () => {
-  duckVqd = await getDuckVqd();
-}, 5 * 60 * 1000);
+      invoke(provider, messages, model, attempt.controller.signal, onFirstByte).then(result => {
+        clearTimeout(attempt.hedgeTimer);
+        inFlight.delete(attempt);
+        if (result) {
+          finish({ ...result, provider: provider.name });
+        } else {
+          launchNext();
+        }
+      });
+    };
+
+    launchNext();
+  });
+}
 
 // Инициализация при старте
-(async () => {
-  puterToken = await getPuterToken();
-  duckVqd = await getDuckVqd();
-})();
+for (const provider of providers) {
+  refreshCredential(provider);
+}
 
 // ============================================
 // HEALTH CHECK
 // ============================================
 router.get('/health', (req, res) => {
+  const now = Date.now();
   res.json({
     status: 'ok',
-    providers: {
-      puter: puterToken ? '✅' : '❌',
-      duckai: duckVqd ? '✅' : '❌'
-    },
+    providers: Object.fromEntries(providers.map(provider => [provider.name, {
+      status: provider.credential ? '✅' : '❌',
+      weight: Number((healthWeight(provider) * 1000).toFixed(3)),
+      latency_ms: provider.stats.latencyMs === null ? null : Math.round(provider.stats.latencyMs),
+      first_byte_ms: provider.stats.firstByteMs === null ? null : Math.round(provider.stats.firstByteMs),
+      error_rate: Number(provider.stats.errorRate.toFixed(3)),
+      requests: provider.stats.requests,
+      failures: provider.stats.failures,
+      cooldown_ms: Math.max(provider.stats.cooldownUntil - now, 0),
+      last_error: provider.stats.lastError
+    }])),
+    hedge: HEDGE_ENABLED ? HEDGE_DELAY_MS : null,
     timestamp: new Date().toISOString(),
     uptime: process.uptime()
   });
@@ -204,36 +449,22 @@ router.get('/v1/models', (req, res) => {
 // ============================================
 router.post('/v1/chat/completions', async (req, res) => {
   const startTime = Date.now();
-  
+
   try {
     const { model = 'claude3.5', messages = [] } = req.body;
-    
+
     console.log(`\n📨 [${new Date().toISOString()}] Запрос к Claude`);
-    
+
     if (!messages.length) {
       return res.status(400).json({ error: 'No messages provided' });
     }
-    
-    // Пробуем провайдеров
-    let result = null;
-    let provider = null;
-    
-    // 1. Puter
-    result = await callPuter(messages, model);
-    provider = 'puter';
-    
-    // 2. Если Puter не сработал - DuckDuckGo
-    if (!result?.content) {
-      console.log('⚠️ Puter не ответил, пробуем DuckDuckGo...');
-      result = await callDuck(messages);
-      provider = 'duckai';
-    }
-    
+
+    const result = await routeRequest(messages, model);
     const duration = Date.now() - startTime;
-    
+
     if (result?.content) {
-      console.log(`✅ Успех (${provider}) за ${duration}ms`);
-      
+      console.log(`✅ Успех (${result.provider}) за ${duration}ms`);
+
       return res.json({
         id: `chatcmpl-${Date.now()}`,
         object: 'chat.completion',
@@ -248,11 +479,11 @@ router.post('/v1/chat/completions', async (req, res) => {
           finish_reason: 'stop'
         }],
         usage: result.usage || { total_tokens: 0 },
-        provider: provider
+        provider: result.provider
       });
     } else {
       console.log(`❌ Все провайдеры недоступны за ${duration}ms`);
-      
+
       return res.json({
         choices: [{
           message: {
@@ -261,7 +492,7 @@ router.post('/v1/chat/completions', async (req, res) => {
         }]
       });
     }
-    
+
   } catch (error) {
     console.error('❌ Ошибка:', error.message);
     res.json({
@@ -274,4 +505,4 @@ router.post('/v1/chat/completions', async (req, res) => {
   }
 });
 
-module.exports = router;
\ No newline at end of file
+module.exports = router;
@@ -0,0 +1,174 @@
+"""
+fsm_storage.py - Хранилище состояний FSM aiogram в SQLite (переживает перезапуски бота)
+"""
+
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+import database
+from config import Config, logger
+
+CLEANUP_INTERVAL = 600
+
+class SQLiteStorage(BaseStorage):
+    """
+    Состояния и данные диалогов хранятся в таблице fsm_storage.
+    set_state и set_data пишут каждый только свою колонку, поэтому
+    параллельные записи из разных процессов друг друга не затирают.
+    Чтения может обслуживать LRU-кеш процесса (cache_ttl > 0) - только
+    если бот работает одним процессом: кеш сбрасывается лишь своими
+    записями. Брошенные диалоги старше dialog_ttl считаются пустыми
+    и периодически удаляются.
+    """
+
+    def __init__(self, db_file=None, dialog_ttl=None, cache_size=None, cache_ttl=None):
+        self.db_file = db_file or database.DB_FILE
+        self.dialog_ttl = dialog_ttl or Config.FSM_DIALOG_TTL
+        self.cache_size = cache_size or Config.FSM_CACHE_SIZE
+        self.cache_ttl = Config.FSM_CACHE_TTL if cache_ttl is None else cache_ttl
+        self._cache = OrderedDict()
+        self._last_cleanup = 0
+        self._init_table()
+
+    # ==================== SQLITE ====================
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=10)
+
+    def _init_table(self):
+        with database.db_lock:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.execute('''CREATE TABLE IF NOT EXISTS fsm_storage
+                               (key TEXT PRIMARY KEY,
+                                state TEXT,
+                                data TEXT,
+                                updated_at REAL)''')
+                conn.execute('''CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_storage(updated_at)''')
+                conn.commit()
+            except Exception as e:
+                logger.error(f"❌ Ошибка создания таблицы FSM: {e}")
+            finally:
+                if conn:
+                    conn.close()
+
+    def _load(self, key):
+        with database.db_lock:
+            conn = None
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT state, data, updated_at FROM fsm_storage WHERE key = ?",
+                                   (key,)).fetchone()
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения FSM {key}: {e}")
+                row = None
+            finally:
+                if conn:
+                    conn.close()
+
+        if not row or row[2] < time.time() - self.dialog_ttl:
+            return None, {}
+        return row[0], json.loads(row[1] or "{}")
+
+    def _save(self, key, column, value):
+        """Пишет одну колонку (state или data); вторая сохраняется, если диалог не истёк"""
+        other = "data" if column == "state" else "state"
+        empty = "'{}'" if other == "data" else "NULL"
+        now = time.time()
+        with database.db_lock:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.execute(f'''INSERT INTO fsm_storage (key, {column}, {other}, updated_at)
+                                VALUES (?, ?, {empty}, ?)
+                                ON CONFLICT(key) DO UPDATE SET
+                                    {column} = excluded.{column},
+                                    {other} = CASE WHEN fsm_storage.updated_at < ?
+                                                   THEN {empty} ELSE fsm_storage.{other} END,
+                                    updated_at = excluded.updated_at''',
+                             (key, value, now, now - self.dialog_ttl))
+                # Пустой диалог не храним
+                conn.execute('''DELETE FROM fsm_storage
+                               WHERE key = ? AND state IS NULL AND (data IS NULL OR data = '{}')''',
+                             (key,))
+                conn.commit()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи FSM {key}: {e}")
+            finally:
+                if conn:
+                    conn.close()
+        self._maybe_cleanup()
+
+    def _maybe_cleanup(self):
+        """Удаляет брошенные диалоги не чаще раза в CLEANUP_INTERVAL"""
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        with database.db_lock:
+            conn = None
+            try:
+                conn = self._connect()
+                deleted = conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?",
+                                       (now - self.dialog_ttl,)).rowcount
+                conn.commit()
+                if deleted:
+                    logger.info(f"🧹 Удалено брошенных диалогов: {deleted}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки FSM: {e}")
+            finally:
+                if conn:
+                    conn.close()
+
+    # ==================== КЕШ ====================
+    @staticmethod
+    def _key(key):
+        parts = [key.bot_id, key.chat_id, key.user_id,
+                 key.thread_id or "", getattr(key, "business_connection_id", None) or "",
+                 key.destiny]
+        return ":".join(str(p) for p in parts)
+
+    def _get(self, key):
+        skey = self._key(key)
+        cached = self._cache.get(skey)
+        if cached and time.monotonic() - cached[2] < self.cache_ttl:
+            self._cache.move_to_end(skey)
+            return cached[0], cached[1]
+        state, data = self._load(skey)
+        if self.cache_ttl > 0:
+            self._remember(skey, state, data)
+        return state, data
+
+    def _remember(self, skey, state, data):
+        self._cache[skey] = (state, data, time.monotonic())
+        self._cache.move_to_end(skey)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _put(self, key, column, value):
+        skey = self._key(key)
+        # Вторую половину строки мог поменять другой процесс - кеш не достраиваем
+        self._cache.pop(skey, None)
+        self._save(skey, column, value)
+
+    # ==================== BaseStorage ====================
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        self._put(key, "state", state)
+
+    async def get_state(self, key):
+        return self._get(key)[0]
+
+    async def set_data(self, key, data):
+        self._put(key, "data", json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key):
+        return dict(self._get(key)[1])
+
+    async def close(self):
+        self._cache.clear()
@@ -0,0 +1,210 @@
+"""
+image_hash.py - Перцептивные хеши фото товаров (dHash/pHash) для поиска перевыставленных объявлений
+"""
+
+import asyncio
+import io
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from config import Config, logger
+from database import (
+    find_image_hash_candidates,
+    get_item_cluster,
+    save_image_hash,
+    set_item_cluster,
+)
+from utils import get_next_user_agent
+
+MAX_IMAGE_BYTES = 2 * 1024 * 1024
+
+# Косинусы для DCT 32 -> 8 (считаются один раз на процесс)
+_DCT = [[math.cos(math.pi * (2 * x + 1) * u / 64) for x in range(32)] for u in range(8)]
+
+# ==================== ХЕШИ (выполняются в пуле процессов) ====================
+def _dhash(img):
+    """Разностный хеш: 9x8, бит = левый пиксель светлее правого"""
+    px = list(img.resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+def _phash(img):
+    """DCT-хеш: 32x32, низкочастотный блок 8x8 сравнивается с медианой"""
+    px = list(img.resize((32, 32)).getdata())
+    # DCT по строкам: 32 строки -> по 8 коэффициентов
+    rows = [[sum(c * v for c, v in zip(_DCT[u], px[y * 32:(y + 1) * 32])) for u in range(8)]
+            for y in range(32)]
+    # DCT по столбцам для первых 8 коэффициентов
+    coeffs = [sum(_DCT[v][y] * rows[y][u] for y in range(32)) for v in range(8) for u in range(8)]
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    bits = 0
+    for c in coeffs:
+        bits = (bits << 1) | (c > median)
+    return bits
+
+def compute_hashes(data):
+    """Байты картинки -> (dhash, phash) как беззнаковые 64-битные числа"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        # Для JPEG декодируем сразу в уменьшенном масштабе
+        img.draft("L", (64, 64))
+        gray = img.convert("L")
+        return _dhash(gray), _phash(gray)
+
+# ==================== ПОИСК ====================
+def hamming(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+def to_signed(h):
+    """SQLite хранит только знаковые 64-битные числа"""
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+def to_unsigned(h):
+    return h + (1 << 64) if h < 0 else h
+
+# Индекс по кускам pHash (колонки p0..p3 в image_hashes)
+CHUNKS = 4
+# Принцип Дирихле: при расстоянии < CHUNKS хотя бы один кусок совпадёт точно.
+# Для большего расстояния индекс пропускает совпадения - такой порог не принимаем
+MAX_DISTANCE = CHUNKS - 1
+CANDIDATE_LIMIT = 500
+
+if not 0 <= Config.IMAGE_HASH_DISTANCE <= MAX_DISTANCE:
+    logger.warning(f"⚠️ IMAGE_HASH_DISTANCE={Config.IMAGE_HASH_DISTANCE} вне 0..{MAX_DISTANCE}: "
+                   f"индекс по {CHUNKS} кускам гарантирует находки только до {MAX_DISTANCE}, "
+                   f"используется {min(max(Config.IMAGE_HASH_DISTANCE, 0), MAX_DISTANCE)}")
+
+def split_chunks(h):
+    """CHUNKS 16-битных кусков: при расстоянии <= MAX_DISTANCE хотя бы один совпадёт точно"""
+    return [(h >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+def find_similar(phash, max_distance=None, exclude=None):
+    """
+    Похожие фото по pHash: [(item_id, расстояние)], ближайшие первыми.
+    Порог не больше MAX_DISTANCE. Кандидатов берём не больше CANDIDATE_LIMIT
+    (сначала совпавшие по большему числу кусков): у очень частых кусков
+    (однотонные фото) часть дальних кандидатов может не попасть в проверку.
+    """
+    max_distance = Config.IMAGE_HASH_DISTANCE if max_distance is None else max_distance
+    max_distance = min(max(max_distance, 0), MAX_DISTANCE)
+    candidates = find_image_hash_candidates(split_chunks(phash), CANDIDATE_LIMIT)
+    if len(candidates) >= CANDIDATE_LIMIT:
+        logger.debug(f"Похожие фото: кандидатов больше {CANDIDATE_LIMIT}, часть не проверена")
+    matches = []
+    for item_id, _, other in candidates:
+        if item_id == exclude:
+            continue
+        distance = hamming(phash, to_unsigned(other))
+        if distance <= max_distance:
+            matches.append((item_id, distance))
+    return sorted(matches, key=lambda m: m[1])
+
+# ==================== КОНВЕЙЕР ====================
+class ImageHashPipeline:
+    """
+    Фоновый конвейер: ограниченный пул загрузчиков качает превью,
+    хеширование уходит в пул процессов, результат пишется в БД.
+    """
+
+    def __init__(self, download_workers=None, processes=None, queue_size=500):
+        self.download_workers = download_workers or Config.IMAGE_DOWNLOAD_WORKERS
+        self.processes = processes or Config.IMAGE_HASH_PROCESSES
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = None
+        self.session = None
+        self.workers = []
+
+    async def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.processes)
+        timeout = aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
+        self.session = aiohttp.ClientSession(timeout=timeout)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.download_workers)]
+        logger.info(f"✅ Хеширование фото: {self.download_workers} загрузчиков, {self.processes} процессов")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        if self.session:
+            await self.session.close()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, items):
+        """Ставит товары с фото в очередь; при переполнении лишние отбрасываются"""
+        for item in items:
+            if not item.get('img_url') or not item.get('id'):
+                continue
+            try:
+                self.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                logger.debug("Очередь хеширования фото переполнена")
+                return
+
+    async def _download(self, url):
+        import media_cache
+        if media_cache.cache:
+            # Общий кеш превью: фото скачивается один раз и для хешей, и для отправки
+            _, data = await media_cache.cache.get(url)
+            return data
+        headers = {"User-Agent": get_next_user_agent()}
+        async with self.session.get(url, headers=headers) as r:
+            if r.status != 200:
+                return None
+            data = await r.content.read(MAX_IMAGE_BYTES + 1)
+            return data if len(data) <= MAX_IMAGE_BYTES else None
+
+    async def process(self, item):
+        """Скачивает фото, считает хеши, ищет совпадения. Возвращает id похожего товара или None"""
+        data = await self._download(item['img_url'])
+        if not data:
+            return None
+
+        loop = asyncio.get_running_loop()
+        dhash, phash = await loop.run_in_executor(self.executor, compute_hashes, data)
+
+        matches = find_similar(phash, exclude=item['id'])
+        match_of = matches[0][0] if matches else None
+        save_image_hash(item['id'], to_signed(dhash), to_signed(phash), split_chunks(phash), match_of)
+
+        if match_of:
+            cluster_id = get_item_cluster(match_of) or match_of
+            set_item_cluster(item['id'], cluster_id)
+            logger.info(f"📸 Перевыставлено? {item['id']} ~ {match_of} (расстояние {matches[0][1]})")
+        return match_of
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.process(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Ошибка хеширования фото {item.get('id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+# Общий экземпляр процесса (создаётся в setup_bot или в воркере)
+pipeline = None
+
+async def submit_items(items):
+    """
+    Передаёт новые товары в конвейер, если он запущен. У бота при воркерах
+    (PARSE_WORKERS > 0) конвейера нет - его товары уходят воркерам задачей 'image_hash'
+    """
+    if pipeline:
+        pipeline.submit(items)
+    elif Config.PARSE_WORKERS > 0:
+        photos = [{'id': item['id'], 'img_url': item['img_url']}
+                  for item in items if item.get('id') and item.get('img_url')]
+        if photos:
+            import job_queue
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, job_queue.enqueue, "image_hash", {"items": photos})
@@ -0,0 +1,223 @@
+"""
+job_queue.py - Очередь задач парсинга в SQLite с арендой (lease) для нескольких воркер-процессов
+
+Аренда принадлежит паре (worker, attempt): воркер, чью просроченную задачу
+уже забрал другой, не может ни продлить её, ни записать свой результат.
+Задачи, которых бот перестал ждать, помечаются 'cancelled'.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+
+import database
+from config import Config, logger
+
+MAX_ATTEMPTS = 3
+
+def _connect():
+    # Несколько процессов пишут в один файл - ждём блокировку, а не падаем
+    return sqlite3.connect(database.DB_FILE, timeout=30, isolation_level=None)
+
+def enqueue(kind, payload):
+    """Ставит задачу в очередь, возвращает её id"""
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            now = time.time()
+            cur = conn.execute('''INSERT INTO jobs (kind, payload, status, created_at, updated_at)
+                                 VALUES (?, ?, 'queued', ?, ?)''',
+                              (kind, json.dumps(payload, ensure_ascii=False), now, now))
+            return cur.lastrowid
+        finally:
+            if conn:
+                conn.close()
+
+def claim(worker_id, lease_seconds=None):
+    """
+    Атомарно забирает следующую задачу: новую или ту, чья аренда истекла
+    (воркер упал). Возвращает dict задачи или None.
+    """
+    lease_seconds = lease_seconds or Config.JOB_LEASE_SECONDS
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            conn.row_factory = sqlite3.Row
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute('''SELECT * FROM jobs
+                                 WHERE status = 'queued'
+                                    OR (status = 'running' AND lease_until < ?)
+                                 ORDER BY id
+                                 LIMIT 1''', (now,)).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return None
+
+            if row['attempts'] >= MAX_ATTEMPTS:
+                conn.execute('''UPDATE jobs SET status = 'failed', error = ?, updated_at = ?
+                               WHERE id = ?''',
+                            (row['error'] or "превышено число попыток", now, row['id']))
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute('''UPDATE jobs
+                           SET status = 'running', attempts = attempts + 1,
+                               worker = ?, lease_until = ?, updated_at = ?
+                           WHERE id = ?''',
+                        (worker_id, now + lease_seconds, now, row['id']))
+            conn.execute("COMMIT")
+
+            job = dict(row)
+            job['payload'] = json.loads(job['payload'] or "{}")
+            # Номер этой попытки - токен аренды для heartbeat/finish
+            job['attempt'] = row['attempts'] + 1
+            return job
+        except Exception as e:
+            if conn and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"❌ Ошибка получения задачи из очереди: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def heartbeat(job_id, worker_id, attempt, progress=None, lease_seconds=None):
+    """
+    Продлевает аренду задачи и, если передан, сохраняет прогресс.
+    Возвращает False, если аренда потеряна (задачу забрали или отменили).
+    """
+    lease_seconds = lease_seconds or Config.JOB_LEASE_SECONDS
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            now = time.time()
+            if progress is not None:
+                cur = conn.execute('''UPDATE jobs SET lease_until = ?, progress = ?, updated_at = ?
+                                     WHERE id = ? AND worker = ? AND attempts = ? AND status = 'running' ''',
+                                  (now + lease_seconds, json.dumps(progress), now, job_id, worker_id, attempt))
+            else:
+                cur = conn.execute('''UPDATE jobs SET lease_until = ?, updated_at = ?
+                                     WHERE id = ? AND worker = ? AND attempts = ? AND status = 'running' ''',
+                                  (now + lease_seconds, now, job_id, worker_id, attempt))
+            return cur.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ Ошибка продления задачи {job_id}: {e}")
+            return True
+        finally:
+            if conn:
+                conn.close()
+
+def finish(job_id, worker_id, attempt, result=None, error=None):
+    """
+    Завершает задачу: done с результатом или failed с ошибкой. Только если
+    аренда всё ещё у этой попытки; иначе результат отбрасывается (False).
+    """
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            cur = conn.execute('''UPDATE jobs
+                                 SET status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ?
+                                 WHERE id = ? AND worker = ? AND attempts = ? AND status = 'running' ''',
+                              ('failed' if error else 'done',
+                               json.dumps(result, ensure_ascii=False) if result is not None else None,
+                               error, time.time(), job_id, worker_id, attempt))
+            if cur.rowcount == 0:
+                logger.warning(f"⚠️ Задача {job_id}: аренда попытки {attempt} потеряна, результат отброшен")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка завершения задачи {job_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def cancel(job_id, reason="отменена"):
+    """Отменяет задачу, которую ещё не завершили (её больше никто не ждёт)"""
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            cur = conn.execute('''UPDATE jobs SET status = 'cancelled', error = ?, lease_until = NULL, updated_at = ?
+                                 WHERE id = ? AND status IN ('queued', 'running')''',
+                              (reason, time.time(), job_id))
+            return cur.rowcount > 0
+        except Exception as e:
+            logger.error(f"❌ Ошибка отмены задачи {job_id}: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def get_job(job_id):
+    """Текущее состояние задачи"""
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return None
+            job = dict(row)
+            for field in ('payload', 'progress', 'result'):
+                job[field] = json.loads(job[field]) if job[field] else None
+            return job
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения задачи {job_id}: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+def queue_depth():
+    """Сколько задач ждёт и выполняется"""
+    with database.db_lock:
+        conn = None
+        try:
+            conn = _connect()
+            rows = conn.execute('''SELECT status, COUNT(*) FROM jobs
+                                  WHERE status IN ('queued', 'running')
+                                  GROUP BY status''').fetchall()
+            return dict(rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка подсчёта очереди: {e}")
+            return {}
+        finally:
+            if conn:
+                conn.close()
+
+async def wait_for_job(job_id, on_progress=None, poll_interval=0.5, timeout=None):
+    """
+    Ждёт завершения задачи, передавая прогресс в on_progress(progress).
+    Возвращает итоговую запись задачи (или None по таймауту). Задачу, которую
+    перестали ждать (таймаут, отмена), отменяет - чтобы воркеры её не делали.
+    """
+    timeout = timeout or Config.JOB_TIMEOUT
+    deadline = time.monotonic() + timeout
+    last_progress = None
+
+    try:
+        while time.monotonic() < deadline:
+            job = get_job(job_id)
+            if job and job['progress'] and job['progress'] != last_progress and on_progress:
+                last_progress = job['progress']
+                await on_progress(last_progress)
+            if job and job['status'] in ('done', 'failed', 'cancelled'):
+                return job
+            await asyncio.sleep(poll_interval)
+    except asyncio.CancelledError:
+        cancel(job_id, "ожидание прервано")
+        raise
+    if cancel(job_id, "истекло время ожидания"):
+        logger.warning(f"⚠️ Задача {job_id} отменена: не выполнена за {timeout:.0f}с")
+        return None
+    # Успела завершиться между последним опросом и отменой
+    job = get_job(job_id)
+    return job if job and job['status'] in ('done', 'failed') else None
@@ -0,0 +1,215 @@
+"""
+json_extract.py - Извлечение JSON из свободного текста ответа LLM
+
+Один проход по тексту: регулярка прыгает только по структурным символам
+([ ] { } " \\ и перевод строки), стек скобок собирает дерево кандидатов.
+Внешнюю скобку сначала пробуем разобрать целиком (raw_decode на C) - для
+корректного JSON на этом всё. Иначе кандидаты сверху вниз отдаются json.loads:
+если фрагмент не JSON (проза в скобках, обрезанный ответ), пробуем вложенные -
+так из обрезанного массива спасаются все целые объекты. Вложенные, которые
+содержат позицию ошибки родителя, заново не разбираются, а глубже MAX_DEPTH
+под неудачным корнем не спускаемся (иначе вложенный мусор квадратичен).
+Если внутри неудачного фрагмента были кавычки, он сканируется заново после
+открывающей скобки - непарная кавычка в прозе не прячет следующий JSON.
+"""
+
+import json
+import re
+
+# Структурные символы вне строки / внутри строки
+_OUTSIDE = re.compile(r'[\[\]{}"\n]')
+_INSIDE = re.compile(r'["\\\n]')
+_CLOSE = {"]": "[", "}": "{"}
+# Что может идти после открывающей скобки в JSON. Проза в скобках отсеивается
+# без raw_decode: JSONDecodeError считает строки от начала текста, O(позиции)
+_FIRST = {"{": re.compile(r'\s*["}]'), "[": re.compile(r'\s*[\[{"\-\d\]tfn]')}
+_SPACE = re.compile(r'\s*')
+
+_decoder = json.JSONDecoder()
+_UNPARSED = object()
+_RESCAN = object()
+
+# Глубже товары не ищем (защита от патологической вложенности)
+MAX_DEPTH = 20
+# Повторные проходы после сбитых кавычек: не больше RESCAN_FACTOR длин текста
+RESCAN_FACTOR = 4
+
+class _Node:
+    """
+    Скобочный фрагмент: end = None у незакрытых (обрезанный ответ, сбой разметки),
+    stop - где сканер его закрыл или бросил, value - разобранное значение или
+    _UNPARSED, error - позиция ошибки разбора (дети, содержащие её, тоже невалидны),
+    quoted - внутри были строки, то есть кавычка из прозы могла сбить разметку,
+    depth - вложенность относительно корня (глубже MAX_DEPTH не спускаемся).
+    """
+    __slots__ = ("start", "end", "stop", "children", "value", "error", "quoted", "depth")
+
+    def __init__(self, start, end=None, value=_UNPARSED, error=None):
+        self.start = start
+        self.end = end
+        self.stop = end
+        self.children = []
+        self.value = value
+        self.error = error
+        self.quoted = False
+        self.depth = 0
+
+def _scan(text, pos=0):
+    """Дерево скобочных фрагментов text[pos:] (список корней)"""
+    roots = []
+    stack = []
+    in_string = False
+    length = len(text)
+
+    def abandon():
+        # Открытые фрагменты уже не станут валидными
+        for node in stack:
+            node.stop = pos
+        stack.clear()
+
+    while pos < length:
+        match = (_INSIDE if in_string else _OUTSIDE).search(text, pos)
+        if not match:
+            break
+        char = match.group()
+        pos = match.end()
+
+        if in_string:
+            if char == '"':
+                in_string = False
+            elif char == "\\":
+                pos += 1  # экранированный символ
+            else:
+                # Перевод строки в JSON-строке невозможен - разметка сбилась
+                in_string = False
+                abandon()
+            continue
+
+        if char == '"':
+            # Кавычки в прозе вне скобок нас не интересуют
+            in_string = bool(stack)
+            if stack:
+                stack[0].quoted = True
+        elif char in "[{":
+            start = match.start()
+            error = None
+            if not _FIRST[char].match(text, pos):
+                error = _SPACE.match(text, pos).end()
+            elif not stack:
+                # Быстрый путь: внешний фрагмент - целиком корректный JSON
+                try:
+                    value, end = _decoder.raw_decode(text, start)
+                    roots.append(_Node(start, end, value))
+                    pos = end
+                    continue
+                except json.JSONDecodeError as e:
+                    error = e.pos
+                except (ValueError, RecursionError):
+                    pass
+            node = _Node(start, error=error)
+            (stack[-1].children if stack else roots).append(node)
+            stack.append(node)
+        elif char in "]}":
+            if stack and text[stack[-1].start] == _CLOSE[char]:
+                node = stack.pop()
+                node.end = node.stop = pos
+            else:
+                abandon()
+
+    pos = length
+    abandon()
+    return roots
+
+def iter_json_values(text):
+    """Все корректные JSON-массивы и объекты в тексте (самые внешние из валидных)"""
+    if not text:
+        return
+    budget = len(text) * RESCAN_FACTOR
+    produced = 0
+    # Узлы и отметки (_RESCAN, узел, produced): проверить, дали ли что-то вложенные
+    pending = list(reversed(_scan(text)))
+    while pending:
+        node = pending.pop()
+        if isinstance(node, tuple):
+            _, node, before = node
+            # Кавычка из прозы ("x] ...) могла проглотить соседний JSON как строку:
+            # ничего не нашли - сканируем заново сразу после открывающей скобки
+            if produced == before and node.stop - node.start <= budget:
+                budget -= node.stop - node.start
+                pending.extend(reversed(_scan(text[:node.stop], node.start + 1)))
+            continue
+        if node.value is not _UNPARSED:
+            produced += 1
+            yield node.value
+            continue
+        error = node.error
+        if node.end is not None and (error is None or error >= node.end):
+            try:
+                # raw_decode с позиции, без копии фрагмента
+                value, end = _decoder.raw_decode(text, node.start)
+                if end == node.end:
+                    produced += 1
+                    yield value
+                    continue
+                error = min(end, node.end)
+            except json.JSONDecodeError as e:
+                error = e.pos
+            except (ValueError, RecursionError):
+                pass
+        if node.quoted:
+            pending.append((_RESCAN, node, produced))
+        if node.depth >= MAX_DEPTH:
+            continue
+        # Невалидный или незакрытый фрагмент - пробуем вложенные. Вложенный,
+        # внутри которого ошибка родителя, разбирается так же и падает там же
+        for child in node.children:
+            child.depth = node.depth + 1
+            if error is not None and child.start < error and (child.end is None or error < child.end):
+                child.error = error
+        pending.extend(reversed(node.children))
+
+def validate_item(obj):
+    """Товар по схеме промпта или None: нужен непустой title и price или url"""
+    if not isinstance(obj, dict):
+        return None
+    title = obj.get("title")
+    if not isinstance(title, str) or not title.strip():
+        return None
+    if obj.get("price") in (None, "") and not obj.get("url"):
+        return None
+    for field in ("price", "url", "image", "img_url", "location", "condition"):
+        value = obj.get(field)
+        if value is not None and not isinstance(value, (str, int, float)):
+            return None
+    return obj
+
+def items_from_values(values):
+    """Товары из уже разобранных JSON-значений (с обходом вложенных списков и обёрток)"""
+    items = []
+    seen = set()
+
+    def collect(value, depth=0):
+        if depth > MAX_DEPTH:
+            return
+        item = validate_item(value)
+        if item is not None:
+            key = (item.get("title"), item.get("url"), str(item.get("price")))
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+        elif isinstance(value, list):
+            for element in value:
+                collect(element, depth + 1)
+        elif isinstance(value, dict):
+            # {"items": [...]} и другие обёртки вокруг списка товаров
+            for element in value.values():
+                if isinstance(element, (list, dict)):
+                    collect(element, depth + 1)
+
+    for value in values:
+        collect(value)
+    return items
+
+def extract_items(text):
+    """Товары из ответа LLM: массивы объектов, {"items": [...]}, одиночные объекты и обрывки массивов"""
+    return items_from_values(iter_json_values(text))
@@ -0,0 +1,136 @@
+"""
+liveness.py - Фоновая проверка актуальности объявлений (проданные/снятые)
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+import aiohttp
+
+from config import Config, logger
+from database import (
+    Database,
+    get_tracked_brands,
+    get_unseen_items,
+    mark_items_inactive,
+    touch_items_checked,
+)
+from tracing import in_context
+from utils import RateLimiter, get_next_user_agent
+
+# Коды, при которых объявление считаем снятым
+GONE_STATUSES = {404, 410}
+# Mercari отдаёт проданные и удалённые карточки с кодом 200 - снятость видна только в теле
+GONE_MARKERS = tuple(marker.encode() for marker in (
+    '"status":"sold_out"',
+    '"status":"trading"',
+    '売り切れました',
+    'この商品は削除されました',
+))
+
+
+def _db_timestamp():
+    """Текущее время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def check_item_alive(session, limiter, url):
+    """
+    Проверка карточки объявления: 404/410 или отметка о продаже/удалении
+    в теле страницы - снято. Возвращает True/False, или None если ответ непонятен.
+    """
+    if not url:
+        return None
+    headers = {"User-Agent": get_next_user_agent()}
+    try:
+        async with limiter:
+            async with session.get(url, headers=headers, allow_redirects=True) as r:
+                status = r.status
+                body = await r.read() if status == 200 else b""
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.debug(f"Проверка {url} не удалась: {e}")
+        return None
+
+    if status in GONE_STATUSES:
+        return False
+    if status == 200:
+        return not any(marker in body for marker in GONE_MARKERS)
+    if 200 <= status < 400:
+        return True
+    return None
+
+
+async def verify_items(items, limiter=None):
+    """
+    Пакетно проверяет товары. Снятые помечаются неактивными,
+    живые получают свежий last_checked. Возвращает (живых, снятых).
+    """
+    if not items:
+        return 0, 0
+    limiter = limiter or RateLimiter(Config.LIVENESS_RATE, burst=2)
+    timeout = aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        results = await asyncio.gather(
+            *(check_item_alive(session, limiter, item['url']) for item in items)
+        )
+
+    alive = [item['id'] for item, ok in zip(items, results) if ok is True]
+    gone = [item['id'] for item, ok in zip(items, results) if ok is False]
+    touch_items_checked(alive)
+    mark_items_inactive(gone)
+    return len(alive), len(gone)
+
+
+async def sweep_brand(brand_main, platform="mercari", limiter=None):
+    """
+    Обходит выдачу бренда «в продаже» до конца (не больше LIVENESS_PAGES страниц),
+    обновляет last_seen у найденного и проверяет «отставших» - активные товары,
+    которых в выдаче не было. Если обход упёрся в лимит страниц или сбой,
+    отсутствие в нём ничего не значит, и отставших не трогаем.
+    """
+    from simple_parsers import sweep_mercari
+
+    source = Config.PLATFORMS.get(platform, {}).get("name", platform)
+    sweep_started = _db_timestamp()
+
+    loop = asyncio.get_running_loop()
+    items, complete = await loop.run_in_executor(
+        None, in_context(sweep_mercari), brand_main, Config.LIVENESS_PAGES
+    )
+    if not items:
+        # Пустая выдача - скорее всего блокировка или сбой, а не распродажа
+        logger.warning(f"⚠️ Liveness: пустая выдача по '{brand_main}', пропускаю")
+        return {"brand": brand_main, "seen": 0, "alive": 0, "gone": 0}
+
+    for item in items:
+        item['brand'] = brand_main
+    await Database().save_items(items, platform, brand_main)
+
+    if not complete:
+        logger.info(f"🔎 Liveness '{brand_main}': в выдаче {len(items)}, обход неполный "
+                    f"(LIVENESS_PAGES={Config.LIVENESS_PAGES}), отставших не проверяем")
+        return {"brand": brand_main, "seen": len(items), "alive": 0, "gone": 0}
+
+    stragglers = get_unseen_items(brand_main, source, sweep_started, Config.LIVENESS_BATCH)
+    alive, gone = await verify_items(stragglers, limiter)
+
+    logger.info(f"🔎 Liveness '{brand_main}': в выдаче {len(items)}, "
+                f"проверено {len(stragglers)}, живых {alive}, снято {gone}")
+    return {"brand": brand_main, "seen": len(items), "alive": alive, "gone": gone}
+
+
+async def liveness_loop(interval=None, platform="mercari"):
+    """Бесконечный фоновый цикл проверки всех отслеживаемых брендов"""
+    interval = interval or Config.LIVENESS_INTERVAL
+    limiter = RateLimiter(Config.LIVENESS_RATE, burst=2)
+
+    while True:
+        try:
+            for brand in get_tracked_brands():
+                await sweep_brand(brand, platform, limiter)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка liveness-прохода: {e}")
+        await asyncio.sleep(interval)
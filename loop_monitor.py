@@ -0,0 +1,81 @@
+"""
+loop_monitor.py - Сторож event loop: непрерывно меряет лаг и ловит блокирующие колбэки
+
+Задача-пульс внутри loop раз в interval отмечается и пишет запаздывание в
+event_loop_lag_seconds. Отдельный поток следит за пульсом: если его нет дольше
+threshold, значит loop занят одним колбэком - снимаем стек потока loop
+(sys._current_frames) и пишем в лог, чтобы было видно, кто блокирует.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from config import Config, logger
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS, LOOP_STALL_SECONDS
+
+class LoopMonitor:
+    def __init__(self, interval=None, threshold=None):
+        self.interval = interval or Config.LOOP_MONITOR_INTERVAL
+        self.threshold = threshold or Config.LOOP_BLOCK_THRESHOLD
+        self.last_beat = time.monotonic()
+        self.loop_thread_id = None
+        self.task = None
+        self.thread = None
+        self._stop = threading.Event()
+
+    async def start(self):
+        """Запускать из потока event loop"""
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.create_task(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        logger.info(f"✅ Сторож event loop запущен (порог {self.threshold}с)")
+
+    async def stop(self):
+        self._stop.set()
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(now - start - self.interval, 0))
+            self.last_beat = now
+
+    def _watch(self):
+        stalled_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self.last_beat
+            blocked = time.monotonic() - beat - self.interval
+
+            if stalled_beat is not None:
+                if beat != stalled_beat:
+                    # Пульс вернулся - блокировка закончилась
+                    stall = beat - stalled_beat - self.interval
+                    LOOP_STALL_SECONDS.observe(stall)
+                    logger.warning(f"🐢 Event loop был заблокирован {stall:.2f}с")
+                    stalled_beat = None
+                continue
+
+            if blocked > self.threshold:
+                stalled_beat = beat
+                LOOP_STALLS.inc()
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+                logger.warning(f"🐢 Event loop заблокирован уже {blocked:.2f}с, "
+                               f"текущий колбэк:\n{stack}")
+
+async def start_loop_monitor():
+    """Запускает сторожа, если он включён; возвращает его или None"""
+    if not Config.LOOP_MONITOR_ENABLED:
+        return None
+    monitor = LoopMonitor()
+    await monitor.start()
+    return monitor
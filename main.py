@@ -1,10 +1,13 @@
 import os
+import heapq
+import queue
 import subprocess
 import sys
 import time
 import threading
 import logging
-from database import init_db
+import urllib.request
+from collections import deque
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -13,6 +16,72 @@ logger = logging.getLogger(__name__)
 # Конфигурация для Puter
 PUTER_PORT = int(os.environ.get("PORT", 8080))  # Puter использует PORT или 8080
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", 0))
+
+# Супервизор процессов
+API_HEALTH_URL = "http://localhost:3032/health"
+API_READY_TIMEOUT = float(os.environ.get("API_READY_TIMEOUT", 30))
+RESTART_MAX = int(os.environ.get("RESTART_MAX", 5))          # перезапусков за окно
+RESTART_WINDOW = float(os.environ.get("RESTART_WINDOW", 300))
+RESTART_MAX_DELAY = float(os.environ.get("RESTART_MAX_DELAY", 60))
+STARTUP_GRACE = 3  # процесс, умерший быстрее, считаем не стартовавшим
+
+# Сюда потоки-наблюдатели кладут (имя, процесс) при завершении дочернего процесса
+exits = queue.Queue()
+
+def watch_process(name, process):
+    """Пересылает вывод процесса в лог и сообщает о его завершении в очередь exits"""
+    def run():
+        for line in process.stdout:
+            if line.strip():
+                logger.info(f"[{name}] {line.strip()}")
+        process.wait()
+        exits.put((name, process))
+    
+    threading.Thread(target=run, daemon=True).start()
+
+def wait_http_ready(url, process, timeout=API_READY_TIMEOUT):
+    """
+    Ждёт, пока url ответит 200, с экспоненциальной паузой между попытками.
+    Возвращает False, если процесс умер или истёк таймаут.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=2) as r:
+                if r.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, 2)
+    return False
+
+class RestartPolicy:
+    """
+    Ограничивает частоту перезапусков: пауза растёт экспоненциально с числом
+    недавних падений, а больше RESTART_MAX падений за RESTART_WINDOW - отказ.
+    """
+    
+    def __init__(self, max_restarts=RESTART_MAX, window=RESTART_WINDOW, max_delay=RESTART_MAX_DELAY):
+        self.max_restarts = max_restarts
+        self.window = window
+        self.max_delay = max_delay
+        self.history = {}
+    
+    def next_delay(self, name):
+        """Пауза перед перезапуском в секундах или None, если перезапускать больше нельзя"""
+        now = time.monotonic()
+        recent = self.history.setdefault(name, deque())
+        while recent and now - recent[0] > self.window:
+            recent.popleft()
+        if len(recent) >= self.max_restarts:
+            return None
+        recent.append(now)
+        return min(2 ** (len(recent) - 1), self.max_delay)
 
 def check_puter_environment():
     """Проверяет, запущено ли на Puter, и адаптирует конфигурацию"""
@@ -111,32 +180,17 @@ def start_node_api():
             bufsize=1
         )
         
-        def log_output():
-            for line in process.stdout:
-                if line.strip():
-                    logger.info(f"[free-api] {line.strip()}")
+        watch_process("free-api", process)
         
-        threading.Thread(target=log_output, daemon=True).start()
-        
-        # Даем API время запуститься
-        time.sleep(5)
-        
-        # Проверяем, что процесс жив
+        # Ждём, пока API начнёт отвечать на /health (а не фиксированные 5 секунд)
+        if wait_http_ready(API_HEALTH_URL, process):
+            logger.info("✅ free-sonnetapi запущен и отвечает на порту 3032")
+            return process
         if process.poll() is None:
-            # Дополнительная проверка: пробуем подключиться к API
-            import socket
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            try:
-                s.connect(('localhost', 3032))
-                s.close()
-                logger.info("✅ free-sonnetapi запущен и отвечает на порту 3032")
-            except:
-                logger.warning("⚠️ Процесс запущен, но порт 3032 не отвечает")
-            
+            logger.warning("⚠️ Процесс запущен, но /health на порту 3032 не отвечает")
             return process
-        else:
-            logger.error("❌ free-sonnetapi сразу завершился")
-            return None
+        logger.error("❌ free-sonnetapi сразу завершился")
+        return None
         
     except Exception as e:
         logger.error(f"❌ Ошибка запуска Node.js API: {e}")
@@ -154,6 +208,7 @@ def start_bot():
         is_puter = 'PUTER_USER' in os.environ or os.path.exists('/puter')
         
         env = os.environ.copy()
+        env['PROCESS_ROLE'] = 'bot'
         if is_puter:
             # Puter может требовать явного указания порта для бота
             env['BOT_PORT'] = str(PUTER_PORT)
@@ -167,27 +222,39 @@ def start_bot():
             bufsize=1
         )
         
-        def log_output():
-            for line in process.stdout:
-                if line.strip():
-                    logger.info(f"[bot] {line.strip()}")
+        watch_process("bot", process)
         
-        threading.Thread(target=log_output, daemon=True).start()
+        # Не ждём: если бот упадёт при старте, об этом сообщит очередь exits
+        logger.info("✅ Бот запущен")
+        return process
         
-        # Даем боту время запуститься
-        time.sleep(3)
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска бота: {e}")
+        return None
+
+def start_worker(index):
+    """Запускает воркер-процесс парсинга"""
+    try:
+        logger.info(f"🚀 Запуск воркера #{index}...")
         
-        if process.poll() is None:
-            logger.info("✅ Бот запущен")
-            return process
-        else:
-            # Читаем ошибку
-            stdout, _ = process.communicate(timeout=1)
-            logger.error(f"❌ Бот сразу завершился: {stdout}")
-            return None
+        env = os.environ.copy()
+        env['WORKER_INDEX'] = str(index)
+        env['PROCESS_ROLE'] = f'worker-{index}'
+        
+        process = subprocess.Popen(
+            [sys.executable, 'worker.py'],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            bufsize=1
+        )
+        
+        watch_process(f"worker-{index}", process)
+        return process
         
     except Exception as e:
-        logger.error(f"❌ Ошибка запуска бота: {e}")
+        logger.error(f"❌ Ошибка запуска воркера #{index}: {e}")
         return None
 
 def create_puter_start_script():
@@ -214,10 +281,12 @@ def main():
     
     # Инициализация БД
     try:
-        # Для Puter используем абсолютный путь к БД
+        # Для Puter используем абсолютный путь к БД. database читает DB_PATH
+        # при импорте, поэтому импортируем его только после настройки
         if is_puter:
             os.environ['DB_PATH'] = os.path.join(BASE_DIR, 'items.db')
         
+        from database import init_db
         init_db()
         logger.info("✅ База данных инициализирована")
     except Exception as e:
@@ -234,8 +303,16 @@ def main():
     if not node_process:
         logger.warning("⚠️ free-sonnetapi не запущен. Бот будет работать без Claude.")
     
+    # Воркеры парсинга: забирают задачи из общей очереди в БД
+    starters = {f"worker-{i}": (lambda i=i: start_worker(i)) for i in range(PARSE_WORKERS)}
+    starters["free-api"] = start_node_api
+    starters["bot"] = start_bot
+    processes = {name: starters[name]() for name in starters if name.startswith("worker-")}
+    processes["free-api"] = node_process
+    
     # Запуск бота
     bot_process = start_bot()
+    processes["bot"] = bot_process
     
     if not bot_process:
         logger.error("❌ Не удалось запустить бота!")
@@ -243,8 +320,10 @@ def main():
             node_process.terminate()
         sys.exit(1)
     
-    # Создаём health check сервер для Puter
-    if is_puter:
+    # Health check и /metrics при polling - на Puter и вне его
+    # (в режиме вебхука PORT занят ботом, там эти пути отдаёт он сам)
+    webhook_mode = os.environ.get("BOT_MODE", "polling").lower() == "webhook"
+    if not webhook_mode:
         from flask import Flask
         health_app = Flask(__name__)
         
@@ -256,33 +335,69 @@ def main():
         def health_check():
             return {"status": "alive"}
         
+        @health_app.route('/metrics')
+        def metrics_endpoint():
+            # Снимки метрик бота и воркеров из общей БД
+            import metrics
+            return metrics.render_all(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        
         def run_health_server():
             health_app.run(host='0.0.0.0', port=PUTER_PORT)
         
         threading.Thread(target=run_health_server, daemon=True).start()
         logger.info(f"✅ Health server запущен на порту {PUTER_PORT}")
     
+    policy = RestartPolicy()
+    started = {name: time.monotonic() for name in processes}
+    restarts = []  # куча (время запуска, имя) отложенных перезапусков
+    
     try:
-        # Держим главный процесс живым
+        # Держим главный процесс живым: просыпаемся по завершению дочернего процесса
+        # или к времени ближайшего отложенного перезапуска
         while True:
-            time.sleep(5)
-            
-            # Проверяем, живы ли процессы
-            if bot_process.poll() is not None:
-                logger.error("❌ Бот неожиданно остановился!")
-                # Пробуем перезапустить на Puter
-                if is_puter:
-                    logger.info("🔄 Пробую перезапустить бота...")
-                    bot_process = start_bot()
-                    if not bot_process:
+            timeout = max(restarts[0][0] - time.monotonic(), 0) if restarts else None
+            try:
+                name, process = exits.get(timeout=timeout)
+            except queue.Empty:
+                _, name = heapq.heappop(restarts)
+                logger.info(f"🔄 Перезапускаю {name}...")
+                processes[name] = starters[name]()
+                started[name] = time.monotonic()
+                if processes[name] is None:
+                    if name == "bot":
                         break
-                else:
-                    break
+                    # Не поднялся (умер до готовности, не создался) - события exits не будет
+                    delay = policy.next_delay(name)
+                    if delay is None:
+                        logger.error(f"❌ {name} не запускается ({RESTART_MAX} попыток за {RESTART_WINDOW:.0f}с), сдаюсь")
+                    else:
+                        logger.warning(f"⚠️ {name} не запустился, повтор через {delay}с")
+                        heapq.heappush(restarts, (time.monotonic() + delay, name))
+                continue
             
-            # Проверяем Node.js процесс
-            if node_process and node_process.poll() is not None:
-                logger.warning("⚠️ Node.js API остановился, пробую перезапустить...")
-                node_process = start_node_api()
+            # Событие от уже заменённого процесса
+            if processes.get(name) is not process:
+                continue
+            
+            uptime = time.monotonic() - started.get(name, 0)
+            if uptime < STARTUP_GRACE:
+                logger.error(f"❌ {name} сразу завершился (код {process.returncode})")
+            else:
+                logger.error(f"❌ {name} неожиданно остановился (код {process.returncode})")
+            
+            # Бота перезапускаем только на Puter; упавший воркер - всегда,
+            # его задача вернётся в очередь по истечении аренды
+            if name == "bot" and not is_puter:
+                break
+            
+            delay = policy.next_delay(name)
+            if delay is None:
+                logger.error(f"❌ {name} падает слишком часто ({RESTART_MAX} раз за {RESTART_WINDOW:.0f}с), не перезапускаю")
+                if name == "bot":
+                    break
+                continue
+            logger.warning(f"⚠️ Перезапуск {name} через {delay}с")
+            heapq.heappush(restarts, (time.monotonic() + delay, name))
                 
     except KeyboardInterrupt:
         logger.info("🛑 Остановка по Ctrl+C...")
@@ -290,12 +405,15 @@ def main():
         logger.error(f"❌ Ошибка: {e}")
     finally:
         logger.info("🛑 Останавливаю процессы...")
-        if bot_process and bot_process.poll() is None:
-            bot_process.terminate()
-            bot_process.wait(timeout=5)
-        if node_process and node_process.poll() is None:
-            node_process.terminate()
-            node_process.wait(timeout=5)
+        for process in processes.values():
+            if process and process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            if process:
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
         logger.info("✅ Все процессы остановлены")
 
 if __name__ == "__main__":
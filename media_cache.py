@@ -0,0 +1,184 @@
+"""
+media_cache.py - Локальный кеш превью товаров (по sha256 содержимого) и отправка фото альбомами
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+
+import aiohttp
+
+from config import Config, logger
+from database import evict_lru_media, get_media_by_url, get_media_usage, save_media, touch_media
+from utils import get_next_user_agent
+
+MAX_DOWNLOAD_BYTES = 5 * 1024 * 1024
+THUMB_SIZE = (640, 640)
+MEDIA_GROUP_LIMIT = 10
+
+def _make_thumbnail(data):
+    """Уменьшает картинку до THUMB_SIZE и пережимает в JPEG"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", THUMB_SIZE)
+        img = img.convert("RGB")
+        img.thumbnail(THUMB_SIZE)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=85, optimize=True)
+        return out.getvalue()
+
+class MediaCache:
+    """
+    Превью хранятся на диске как <dir>/<sha[:2]>/<sha>.jpg, метаданные - в БД.
+    При превышении лимита размера удаляются самые давно использованные файлы,
+    но их Telegram file_id сохраняется.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or Config.MEDIA_CACHE_DIR
+        self.max_bytes = max_bytes or Config.MEDIA_CACHE_MAX_BYTES
+        self.session = None
+        self._inflight = {}
+
+    def _path(self, sha256):
+        return os.path.join(self.cache_dir, sha256[:2], f"{sha256}.jpg")
+
+    async def _get_session(self):
+        if not self.session or self.session.closed:
+            timeout = aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
+            self.session = aiohttp.ClientSession(timeout=timeout)
+        return self.session
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    def get_file_id(self, url):
+        row = get_media_by_url(url)
+        return row[2] if row else None
+
+    def remember_file_id(self, sha256, file_id):
+        touch_media(sha256, file_id)
+
+    async def get(self, url):
+        """
+        Возвращает (sha256, bytes) превью: с диска или скачивая заново.
+        Параллельные запросы одного URL склеиваются в одну загрузку.
+        """
+        if not url:
+            return None, None
+        if url in self._inflight:
+            return await asyncio.shield(self._inflight[url])
+
+        task = asyncio.ensure_future(self._get(url))
+        self._inflight[url] = task
+        try:
+            return await task
+        finally:
+            self._inflight.pop(url, None)
+
+    async def _get(self, url):
+        row = get_media_by_url(url)
+        if row and row[1]:
+            path = self._path(row[0])
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                touch_media(row[0])
+                return row[0], data
+            except OSError:
+                pass
+
+        data = await self._download(url)
+        if not data:
+            return None, None
+
+        loop = asyncio.get_running_loop()
+        try:
+            thumb = await loop.run_in_executor(None, _make_thumbnail, data)
+        except Exception as e:
+            logger.debug(f"Не удалось сделать превью {url}: {e}")
+            return None, None
+
+        sha256 = hashlib.sha256(thumb).hexdigest()
+        path = self._path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(thumb)
+        save_media(url, sha256, len(thumb))
+        self.evict()
+        return sha256, thumb
+
+    async def _download(self, url):
+        session = await self._get_session()
+        try:
+            async with session.get(url, headers={"User-Agent": get_next_user_agent()}) as r:
+                if r.status != 200:
+                    return None
+                data = await r.content.read(MAX_DOWNLOAD_BYTES + 1)
+                return data if len(data) <= MAX_DOWNLOAD_BYTES else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"Ошибка загрузки {url}: {e}")
+            return None
+
+    def evict(self):
+        """Удаляет LRU-файлы, пока кеш не влезет в лимит"""
+        overflow = get_media_usage() - self.max_bytes
+        if overflow <= 0:
+            return
+        for sha256 in evict_lru_media(overflow):
+            try:
+                os.remove(self._path(sha256))
+            except OSError:
+                pass
+
+# Общий экземпляр процесса бота (создаётся в setup_bot)
+cache = None
+
+async def send_item_photos(bot, chat_id, items):
+    """
+    Отправляет фото товаров альбомами по 10. Уже загруженные в Telegram
+    картинки уходят по file_id, новые - байтами из кеша; после отправки
+    их file_id запоминается.
+    """
+    from aiogram.types import BufferedInputFile, InputMediaPhoto
+
+    items = [item for item in items if item.get('img_url')]
+    if not cache or not items:
+        return 0
+
+    sent = 0
+    for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+        chunk = items[start:start + MEDIA_GROUP_LIMIT]
+        file_ids = [cache.get_file_id(item['img_url']) for item in chunk]
+        fetched = await asyncio.gather(*(
+            cache.get(item['img_url']) if not file_id else asyncio.sleep(0, (None, None))
+            for item, file_id in zip(chunk, file_ids)
+        ))
+
+        media, shas = [], []
+        for item, file_id, (sha256, data) in zip(chunk, file_ids, fetched):
+            caption = f"{item.get('title', '?')[:80]}\n{item.get('price', '')}\n{item.get('url', '')}"
+            if file_id:
+                media.append(InputMediaPhoto(media=file_id, caption=caption))
+            elif data:
+                media.append(InputMediaPhoto(media=BufferedInputFile(data, f"{sha256}.jpg"), caption=caption))
+            else:
+                continue
+            shas.append(sha256)
+
+        if not media:
+            continue
+        if len(media) == 1:
+            # Альбом в Telegram - минимум 2 фото
+            messages = [await bot.send_photo(chat_id, photo=media[0].media, caption=media[0].caption)]
+        else:
+            messages = await bot.send_media_group(chat_id, media=media)
+        for message, sha256 in zip(messages, shas):
+            if sha256 and message.photo:
+                cache.remember_file_id(sha256, message.photo[-1].file_id)
+        sent += len(media)
+    return sent
@@ -0,0 +1,307 @@
+"""
+metrics.py - Метрики горячих путей в формате Prometheus (text exposition 0.0.4)
+
+Каждый процесс (бот, воркеры) копит метрики у себя и периодически сбрасывает
+снимок в таблицу metrics_snapshots под постоянным именем роли (bot, worker-N).
+При остановке процесса, а также при старте новой копии роли после падения,
+снимок роли вливается в строку RETIRED и удаляется - поэтому сумма счётчиков
+не уменьшается при перезапусках. /metrics отдаёт эту сумму плюс свежие
+значения текущего процесса.
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+from config import Config, logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Роль задаёт супервизор (main.py); без него - хост и имя скрипта
+PROCESS_ID = os.environ.get("PROCESS_ROLE") or f"{socket.gethostname()}:{os.path.basename(sys.argv[0])}"
+RETIRED = "_retired"
+
+# ==================== ТИПЫ МЕТРИК ====================
+class _Metric:
+    type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = Lock()
+        registry.register(self)
+
+    def labels(self, **labels):
+        return _Bound(self, tuple(str(labels.get(n, "")) for n in self.labelnames))
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, key=()):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labelnames)
+
+    def observe(self, value, key=()):
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [счётчики по корзинам (последняя - +Inf), сумма, количество]
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, key=()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, key)
+
+class _Bound:
+    """Метрика с зафиксированными значениями меток"""
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount=1):
+        self.metric.inc(amount, self.key)
+
+    def observe(self, value):
+        self.metric.observe(value, self.key)
+
+    def time(self):
+        return self.metric.time(self.key)
+
+# ==================== РЕЕСТР ====================
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        """Текущие значения в виде, пригодном для JSON"""
+        data = {}
+        for name, metric in self.metrics.items():
+            with metric.lock:
+                values = [[list(key), json.loads(json.dumps(value))] for key, value in metric.values.items()]
+            data[name] = {"type": metric.type, "help": metric.help,
+                          "labels": list(metric.labelnames),
+                          "buckets": list(getattr(metric, "buckets", [])),
+                          "values": values}
+        return data
+
+registry = Registry()
+
+def merge_snapshots(snapshots):
+    """Складывает снимки нескольких процессов: счётчики и корзины гистограмм суммируются"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "values": {}})
+            for key, value in metric["values"]:
+                key = tuple(key)
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = json.loads(json.dumps(value))
+                elif metric["type"] == "counter":
+                    target["values"][key] = current + value
+                elif len(current[0]) == len(value[0]):
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+    return merged
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+def render(merged):
+    """Prometheus text format"""
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["values"].items()):
+            if metric["type"] == "counter":
+                lines.append(f"{name}{_labels(metric['labels'], key)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                cumulative += bucket
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{name}_bucket{_labels(metric['labels'], key, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labels'], key)} {total}")
+            lines.append(f"{name}_count{_labels(metric['labels'], key)} {count}")
+    return "\n".join(lines) + "\n"
+
+# ==================== СНИМКИ В SQLITE ====================
+def _connect():
+    import database
+    conn = sqlite3.connect(database.DB_FILE, timeout=10)
+    conn.execute('''CREATE TABLE IF NOT EXISTS metrics_snapshots
+                   (process TEXT PRIMARY KEY,
+                    data TEXT,
+                    updated_at REAL)''')
+    return conn
+
+def flush():
+    """Сохраняет снимок метрик текущего процесса"""
+    conn = None
+    try:
+        conn = _connect()
+        conn.execute('''INSERT INTO metrics_snapshots (process, data, updated_at)
+                       VALUES (?, ?, ?)
+                       ON CONFLICT(process) DO UPDATE SET
+                           data = excluded.data,
+                           updated_at = excluded.updated_at''',
+                    (PROCESS_ID, json.dumps(registry.snapshot()), time.time()))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"❌ Ошибка сохранения метрик: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def retire(process=PROCESS_ID):
+    """Вливает снимок процесса в RETIRED и удаляет его строку (сумма не меняется)"""
+    conn = None
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT data FROM metrics_snapshots WHERE process = ?", (process,)).fetchone()
+        if row:
+            retired = conn.execute("SELECT data FROM metrics_snapshots WHERE process = ?",
+                                   (RETIRED,)).fetchone()
+            merged = merge_snapshots([json.loads(row[0])] + ([json.loads(retired[0])] if retired else []))
+            data = {name: {**metric, "values": [[list(key), value] for key, value in metric["values"].items()]}
+                    for name, metric in merged.items()}
+            conn.execute('''INSERT INTO metrics_snapshots (process, data, updated_at)
+                           VALUES (?, ?, ?)
+                           ON CONFLICT(process) DO UPDATE SET
+                               data = excluded.data,
+                               updated_at = excluded.updated_at''',
+                        (RETIRED, json.dumps(data), time.time()))
+            conn.execute("DELETE FROM metrics_snapshots WHERE process = ?", (process,))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"❌ Ошибка переноса метрик {process}: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def shutdown():
+    """Последний снимок процесса уходит в RETIRED"""
+    flush()
+    retire()
+
+def install_shutdown():
+    """
+    Сохраняет метрики при выходе процесса. Снимок прошлой копии этой роли
+    (если она упала, не успев это сделать) сразу переносится в RETIRED.
+    """
+    retire()
+    atexit.register(shutdown)
+    # SIGTERM от супервизора по умолчанию завершает процесс без atexit
+    if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+def render_all():
+    """Метрики всех процессов, включая остановленные (RETIRED), + текущий процесс"""
+    snapshots = [registry.snapshot()]
+    conn = None
+    try:
+        conn = _connect()
+        rows = conn.execute("SELECT data FROM metrics_snapshots WHERE process != ?",
+                            (PROCESS_ID,)).fetchall()
+        snapshots.extend(json.loads(row[0]) for row in rows)
+    except Exception as e:
+        logger.error(f"❌ Ошибка чтения метрик: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return render(merge_snapshots(snapshots))
+
+async def flush_loop(interval=None):
+    """Фоновый сброс снимка метрик"""
+    interval = interval or Config.METRICS_FLUSH_INTERVAL
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, flush)
+
+# ==================== МЕТРИКИ ПРИЛОЖЕНИЯ ====================
+FETCH_SECONDS = Histogram("parser_fetch_seconds", "Время загрузки страницы площадки", ["platform"])
+FETCH_STATUS = Counter("parser_fetch_total", "Ответы площадок по кодам статуса", ["platform", "status"])
+PARSE_SECONDS = Histogram("parser_parse_seconds", "Время разбора одной страницы", ["platform"])
+LAYOUT_FALLBACKS = Counter("parser_llm_fallback_total", "Обращения к Claude при сломанной разметке",
+                           ["platform", "outcome"])
+DB_UPSERT_SECONDS = Histogram("db_upsert_batch_seconds", "Время сохранения пачки товаров")
+DB_UPSERT_ITEMS = Counter("db_upsert_items_total", "Сохранено товаров (всего, в пачках)")
+DB_LOCK_WAIT_SECONDS = Histogram("db_lock_wait_seconds", "Ожидание db_lock",
+                                 buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+CLAUDE_SECONDS = Histogram("claude_request_seconds", "Время запроса к прокси Claude", ["outcome"])
+CLAUDE_REQUESTS = Counter("claude_requests_total", "Запросы к прокси Claude", ["outcome"])
+CLAUDE_BATCH_SIZE = Histogram("claude_batch_size", "Задач Claude в одном запросе к прокси",
+                              buckets=(1, 2, 3, 5, 8, 13, 21))
+ALERT_MESSAGES = Counter("alert_messages_total", "Сообщения с оповещениями по подпискам", ["kind"])
+ALERT_ITEMS = Counter("alert_items_total", "Товары, отправленные по подпискам", ["kind"])
+TELEGRAM_SECONDS = Histogram("telegram_send_seconds", "Время вызова Bot API", ["method"])
+TELEGRAM_ERRORS = Counter("telegram_send_errors_total", "Ошибки вызовов Bot API", ["method", "error"])
+LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "Запаздывание пульса event loop",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+LOOP_STALLS = Counter("event_loop_stalls_total", "Блокировки event loop дольше порога")
+LOOP_STALL_SECONDS = Histogram("event_loop_stall_seconds", "Длительность блокировок event loop",
+                               buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+class TimedLock:
+    """threading.Lock, который пишет время ожидания в DB_LOCK_WAIT_SECONDS"""
+
+    def __init__(self):
+        self._lock = Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -4,8 +4,11 @@ simple_bot.py - Telegram бот для парсинга с поддержкой
 
 import os
 import asyncio
+import hashlib
+import importlib.util
 import logging
 import sys
+import time
 from datetime import datetime
 from typing import Dict, List, Optional
 
@@ -17,21 +20,25 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiohttp import web
 
 # Твои модули
 from config import Config, logger
-from database import Database, init_db
+from database import Database, init_db, search_items, get_digest, get_priority_price
 from brands import get_all_brands, get_brand_categories
-from simple_parsers import parse_mercari, search_all, run_parser
 from utils import format_number
-
-# Claude Computer Use
-try:
-    from claude_controller import ClaudeComputerUse, ComputerUseTask
-    CLAUDE_AVAILABLE = True
-except ImportError as e:
-    logger.warning(f"⚠️ Claude модуль не загружен: {e}")
-    CLAUDE_AVAILABLE = False
+from telegram_queue import MessageDispatcher
+from fsm_storage import SQLiteStorage
+import metrics
+import tracing
+from loop_monitor import start_loop_monitor
+import job_queue
+import subscriptions
+
+# Claude Computer Use: модуль только ищем, грузится он при первом обращении (get_claude)
+CLAUDE_AVAILABLE = importlib.util.find_spec("claude_controller") is not None
+if not CLAUDE_AVAILABLE:
+    logger.warning("⚠️ Claude модуль не найден")
 
 # ============================================
 # КОНФИГУРАЦИЯ
@@ -53,28 +60,39 @@ logger.info(f"✅ Токен бота: {config.BOT_TOKEN[:10]}...")
 # ============================================
 
 # Создаем бота и диспетчер
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
+if config.TELEGRAM_API_URL:
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    bot = Bot(token=config.BOT_TOKEN,
+              session=AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=config.BOT_TOKEN)
+if config.FSM_STORAGE == "sqlite":
+    # Диалоги переживают перезапуск и видны всем процессам бота
+    storage = SQLiteStorage()
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
 # Глобальные переменные
 db = None
 claude_cu = None
+outbox = None
+background_tasks = []
 
 # ============================================
 # ФУНКЦИЯ УДАЛЕНИЯ ВЕБХУКА
 # ============================================
 
 async def force_delete_webhook():
-    """Принудительно удаляет вебхук"""
+    """Удаляет вебхук, если он есть (один get_webhook_info на запуск)"""
     try:
-        logger.info("🔍 Проверка наличия вебхука...")
         webhook_info = await bot.get_webhook_info()
         
         if webhook_info.url:
             logger.warning(f"⚠️ НАЙДЕН АКТИВНЫЙ ВЕБХУК: {webhook_info.url}")
-            logger.warning("🔄 Принудительно удаляю вебхук...")
             
+            # delete_webhook возвращает True только после удаления - повторная проверка не нужна
             result = await bot.delete_webhook(drop_pending_updates=True)
             if result:
                 logger.info("✅ Вебхук успешно удален!")
@@ -83,13 +101,6 @@ async def force_delete_webhook():
         else:
             logger.info("✅ Вебхуков нет, можно использовать polling")
             
-        # Проверяем еще раз для уверенности
-        webhook_info = await bot.get_webhook_info()
-        if not webhook_info.url:
-            logger.info("✅ Подтверждено: вебхуков нет")
-        else:
-            logger.error(f"❌ Вебхук все еще есть: {webhook_info.url}")
-            
     except Exception as e:
         logger.error(f"❌ Ошибка при проверке/удалении вебхука: {e}")
 
@@ -99,23 +110,64 @@ async def force_delete_webhook():
 
 async def setup_bot():
     """Настройка бота перед запуском"""
-    global db, claude_cu
-    
-    # Удаляем вебхук
-    await force_delete_webhook()
+    global db, outbox
     
-    # Инициализация базы данных
+    # Инициализация базы данных (таблицы и миграции - и без супервизора)
+    init_db()
     db = Database()
     
-    # Инициализация Claude (если доступно)
-    if config.CLAUDE_ENABLED and CLAUDE_AVAILABLE:
+    # Очередь исходящих сообщений с учётом flood-лимитов
+    outbox = MessageDispatcher(bot)
+    await outbox.start()
+    
+    # Снимок метрик для /metrics (сервер метрик может жить в другом процессе)
+    metrics.install_shutdown()
+    background_tasks.append(asyncio.create_task(metrics.flush_loop()))
+    
+    # Лаг event loop и стеки блокирующих колбэков
+    await start_loop_monitor()
+    
+    # Фоновая проверка проданных/снятых товаров (при воркерах её ведёт воркер #0)
+    if config.LIVENESS_ENABLED and config.PARSE_WORKERS == 0:
+        from liveness import liveness_loop
+        background_tasks.append(asyncio.create_task(liveness_loop()))
+        logger.info("✅ Liveness-проверка запущена")
+    
+    # Оповещения по подпискам (совпадения пишут все процессы, рассылает бот)
+    if config.SUBSCRIPTIONS_ENABLED:
+        background_tasks.append(asyncio.create_task(subscriptions.alerts_loop(outbox)))
+        logger.info("✅ Рассылка оповещений по подпискам запущена")
+    
+    # Кеш превью для отправки фото
+    if config.MEDIA_CACHE_ENABLED:
+        import media_cache
+        media_cache.cache = media_cache.MediaCache()
+    
+    # Хеширование фото для поиска перевыставленных товаров (при воркерах - в них,
+    # товары, сохранённые ботом, уходят им задачей image_hash)
+    if config.IMAGE_HASH_ENABLED and config.PARSE_WORKERS == 0:
+        import image_hash
+        image_hash.pipeline = image_hash.ImageHashPipeline()
+        await image_hash.pipeline.start()
+    
+    logger.info("✅ Настройка бота завершена")
+
+def claude_enabled():
+    """Claude включён и модуль есть (без его загрузки)"""
+    return config.CLAUDE_ENABLED and CLAUDE_AVAILABLE
+
+def get_claude():
+    """Клиент Claude Computer Use; модуль грузится и клиент создаётся при первом обращении"""
+    global claude_cu, CLAUDE_AVAILABLE
+    if claude_cu is None and claude_enabled():
         try:
+            from claude_controller import ClaudeComputerUse
             claude_cu = ClaudeComputerUse(api_url=config.CLAUDE_API_URL)
             logger.info("✅ Claude Computer Use инициализирован")
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации Claude: {e}")
-    
-    logger.info("✅ Настройка бота завершена")
+            CLAUDE_AVAILABLE = False
+    return claude_cu
 
 # ============================================
 # СОСТОЯНИЯ FSM
@@ -199,7 +251,7 @@ async def cmd_start(message: Message):
         "Я бот для парсинга площадок с б/у товарами.\n"
     )
     
-    if claude_cu:
+    if claude_enabled():
         welcome_text += "🤖 **Claude Computer Use активен!**\n\n"
     else:
         welcome_text += "⚠️ Claude отключен, работает только базовый парсинг.\n\n"
@@ -220,6 +272,11 @@ async def cmd_help(message: Message):
         "/help - Эта справка\n"
         "/search <запрос> - Быстрый поиск\n"
         "/claude <запрос> - Поиск с Claude\n"
+        "/find <слова> - Поиск по сохранённым товарам\n"
+        "/subscribe <бренд/слова> [@площадка] [от-до] - Оповещать о новых товарах\n"
+        "/subscriptions - Мои подписки\n"
+        "/unsubscribe <номер> - Удалить подписку\n"
+        "/priority <цена|off> - Товары дешевле цены присылать сразу, без дайджеста\n"
         "/stats - Статистика\n"
     )
     await message.answer(help_text)
@@ -241,10 +298,108 @@ async def cmd_search(message: Message, state: FSMContext):
         reply_markup=get_platforms_keyboard()
     )
 
+@dp.message(Command("find"))
+async def cmd_find(message: Message):
+    """Поиск по уже сохранённым товарам (без обращения к площадкам)"""
+    query = message.text.replace("/find", "", 1).strip()
+    
+    if not query:
+        await message.answer("Введи слова после /find")
+        return
+    
+    loop = asyncio.get_running_loop()
+    items = await loop.run_in_executor(None, lambda: search_items(query, limit=10))
+    
+    if not items:
+        await message.answer(f"🔎 По запросу **{query}** в базе ничего нет")
+        return
+    
+    report = f"🔎 **{query}** — найдено в базе: {len(items)}\n\n"
+    for i, item in enumerate(items, 1):
+        title = item.get('title') or '?'
+        report += f"{i}. {title[:50]} - {item.get('price', '?')}\n{item.get('url', '')}\n"
+    
+    await message.answer(report, disable_web_page_preview=True)
+
+@dp.message(Command("subscribe"))
+async def cmd_subscribe(message: Message):
+    """Сохранённый поиск: новые товары по нему приходят оповещениями"""
+    text = message.text.replace("/subscribe", "", 1).strip()
+    
+    if not text:
+        await message.answer(
+            "Формат: /subscribe <бренд и/или слова> [@площадка] [от-до]\n"
+            "Например: /subscribe gongen ring @mercari 5000-30000"
+        )
+        return
+    
+    try:
+        subscription = subscriptions.subscribe(message.from_user.id, text)
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    
+    await message.answer(
+        f"🔔 Подписка #{subscription.id}: {subscription.describe()}\n"
+        "Пришлю, когда появятся новые товары."
+    )
+
+@dp.message(Command("subscriptions"))
+async def cmd_subscriptions(message: Message):
+    """Список подписок пользователя"""
+    items = subscriptions.list_subscriptions(message.from_user.id)
+    
+    if not items:
+        await message.answer("У тебя нет подписок. Добавь: /subscribe <бренд или слова>")
+        return
+    
+    report = "🔔 **Подписки:**\n\n"
+    for subscription in items:
+        report += f"#{subscription.id} — {subscription.describe()}\n"
+    report += "\nУдалить: /unsubscribe <номер>"
+    await message.answer(report)
+
+@dp.message(Command("unsubscribe"))
+async def cmd_unsubscribe(message: Message):
+    """Удаление подписки по номеру"""
+    arg = message.text.replace("/unsubscribe", "", 1).strip().lstrip("#")
+    
+    if not arg.isdigit():
+        await message.answer("Укажи номер подписки: /unsubscribe <номер> (список - /subscriptions)")
+        return
+    
+    if subscriptions.unsubscribe(message.from_user.id, int(arg)):
+        await message.answer(f"🔕 Подписка #{arg} удалена")
+    else:
+        await message.answer(f"⚠️ Подписки #{arg} нет")
+
+@dp.message(Command("priority"))
+async def cmd_priority(message: Message):
+    """Порог цены для срочных оповещений"""
+    arg = message.text.replace("/priority", "", 1).strip()
+    
+    if not arg:
+        current = get_priority_price(message.from_user.id)
+        status = (f"🔥 Сейчас сразу приходят товары до {current}" if current
+                  else "🔥 Срочный порог не задан - всё приходит дайджестом")
+        await message.answer(f"{status}\nФормат: /priority <цена> или /priority off")
+        return
+    
+    try:
+        price = subscriptions.set_priority(message.from_user.id, arg)
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    
+    if price is None:
+        await message.answer("🔕 Срочные оповещения выключены, всё приходит дайджестом")
+    else:
+        await message.answer(f"🔥 Товары до {price} буду присылать сразу")
+
 @dp.message(Command("claude"))
 async def cmd_claude(message: Message, state: FSMContext):
     """Запуск Claude"""
-    if not claude_cu:
+    if not get_claude():
         await message.answer("❌ Claude Computer Use не доступен")
         return
     
@@ -257,6 +412,7 @@ async def cmd_claude(message: Message, state: FSMContext):
     status_msg = await message.answer("🤖 Запускаю Claude...")
     
     try:
+        from claude_controller import ComputerUseTask
         task = ComputerUseTask(
             query=query,
             user_id=message.from_user.id,
@@ -288,7 +444,7 @@ async def callback_claude_menu(callback: CallbackQuery):
     """Меню Claude"""
     await callback.answer()
     
-    if not claude_cu:
+    if not get_claude():
         await callback.message.edit_text(
             "❌ Claude не доступен",
             reply_markup=InlineKeyboardBuilder().button(text="◀️ Назад", callback_data="back_to_main").as_markup()
@@ -319,6 +475,24 @@ async def callback_back_to_main(callback: CallbackQuery):
         reply_markup=get_main_keyboard()
     )
 
+@dp.callback_query(lambda c: c.data.startswith("digest:"))
+async def callback_digest_page(callback: CallbackQuery):
+    """Листание дайджеста оповещений"""
+    _, digest_id, page = callback.data.split(":")
+    items = get_digest(int(digest_id), callback.from_user.id)
+    if not items:
+        await callback.answer("Дайджест устарел")
+        return
+    text, keyboard = subscriptions.render_digest(int(digest_id), items, int(page))
+    await outbox.edit_message_text(
+        text,
+        chat_id=callback.message.chat.id,
+        message_id=callback.message.message_id,
+        reply_markup=keyboard,
+        disable_web_page_preview=True
+    )
+    await callback.answer()
+
 @dp.callback_query(lambda c: c.data.startswith("platform_"))
 async def callback_platform_selected(callback: CallbackQuery, state: FSMContext):
     """Выбор платформы"""
@@ -398,6 +572,7 @@ async def process_claude_task(message: Message, state: FSMContext):
     
     status_msg = await message.answer("🤖 Передаю задачу Claude...")
     
+    from claude_controller import ComputerUseTask
     task = ComputerUseTask(
         query=task_description,
         user_id=message.from_user.id,
@@ -454,28 +629,93 @@ async def process_price_max(message: Message, state: FSMContext):
 # АСИНХРОННЫЕ ЗАДАЧИ
 # ============================================
 
+async def parse_locally(platform: str, query: str, price_min: int, price_max: int, render_progress):
+    """Парсинг в процессе бота с прогрессом по мере поступления событий"""
+    from simple_parsers import stream_parser
+    
+    results = []
+    saved = 0
+    pages = 0
+    last_render = time.monotonic()
+    
+    async for event in stream_parser(platform, query, price_min, price_max, 20):
+        if event["event"] == "page_fetched":
+            pages += 1
+        elif event["event"] == "items":
+            # Сохраняем пачку сразу, не дожидаясь остальных площадок
+            results.extend(event["items"])
+            saved += await db.save_items(event["items"], platform, query)
+        elif event["event"] == "done":
+            break
+        
+        now = time.monotonic()
+        if now - last_render >= config.PROGRESS_INTERVAL:
+            last_render = now
+            await render_progress(pages, len(results), saved)
+    
+    return results, saved
+
+async def parse_in_worker(platform: str, query: str, price_min: int, price_max: int, render_progress):
+    """Ставит задачу в общую очередь и ждёт, пока её выполнит воркер"""
+    job_id = job_queue.enqueue("parse", {
+        "platform": platform,
+        "query": query,
+        "price_min": price_min,
+        "price_max": price_max,
+        "max_items": 20,
+        "trace": tracing.inject(),
+    })
+    
+    async def on_progress(progress):
+        await render_progress(progress.get("pages", 0), progress.get("found", 0), progress.get("saved", 0))
+    
+    job = await job_queue.wait_for_job(job_id, on_progress)
+    if not job:
+        raise Exception("воркеры не успели обработать задачу")
+    if job["status"] in ("failed", "cancelled"):
+        raise Exception(job["error"] or "задача завершилась с ошибкой")
+    return job["result"]["items"], job["result"]["saved"]
+
 async def run_parser_task(chat_id: int, platform: str, query: str, status_msg_id: int, price_min: int = 0, price_max: int = 1000000):
     """Запуск парсера"""
     try:
         # Обновляем статус
-        await bot.edit_message_text(
+        await outbox.edit_message_text(
             f"🔍 Парсинг... Найдено: 0",
             chat_id=chat_id,
             message_id=status_msg_id
         )
         
-        # Запускаем парсер
-        results = await run_parser(platform, query, price_min, price_max, 20)
+        async def render_progress(pages, found, saved):
+            await outbox.edit_message_text(
+                f"🔍 Парсинг... Страниц: {pages}\n"
+                f"📊 Найдено: {found}\n"
+                f"💾 Новых: {saved}",
+                chat_id=chat_id,
+                message_id=status_msg_id,
+                wait=False
+            )
         
-        # Сохраняем результаты
-        saved = await db.save_items(results, platform, query)
+        # Корневой спан поиска: все этапы ниже (и в воркере) получают его trace_id
+        with tracing.span("search", chat_id=chat_id, platform=platform, query=query) as attrs:
+            if config.PARSE_WORKERS > 0:
+                # Парсинг выполняют воркер-процессы, бот только ждёт результат
+                results, saved = await parse_in_worker(platform, query, price_min, price_max, render_progress)
+            else:
+                results, saved = await parse_locally(platform, query, price_min, price_max, render_progress)
+            attrs.update(found=len(results), saved=saved)
+        
+        duplicates = sum(1 for item in results if item.get('duplicate_of'))
         
         # Отчет
         report = (
             f"✅ **Парсинг завершен!**\n\n"
             f"📊 Найдено: {len(results)}\n"
-            f"💾 Сохранено: {saved}\n\n"
+            f"💾 Сохранено: {saved}\n"
         )
+        if duplicates:
+            report += f"🔁 Дубликатов: {duplicates}\n"
+        report += "\n"
         
         if results:
             report += "**Товары:**\n"
@@ -487,16 +727,24 @@ async def run_parser_task(chat_id: int, platform: str, query: str, status_msg_id
         keyboard = InlineKeyboardBuilder()
         keyboard.button(text="🔄 Новый поиск", callback_data="quick_search")
         
-        await bot.edit_message_text(
+        await outbox.edit_message_text(
             report,
             chat_id=chat_id,
             message_id=status_msg_id,
             reply_markup=keyboard.as_markup()
         )
         
+        # Фото отправляем уже после отчёта, чтобы он не ждал загрузок
+        if config.MEDIA_CACHE_ENABLED and results:
+            from media_cache import send_item_photos
+            try:
+                await send_item_photos(outbox, chat_id, results[:config.SEND_PHOTOS_LIMIT])
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось отправить фото: {e}")
+        
     except Exception as e:
         logger.error(f"Ошибка парсинга: {e}")
-        await bot.edit_message_text(
+        await outbox.edit_message_text(
             f"❌ Ошибка: {str(e)[:100]}",
             chat_id=chat_id,
             message_id=status_msg_id
@@ -504,8 +752,9 @@ async def run_parser_task(chat_id: int, platform: str, query: str, status_msg_id
 
 async def run_claude_task(chat_id: int, task: 'ComputerUseTask', status_msg_id: int):
     """Запуск Claude задачи"""
+    claude_cu = get_claude()
     if not claude_cu:
-        await bot.edit_message_text(
+        await outbox.edit_message_text(
             "❌ Claude не доступен",
             chat_id=chat_id,
             message_id=status_msg_id
@@ -513,7 +762,7 @@ async def run_claude_task(chat_id: int, task: 'ComputerUseTask', status_msg_id:
         return
     
     try:
-        await bot.edit_message_text(
+        await outbox.edit_message_text(
             "🤖 Claude работает...",
             chat_id=chat_id,
             message_id=status_msg_id
@@ -540,14 +789,14 @@ async def run_claude_task(chat_id: int, task: 'ComputerUseTask', status_msg_id:
             keyboard = InlineKeyboardBuilder()
             keyboard.button(text="🔄 Новая задача", callback_data="claude_start")
             
-            await bot.edit_message_text(
+            await outbox.edit_message_text(
                 report,
                 chat_id=chat_id,
                 message_id=status_msg_id,
                 reply_markup=keyboard.as_markup()
             )
         else:
-            await bot.edit_message_text(
+            await outbox.edit_message_text(
                 f"❌ Ошибка Claude: {result.error}",
                 chat_id=chat_id,
                 message_id=status_msg_id
@@ -555,12 +804,89 @@ async def run_claude_task(chat_id: int, task: 'ComputerUseTask', status_msg_id:
             
     except Exception as e:
         logger.error(f"Ошибка Claude задачи: {e}")
-        await bot.edit_message_text(
+        await outbox.edit_message_text(
             f"❌ Критическая ошибка: {str(e)[:100]}",
             chat_id=chat_id,
             message_id=status_msg_id
         )
 
+# ============================================
+# WEBHOOK
+# ============================================
+
+def get_webhook_secret():
+    """Секрет вебхука: из конфига или стабильно выводится из токена"""
+    if config.WEBHOOK_SECRET:
+        return config.WEBHOOK_SECRET
+    return hashlib.sha256(config.BOT_TOKEN.encode()).hexdigest()[:32]
+
+async def handle_health(request):
+    """Health check для платформы и балансировщика"""
+    return web.json_response({"status": "alive", "bot": "running", "mode": "webhook"})
+
+async def handle_metrics(request):
+    """Метрики всех процессов в формате Prometheus"""
+    text = await asyncio.get_running_loop().run_in_executor(None, metrics.render_all)
+    return web.Response(text=text, content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+def build_webhook_app():
+    """aiohttp-приложение: приём апдейтов от Telegram + health check"""
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    
+    app = web.Application()
+    app.router.add_get("/", handle_health)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    
+    # Запросы без правильного X-Telegram-Bot-Api-Secret-Token отклоняются
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=get_webhook_secret()
+    ).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def register_webhook():
+    """
+    Регистрирует вебхук в Telegram. Накопленные обновления не сбрасываются:
+    при перезапуске одной из реплик очередь должны разобрать остальные.
+    set_webhook вызываем всегда: getWebhookInfo не показывает секрет, и без
+    повторной регистрации смена WEBHOOK_SECRET не дошла бы до Telegram.
+    """
+    url = config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH
+    allowed_updates = dp.resolve_used_update_types()
+    await bot.set_webhook(
+        url,
+        secret_token=get_webhook_secret(),
+        allowed_updates=allowed_updates,
+        drop_pending_updates=False
+    )
+    logger.info(f"✅ Вебхук установлен: {url}")
+
+async def run_webhook():
+    """Запуск в режиме вебхука на порту PORT"""
+    if not config.WEBHOOK_URL:
+        logger.critical("❌ BOT_MODE=webhook, но WEBHOOK_URL не задан!")
+        sys.exit(1)
+    
+    if config.WEBHOOK_REGISTER:
+        await register_webhook()
+    
+    runner = web.AppRunner(build_webhook_app())
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.PORT)
+    await site.start()
+    logger.info(f"🌐 Webhook-сервер слушает {config.WEBHOOK_HOST}:{config.PORT}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if claude_cu:
+            await claude_cu.close()
+
 # ============================================
 # ЗАПУСК
 # ============================================
@@ -573,22 +899,34 @@ async def main():
     # Выполняем настройку перед запуском
     await setup_bot()
     
-    logger.info(f"🤖 Claude: {'доступен' if claude_cu else 'отключен'}")
+    logger.info(f"🤖 Claude: {'доступен' if claude_enabled() else 'отключен'}")
     
-    # Финальная проверка вебхука (просто для уверенности)
-    try:
-        webhook_info = await bot.get_webhook_info()
-        if webhook_info.url:
-            logger.warning(f"⚠️ ВЕБХУК ВСЕ ЕЩЕ ЕСТЬ: {webhook_info.url}")
-            await bot.delete_webhook(drop_pending_updates=True)
-            logger.info("✅ Вебхук удален перед стартом")
-        else:
-            logger.info("✅ Вебхуков нет, запускаем polling")
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка при финальной проверке: {e}")
+    if config.BOT_MODE == "webhook":
+        await run_webhook()
+        return
+    
+    # Удаляем вебхук - он мешает polling
+    await force_delete_webhook()
     
     # Запускаем polling
-    await dp.start_polling(bot, drop_pending_updates=True)
+    try:
+        await dp.start_polling(bot, drop_pending_updates=True)
+    finally:
+        if claude_cu:
+            await claude_cu.close()
+
+async def set_webhook_command():
+    """`python simple_bot.py set-webhook` - однократная регистрация вебхука (деплой, супервизор)"""
+    if not config.WEBHOOK_URL:
+        logger.critical("❌ WEBHOOK_URL не задан!")
+        sys.exit(1)
+    try:
+        await register_webhook()
+    finally:
+        await bot.session.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if sys.argv[1:] == ["set-webhook"]:
+        asyncio.run(set_webhook_command())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -3,18 +3,379 @@ simple_parsers.py - Парсеры для маркетплейсов
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment, NavigableString
 from urllib.parse import quote
 import time
 import random
+import re
+import hashlib
 import asyncio
-from config import ITEMS_PER_PAGE, logger
+from concurrent.futures import ProcessPoolExecutor
+import database
+from config import Config, ITEMS_PER_PAGE, logger
+from metrics import FETCH_SECONDS, FETCH_STATUS, PARSE_SECONDS, LAYOUT_FALLBACKS
+from tracing import span, traced, in_context
 from utils import generate_item_id, make_full_url, get_next_user_agent
 
-def parse_mercari(keyword):
-    """Синхронный парсер Mercari с отладкой"""
-    items = []
-    url = f"https://jp.mercari.com/search?keyword={quote(keyword)}"
+MERCARI = "mercari"
+MERCARI_BASE = Config.MERCARI_BASE_URL.rstrip('/')
+
+# Теги без содержимого карточек - в разметку для Claude не попадают
+NON_CONTENT_TAGS = ['script', 'style', 'noscript', 'svg', 'iframe', 'link', 'meta', 'template',
+                    'head', 'canvas', 'video', 'audio', 'object', 'embed', 'form', 'button', 'input', 'select']
+# Атрибуты, по которым Claude подбирает селекторы
+COMPACT_ATTRS = ('class', 'data-testid', 'href', 'src', 'alt')
+
+# Пул процессов для разбора HTML (создаётся при первом использовании)
+_parse_pool = None
+
+def _warm_parse_worker():
+    """Инициализация процесса пула: заранее грузим bs4/lxml и их внутренние кеши"""
+    BeautifulSoup('<html><body><a href="/item/m1"><img alt="x" src="y"></a></body></html>', 'lxml').select('a img')
+
+def get_parse_pool():
+    """ProcessPoolExecutor для разбора HTML или None, если он выключен"""
+    global _parse_pool
+    if Config.PARSE_PROCESSES <= 0:
+        return None
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=Config.PARSE_PROCESSES,
+            initializer=_warm_parse_worker
+        )
+        logger.info(f"✅ Пул разбора HTML: {Config.PARSE_PROCESSES} процессов")
+    return _parse_pool
+
+def parse_mercari_html(html, limit=ITEMS_PER_PAGE):
+    """
+    Разбирает страницу выдачи Mercari (bytes или str).
+    Возвращает компактные кортежи (title, price, url, img_url) -
+    функция чистая, поэтому её можно выполнять в пуле процессов.
+    """
+    return _parse_mercari_soup(BeautifulSoup(html, 'lxml'), limit)
+
+def _parse_mercari_soup(soup, limit):
+    rows = []
+    
+    # Пробуем разные селекторы
+    selectors = [
+        '[data-testid="item-cell"]',
+        '.merItemCell',
+        '.sc-1v2q8tf-0',
+        '.items-box',
+        'article',
+        '.item'
+    ]
+    
+    cards = []
+    for selector in selectors:
+        cards = soup.select(selector)
+        if cards:
+            logger.info(f"✅ Найдено карточек по селектору '{selector}': {len(cards)}")
+            break
+    
+    if not cards:
+        # Если карточки не найдены, ищем ссылки на товары
+        links = soup.find_all('a', href=True)
+        product_links = [l for l in links if '/item/' in l['href'] or '/m' in l['href']]
+        logger.info(f"🔗 Найдено ссылок на товары: {len(product_links)}")
+        
+        # Пробуем извлечь товары из ссылок
+        for link in product_links[:limit]:
+            try:
+                href = link.get('href')
+                full_url = make_full_url(MERCARI_BASE, href)
+                
+                # Ищем название
+                title_elem = link.find(['h3', 'div', 'span'], class_=True)
+                title = title_elem.text.strip() if title_elem else 'Без названия'
+                
+                # Ищем цену
+                price_elem = link.find(text=lambda t: t and ('¥' in t or '円' in t))
+                price = price_elem.strip() if price_elem else 'Цена не указана'
+                
+                # Ищем фото
+                img_elem = link.select_one('img')
+                img_url = img_elem.get('src') if img_elem else ''
+                
+                rows.append((title, price, full_url, img_url or ''))
+            except Exception as e:
+                logger.debug(f"Ошибка парсинга ссылки: {e}")
+        
+        logger.info(f"📦 Извлечено товаров из ссылок: {len(rows)}")
+        return rows
+    
+    # Парсим карточки
+    for card in cards[:limit]:
+        try:
+            # Пробуем разные селекторы для названия
+            title_elem = (
+                card.select_one('[data-testid="thumbnail-title"]') or
+                card.select_one('h3') or
+                card.select_one('img[alt]') or
+                card.select_one('.item-name')
+            )
+            
+            # Пробуем разные селекторы для цены
+            price_elem = (
+                card.select_one('[data-testid="price"]') or
+                card.select_one('.price') or
+                card.select_one('[class*="price"]') or
+                card.find(text=lambda t: t and ('¥' in t or '円' in t))
+            )
+            
+            # Пробуем найти ссылку
+            link_elem = card.select_one('a') or card.find('a', href=True)
+            
+            if not link_elem:
+                continue
+            
+            title = title_elem.text.strip() if title_elem else 'Без названия'
+            if hasattr(title_elem, 'get') and title_elem.get('alt'):
+                title = title_elem.get('alt')
+            
+            price = price_elem.text.strip() if price_elem else 'Цена не указана'
+            if isinstance(price_elem, str):
+                price = price_elem
+            
+            href = link_elem.get('href')
+            full_url = make_full_url(MERCARI_BASE, href)
+            
+            # Ищем фото
+            img_elem = card.select_one('img') or link_elem.select_one('img')
+            img_url = img_elem.get('src') if img_elem else ''
+            
+            rows.append((str(title), str(price), full_url, img_url or ''))
+            
+            logger.debug(f"✅ Товар: {title[:30]}... - {price}")
+            
+        except Exception as e:
+            logger.debug(f"Ошибка парсинга карточки: {e}")
+    
+    return rows
+
+def mercari_rows_to_items(rows):
+    """Кортежи из parse_mercari_html -> словари товаров"""
+    return [
+        {
+            'id': generate_item_id({'source': 'Mercari JP', 'url': url, 'title': title}),
+            'title': title[:200],
+            'price': price[:100],
+            'url': url,
+            'source': 'Mercari JP',
+            'img_url': img_url,
+        }
+        for title, price, url, img_url in rows
+    ]
+
+def parse_mercari_page(html, limit=ITEMS_PER_PAGE, learned=None):
+    """
+    Разбор страницы вместе с подписью её разметки: (rows, layout_hash).
+    learned - {layout_hash: selectors}: если для этой разметки уже выучены
+    селекторы, разбираем ими, иначе (или если они не сработали) - встроенными.
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    layout = layout_hash(soup)
+    if learned and layout in learned:
+        rows = select_rows(soup, learned[layout], limit)
+        if not rows_look_broken(rows):
+            return rows, layout
+    return _parse_mercari_soup(soup, limit), layout
+
+def layout_hash(soup):
+    """
+    Подпись вёрстки: повторяющиеся сочетания тег + классы + data-testid.
+    От текста и числа карточек почти не зависит, меняется вместе с разметкой.
+    """
+    counts = {}
+    for tag in soup.find_all(True):
+        classes = tag.get('class') or ()
+        testid = tag.get('data-testid')
+        if not classes and not testid:
+            continue
+        signature = f"{tag.name}.{'.'.join(sorted(classes))}[{testid or ''}]"
+        counts[signature] = counts.get(signature, 0) + 1
+    repeated = sorted(signature for signature, count in counts.items() if count >= 2)
+    return hashlib.sha1("\n".join(repeated).encode()).hexdigest()[:16]
+
+def select_rows(soup, selectors, limit=ITEMS_PER_PAGE):
+    """Разбор карточек по выученным селекторам {card, title, price, link, image}"""
+    rows = []
+    try:
+        cards = soup.select(selectors['card'])
+    except Exception as e:
+        logger.debug(f"Негодный селектор карточки {selectors.get('card')}: {e}")
+        return rows
+    
+    for card in cards[:limit]:
+        try:
+            title_elem = card.select_one(selectors['title']) if selectors.get('title') else None
+            price_elem = card.select_one(selectors['price']) if selectors.get('price') else None
+            link_elem = card if card.name == 'a' else card.select_one(selectors.get('link') or 'a[href]')
+            img_elem = card.select_one(selectors.get('image') or 'img')
+            
+            if not link_elem or not link_elem.get('href'):
+                continue
+            
+            title = 'Без названия'
+            if title_elem:
+                title = title_elem.get('alt') or title_elem.get_text(' ', strip=True) or title
+            price = price_elem.get_text(' ', strip=True) if price_elem else 'Цена не указана'
+            
+            rows.append((title, price, make_full_url(MERCARI_BASE, link_elem['href']),
+                         (img_elem.get('src') if img_elem else '') or ''))
+        except Exception as e:
+            logger.debug(f"Ошибка разбора карточки по выученным селекторам: {e}")
+    
+    return rows
+
+def select_rows_html(html, selectors, limit=ITEMS_PER_PAGE):
+    return select_rows(BeautifulSoup(html, 'lxml'), selectors, limit)
+
+def rows_look_broken(rows):
+    """Селекторы не сработали: товаров нет или у большинства нет названия, цены или ссылки"""
+    if not rows:
+        return True
+    bad = sum(
+        1 for title, price, url, _ in rows
+        if title in ('', 'Без названия') or not any(ch.isdigit() for ch in price) or not url
+    )
+    return bad * 2 > len(rows)
+
+# Текст пустой выдачи Mercari: товаров нет, но разметка в порядке - Claude не нужен
+NO_RESULTS_MARKERS = tuple(marker.encode() for marker in (
+    '該当する商品が見つかりません',
+    '出品された商品がありません',
+    '検索結果はありません',
+))
+
+def page_has_no_results(content):
+    """Площадка сама пишет, что по запросу ничего нет"""
+    return any(marker in content for marker in NO_RESULTS_MARKERS)
+
+# ==================== СЖАТИЕ РАЗМЕТКИ ДЛЯ LLM ====================
+def estimate_tokens(text):
+    """Грубая оценка токенов: ~4 ASCII-символа или ~1.5 прочих (кана, кириллица) на токен"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return int((len(text) - non_ascii) / 4 + non_ascii / 1.5) + 1
+
+def _strip_non_content(root):
+    """Удаляет скрипты, стили, скрытые узлы и комментарии"""
+    for tag in root(NON_CONTENT_TAGS):
+        tag.decompose()
+    for comment in root.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    for tag in root.find_all(True):
+        if tag.decomposed:
+            continue
+        if tag.has_attr('hidden') or tag.get('aria-hidden') == 'true':
+            tag.decompose()
+
+def _compact_attrs(tag, keep_alt=True):
+    attrs = []
+    for name in COMPACT_ATTRS:
+        value = tag.get(name)
+        if not value or (name == 'alt' and not keep_alt):
+            continue
+        if isinstance(value, list):
+            value = " ".join(value)
+        if name in ('href', 'src'):
+            # Трекинговые параметры и якоря Claude не нужны
+            value = value.split('#')[0].split('?')[0]
+        elif name == 'alt':
+            value = value[:60]
+        attrs.append(f'{name}="{value}"')
+    return attrs
+
+def _compact_node(node, keep_alt=True):
+    """
+    Минимальная разметка узла: теги без значимых атрибутов разворачиваются
+    в содержимое, пустые выбрасываются, пробелы схлопываются.
+    keep_alt=False - alt картинок не нужен (название и так есть в тексте).
+    """
+    if isinstance(node, NavigableString):
+        return re.sub(r'\s+', ' ', str(node)).strip()
+    
+    inner = " ".join(part for part in (_compact_node(child, keep_alt) for child in node.children) if part)
+    attrs = _compact_attrs(node, keep_alt)
+    if not attrs:
+        return inner
+    if not inner and not (node.get('href') or node.get('src')):
+        return ""
+    inner = re.sub(r'> <', '><', inner)
+    if node.name == 'img':
+        return f"<img {' '.join(attrs)}>"
+    return f"<{node.name} {' '.join(attrs)}>{inner}</{node.name}>"
+
+def find_cards(root):
+    """
+    Карточки товаров: самая многочисленная группа одинаковых по тегу, классам
+    и data-testid узлов, в каждом из которых есть ссылка и цифры (цена).
+    При равенстве берём внешние узлы - в них больше потомков.
+    """
+    groups = {}
+    for tag in root.find_all(True):
+        classes = tag.get('class') or ()
+        testid = tag.get('data-testid')
+        if not classes and not testid:
+            continue
+        groups.setdefault((tag.name, tuple(sorted(classes)), testid), []).append(tag)
+    
+    best, best_score = [], None
+    for tags in groups.values():
+        if len(tags) < 3:
+            continue
+        cards = [
+            tag for tag in tags
+            if (tag.name == 'a' or tag.find('a', href=True)) and any(ch.isdigit() for ch in tag.get_text())
+        ]
+        if len(cards) * 5 < len(tags) * 4:
+            continue
+        score = (len(cards), sum(len(tag.find_all(True)) for tag in cards))
+        if best_score is None or score > best_score:
+            best, best_score = cards, score
+    return best
+
+def compact_html(html, budget=None):
+    """
+    Сжатая разметка страницы для запроса к Claude в пределах budget токенов:
+    без скриптов, стилей, скрытых узлов и лишних атрибутов. Если найдены
+    карточки товаров - только они, в минимальном виде (текст, ссылки, фото
+    и классы для селекторов); сколько не влезло в бюджет - помечаем.
+    """
+    budget = budget or Config.LLM_PAGE_TOKEN_BUDGET
+    soup = BeautifulSoup(html, 'lxml')
+    root = soup.body or soup
+    _strip_non_content(root)
+    
+    cards = find_cards(root)
+    if not cards:
+        # Карточек не нашли - вся страница в сжатом виде, обрезанная по бюджету
+        text = _compact_node(root)
+        while text and estimate_tokens(text) > budget:
+            text = text[:int(len(text) * 0.9)]
+        return text
+    
+    parts = [f"<!-- карточек на странице: {len(cards)} -->"]
+    # Место под пометку о не вошедших карточках
+    used = estimate_tokens(parts[0]) * 2
+    for card in cards:
+        compact = _compact_node(card, keep_alt=not card.get_text(strip=True))
+        tokens = estimate_tokens(compact)
+        if used + tokens > budget:
+            parts.append(f"<!-- ещё {len(cards) - len(parts) + 1} карточек не вошли -->")
+            break
+        parts.append(compact)
+        used += tokens
+    return "\n".join(parts)
+
+def fetch_mercari(keyword, progress=None, page=0, on_sale=False):
+    """Загрузка страницы выдачи Mercari (page - номер страницы, on_sale - только в продаже): bytes или None"""
+    url = f"{MERCARI_BASE}/search?keyword={quote(keyword)}"
+    if on_sale:
+        url += "&status=on_sale"
+    if page:
+        url += f"&page_token={quote(f'v1:{page}')}"
     
     # Ротация User-Agent
     user_agents = [
@@ -41,171 +402,312 @@ def parse_mercari(keyword):
     
     try:
         # Добавляем случайную задержку
-        time.sleep(random.uniform(1, 3))
+        time.sleep(random.uniform(Config.REQUEST_DELAY_MIN, Config.REQUEST_DELAY_MAX))
         
         session = requests.Session()
-        r = session.get(url, headers=headers, timeout=15)
+        with FETCH_SECONDS.labels(platform="Mercari JP").time(), span("fetch", url=url) as attrs:
+            r = session.get(url, headers=headers, timeout=15)
+            attrs["status"] = r.status_code
+        FETCH_STATUS.labels(platform="Mercari JP", status=r.status_code).inc()
         
         logger.info(f"📊 Статус код: {r.status_code}")
-        logger.info(f"📏 Длина ответа: {len(r.text)} символов")
+        logger.info(f"📏 Длина ответа: {len(r.content)} байт")
+        _emit(progress, "page_fetched", platform="Mercari JP", status=r.status_code, size=len(r.content))
         
         if r.status_code != 200:
             logger.warning(f"Mercari вернул {r.status_code}")
-            return items
-            
-        soup = BeautifulSoup(r.text, 'lxml')
+            return None
+        return r.content
         
-        # Пробуем разные селекторы
-        selectors = [
-            '[data-testid="item-cell"]',
-            '.merItemCell',
-            '.sc-1v2q8tf-0',
-            '.items-box',
-            'article',
-            '.item'
-        ]
-        
-        cards = []
-        for selector in selectors:
-            cards = soup.select(selector)
-            if cards:
-                logger.info(f"✅ Найдено карточек по селектору '{selector}': {len(cards)}")
-                break
-        
-        if not cards:
-            # Если карточки не найдены, ищем ссылки на товары
-            links = soup.find_all('a', href=True)
-            product_links = [l for l in links if '/item/' in l['href'] or '/m' in l['href']]
-            logger.info(f"🔗 Найдено ссылок на товары: {len(product_links)}")
-            
-            # Пробуем извлечь товары из ссылок
-            for link in product_links[:ITEMS_PER_PAGE]:
-                try:
-                    href = link.get('href')
-                    full_url = make_full_url('https://jp.mercari.com', href)
-                    
-                    # Ищем название
-                    title_elem = link.find(['h3', 'div', 'span'], class_=True)
-                    title = title_elem.text.strip() if title_elem else 'Без названия'
-                    
-                    # Ищем цену
-                    price_elem = link.find(text=lambda t: t and ('¥' in t or '円' in t))
-                    price = price_elem.strip() if price_elem else 'Цена не указана'
-                    
-                    # Ищем фото
-                    img_elem = link.select_one('img')
-                    img_url = img_elem.get('src') if img_elem else ''
-                    
-                    items.append({
-                        'id': generate_item_id({'source': 'Mercari JP', 'url': full_url, 'title': title}),
-                        'title': title[:200],
-                        'price': price[:100],
-                        'url': full_url,
-                        'source': 'Mercari JP',
-                        'img_url': img_url,
-                    })
-                except Exception as e:
-                    logger.debug(f"Ошибка парсинга ссылки: {e}")
-            
-            logger.info(f"📦 Извлечено товаров из ссылок: {len(items)}")
-            return items
-        
-        # Парсим карточки
-        for card in cards[:ITEMS_PER_PAGE]:
-            try:
-                # Пробуем разные селекторы для названия
-                title_elem = (
-                    card.select_one('[data-testid="thumbnail-title"]') or
-                    card.select_one('h3') or
-                    card.select_one('img[alt]') or
-                    card.select_one('.item-name')
-                )
-                
-                # Пробуем разные селекторы для цены
-                price_elem = (
-                    card.select_one('[data-testid="price"]') or
-                    card.select_one('.price') or
-                    card.select_one('[class*="price"]') or
-                    card.find(text=lambda t: t and ('¥' in t or '円' in t))
-                )
-                
-                # Пробуем найти ссылку
-                link_elem = card.select_one('a') or card.find('a', href=True)
-                
-                if not link_elem:
-                    continue
-                
-                title = title_elem.text.strip() if title_elem else 'Без названия'
-                if hasattr(title_elem, 'get') and title_elem.get('alt'):
-                    title = title_elem.get('alt')
-                
-                price = price_elem.text.strip() if price_elem else 'Цена не указана'
-                if isinstance(price_elem, str):
-                    price = price_elem
-                
-                href = link_elem.get('href')
-                full_url = make_full_url('https://jp.mercari.com', href)
-                
-                # Ищем фото
-                img_elem = card.select_one('img') or link_elem.select_one('img')
-                img_url = img_elem.get('src') if img_elem else ''
-                
-                items.append({
-                    'id': generate_item_id({'source': 'Mercari JP', 'url': full_url, 'title': title}),
-                    'title': title[:200],
-                    'price': price[:100],
-                    'url': full_url,
-                    'source': 'Mercari JP',
-                    'img_url': img_url,
-                })
-                
-                logger.debug(f"✅ Товар: {title[:30]}... - {price}")
-                
-            except Exception as e:
-                logger.debug(f"Ошибка парсинга карточки: {e}")
-                
     except requests.exceptions.Timeout:
+        FETCH_STATUS.labels(platform="Mercari JP", status="timeout").inc()
         logger.error("⏰ Таймаут запроса Mercari")
     except requests.exceptions.ConnectionError:
+        FETCH_STATUS.labels(platform="Mercari JP", status="connection_error").inc()
         logger.error("🔌 Ошибка соединения с Mercari")
     except Exception as e:
         logger.error(f"❌ Ошибка запроса Mercari: {e}")
+    return None
+
+def parse_mercari_content(content, learned=None, limit=ITEMS_PER_PAGE):
+    """Разбор загруженной страницы: (rows, layout_hash). В пул уходят только сырые байты, обратно - кортежи"""
+    pool = get_parse_pool()
+    with PARSE_SECONDS.labels(platform="Mercari JP").time(), span("parse", pool=bool(pool)):
+        if pool:
+            return pool.submit(parse_mercari_page, content, limit, learned).result()
+        return parse_mercari_page(content, limit, learned)
+
+@traced("parse_mercari")
+def parse_mercari(keyword, progress=None):
+    """
+    Синхронный парсер Mercari с отладкой.
+    progress - необязательный callback(event: dict) для событий хода парсинга.
+    Разбор HTML уходит в пул процессов, если задан PARSE_PROCESSES.
+    Claude здесь не зовётся - используются только уже выученные селекторы.
+    """
+    items = []
+    content = fetch_mercari(keyword, progress)
+    if content is not None:
+        try:
+            rows, _ = parse_mercari_content(content, learned_selectors(MERCARI))
+            items = mercari_rows_to_items(rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка разбора Mercari: {e}")
     
     logger.info(f"📦 Найдено {len(items)} товаров на Mercari")
+    _emit(progress, "items_parsed", platform="Mercari JP", count=len(items))
     return items
 
-def search_all(keywords):
+@traced("sweep_mercari")
+def sweep_mercari(keyword, max_pages):
+    """
+    Полный обход выдачи «в продаже» по страницам (для liveness): (items, complete).
+    complete - выдача кончилась раньше max_pages (страница без новых товаров),
+    только тогда отсутствие товара в обходе что-то значит.
+    """
+    items = []
+    seen = set()
+    learned = learned_selectors(MERCARI)
+    for page in range(max_pages):
+        content = fetch_mercari(keyword, page=page, on_sale=True)
+        if content is None:
+            return items, False
+        rows, _ = parse_mercari_content(content, learned, limit=None)
+        fresh = [item for item in mercari_rows_to_items(rows) if item['url'] not in seen]
+        if not fresh:
+            return items, True
+        seen.update(item['url'] for item in fresh)
+        items.extend(fresh)
+    return items, False
+
+# ==================== ЗАПАСНОЙ РАЗБОР ЧЕРЕЗ CLAUDE ====================
+# platform -> (время загрузки, {layout_hash: (status, selectors, updated_at)})
+_layout_rules = {}
+# (platform, layout_hash) -> задача обучения, чтобы на одну разметку был один запрос к Claude
+_learning = {}
+_claude = None
+
+def layout_rules(platform):
+    """Правила разбора площадки из БД (с коротким кешем в процессе)"""
+    cached = _layout_rules.get(platform)
+    if cached and time.monotonic() - cached[0] < Config.LAYOUT_RULES_TTL:
+        return cached[1]
+    rules = database.get_layout_rules(platform)
+    _layout_rules[platform] = (time.monotonic(), rules)
+    return rules
+
+def learned_selectors(platform):
+    """{layout_hash: selectors} для разметок, где выученные селекторы сработали"""
+    return {layout: selectors for layout, (status, selectors, _) in layout_rules(platform).items()
+            if status == 'selectors'}
+
+def claude_fallback_enabled(platform):
+    return Config.CLAUDE_ENABLED and Config.PLATFORMS.get(platform, {}).get('use_claude', False)
+
+def _should_learn(platform, layout):
+    """Claude зовём на новую разметку или если прошлое обучение устарело"""
+    if not claude_fallback_enabled(platform):
+        return False
+    rule = layout_rules(platform).get(layout)
+    return rule is None or time.time() - rule[2] > Config.LAYOUT_RELEARN_INTERVAL
+
+def parse_with_rules(content, platform):
+    """
+    Разбор выученными селекторами (правила читаются из БД - только в потоке):
+    (rows, layout, learn), learn - страница сломана и Claude для её разметки можно звать
+    """
+    rows, layout = parse_mercari_content(content, learned_selectors(platform))
+    broken = rows_look_broken(rows) and not page_has_no_results(content)
+    return rows, layout, broken and ((platform, layout) in _learning or _should_learn(platform, layout))
+
+def _get_claude():
+    global _claude
+    if _claude is None:
+        from claude_controller import ClaudeComputerUse
+        _claude = ClaudeComputerUse(api_url=Config.CLAUDE_API_URL, batch_window=0)
+    return _claude
+
+async def learn_layout(platform, content, layout):
+    """
+    Claude разбирает выдержку страницы и подбирает селекторы. Сработали -
+    запоминаем их для этой разметки; нет - берём товары из его ответа,
+    а разметку помечаем 'failed' до LAYOUT_RELEARN_INTERVAL (так же и при
+    ошибке запроса к Claude). Возвращает rows.
+    """
+    loop = asyncio.get_running_loop()
+    info = Config.PLATFORMS.get(platform, {})
+    excerpt = await loop.run_in_executor(None, compact_html, content)
+    logger.info(f"🤖 Разметка {platform} {layout} не разобрана, спрашиваем Claude "
+                f"({len(content)} байт -> ~{estimate_tokens(excerpt)} токенов)")
+    
+    try:
+        answer = await _get_claude().learn_layout(info.get('name', platform), info.get('url', ''), excerpt)
+    except Exception as e:
+        # Прокси лежит или не ответил: помечаем разметку, иначе каждый запрос
+        # снова ждал бы Claude до таймаута. Повтор - через LAYOUT_RELEARN_INTERVAL
+        await loop.run_in_executor(None, database.save_layout_rule, platform, layout, 'failed', None)
+        _layout_rules.pop(platform, None)
+        LAYOUT_FALLBACKS.labels(platform=platform, outcome="error").inc()
+        logger.error(f"❌ Claude не разобрал страницу {platform}: {e}")
+        return []
+    
+    selectors = answer['selectors']
+    if selectors:
+        rows = await loop.run_in_executor(None, select_rows_html, content, selectors)
+        if not rows_look_broken(rows):
+            await loop.run_in_executor(None, database.save_layout_rule, platform, layout, 'selectors', selectors)
+            _layout_rules.pop(platform, None)
+            LAYOUT_FALLBACKS.labels(platform=platform, outcome="learned").inc()
+            logger.info(f"✅ Выучены селекторы {platform} для разметки {layout}: {selectors}")
+            return rows
+    
+    # Селекторы не подошли - товары этой страницы берём из ответа Claude
+    await loop.run_in_executor(None, database.save_layout_rule, platform, layout, 'failed', selectors)
+    _layout_rules.pop(platform, None)
+    LAYOUT_FALLBACKS.labels(platform=platform, outcome="llm_items").inc()
+    logger.warning(f"⚠️ Селекторы {platform} не выучены, товаров из ответа Claude: {len(answer['items'])}")
+    return [
+        (str(item['title']),
+         str(item.get('price') or 'Цена не указана'),
+         make_full_url(MERCARI_BASE, str(item['url'])) if item.get('url') else '',
+         str(item.get('image') or item.get('img_url') or ''))
+        for item in answer['items']
+    ]
+
+def _learning_done(key, task):
+    """Снимает обучение с учёта; ошибку забираем - в фоне её может никто не дождаться"""
+    _learning.pop(key, None)
+    if not task.cancelled() and task.exception():
+        logger.error(f"❌ Обучение разметки {key} упало: {task.exception()}")
+
+async def _learn_once(platform, content, layout):
+    """
+    Одно обучение на разметку. Ждём его не дольше LAYOUT_LEARN_WAIT: дальше Claude
+    доучивает в фоне, а запрос отдаёт то, что нашёл HTML-парсер. Параллельные
+    запросы той же разметки после обучения разбирают свою страницу выученным
+    """
+    key = (platform, layout)
+    task = _learning.get(key)
+    first = task is None
+    if first:
+        task = _learning[key] = asyncio.create_task(learn_layout(platform, content, layout))
+        task.add_done_callback(lambda done: _learning_done(key, done))
+    
+    try:
+        rows = await asyncio.wait_for(asyncio.shield(task), Config.LAYOUT_LEARN_WAIT)
+    except asyncio.TimeoutError:
+        logger.warning(f"⏳ Claude разбирает {platform} {layout} дольше {Config.LAYOUT_LEARN_WAIT}с, "
+                       f"отвечаем без него, обучение продолжается в фоне")
+        return []
+    if first:
+        return rows
+    
+    loop = asyncio.get_running_loop()
+    rows, _, _ = await loop.run_in_executor(None, in_context(parse_with_rules), content, platform)
+    return rows
+
+@traced("parse_mercari")
+async def parse_mercari_adaptive(keyword, progress=None):
+    """
+    Mercari с запасным разбором: сначала обычный HTML-парсер, Claude - только
+    если селекторы не дали товаров. Итог кешируется по (площадка, хеш разметки),
+    поэтому Claude зовётся при смене вёрстки, а не на каждый запрос.
+    """
+    loop = asyncio.get_running_loop()
+    rows = []
+    content = await loop.run_in_executor(None, in_context(fetch_mercari), keyword, progress)
+    if content is not None:
+        try:
+            rows, layout, learn = await loop.run_in_executor(
+                None, in_context(parse_with_rules), content, MERCARI
+            )
+            if learn:
+                rows = await _learn_once(MERCARI, content, layout) or rows
+        except Exception as e:
+            logger.error(f"❌ Ошибка разбора Mercari: {e}")
+    
+    items = mercari_rows_to_items(rows)
+    logger.info(f"📦 Найдено {len(items)} товаров на Mercari")
+    _emit(progress, "items_parsed", platform="Mercari JP", count=len(items))
+    return items
+
+def _emit(progress, event, **data):
+    """Отправляет событие прогресса, не давая ошибкам callback'а сломать парсинг"""
+    if not progress:
+        return
+    try:
+        progress({"event": event, **data})
+    except Exception as e:
+        logger.debug(f"Ошибка callback прогресса: {e}")
+
+def search_all(keywords, progress=None):
     """Запускает поиск по всем ключам"""
     all_items = []
     for keyword in keywords:
         logger.info(f"🔍 Ищем '{keyword}'...")
-        items = parse_mercari(keyword)
+        items = parse_mercari(keyword, progress)
         all_items.extend(items)
+        _emit(progress, "items", items=items)
         time.sleep(random.uniform(2, 5))  # случайная задержка
     return all_items
 
-async def run_parser(platform, query, price_min=0, price_max=1000000, max_items=50):
+@traced("run_parser")
+async def run_parser(platform, query, price_min=0, price_max=1000000, max_items=50, progress=None):
     """
-    Асинхронная функция для запуска парсера
+    Асинхронная функция для запуска парсера.
+    progress вызывается из потока парсера - он должен быть потокобезопасным.
+    Поток выполняется в копии контекста, поэтому его спаны попадают в текущий трейс.
     """
     logger.info(f"🚀 Запуск парсера для {platform}, запрос: {query}")
+    loop = asyncio.get_event_loop()
     
     # Для Mercari
     if platform in ["mercari", "Mercari JP", "mercari jp", "mercari"]:
-        # Запускаем синхронный парсер в отдельном потоке
-        loop = asyncio.get_event_loop()
-        items = await loop.run_in_executor(None, parse_mercari, query)
-        return items[:max_items]
+        # Загрузка и разбор - в потоках, Claude - только при сломанной разметке
+        items = await parse_mercari_adaptive(query, progress)
+        items = items[:max_items]
+        _emit(progress, "items", items=items)
+        return items
     
     elif platform in ["all", "multiple", "все"]:
-        # Поиск по всем ключам
-        loop = asyncio.get_event_loop()
-        items = await loop.run_in_executor(None, search_all, [query])
+        # Поиск по всем ключам (пачки товаров уходят в progress по мере готовности)
+        items = await loop.run_in_executor(None, in_context(search_all), [query], progress)
         return items[:max_items]
     
     else:
         # Для других платформ
         logger.warning(f"⚠️ Платформа {platform} пока не поддерживается, используем Mercari")
-        loop = asyncio.get_event_loop()
-        items = await loop.run_in_executor(None, parse_mercari, query)
-        return items[:max_items]
\ No newline at end of file
+        items = await parse_mercari_adaptive(query, progress)
+        items = items[:max_items]
+        _emit(progress, "items", items=items)
+        return items
+
+async def stream_parser(platform, query, price_min=0, price_max=1000000, max_items=50):
+    """
+    Асинхронный генератор событий парсинга:
+    page_fetched / items_parsed / items (пачка товаров) и в конце done.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def progress(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+    
+    task = asyncio.create_task(run_parser(platform, query, price_min, price_max, max_items, progress))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # События из потока могли прийти после завершения задачи
+        while not events.empty():
+            event = events.get_nowait()
+            if event:
+                yield event
+        yield {"event": "done", "items": task.result()}
+    finally:
+        if not task.done():
+            task.cancel()
\ No newline at end of file
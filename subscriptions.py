@@ -0,0 +1,369 @@
+"""
+subscriptions.py - Сохранённые поиски пользователей и оповещения о новых товарах
+
+Подписка: бренд и/или ключевые слова, площадка и диапазон цен. MatchEngine
+держит инвертированный индекс "якорь -> подписки": якорь - бренд подписки,
+а без бренда - самое длинное её слово. Для товара достаются только подписки
+по его бренду и словам названия, поэтому пачка новых товаров стоит
+O(слов в названиях + кандидатов), а не O(подписок × товаров).
+Совпадения пишутся в таблицу alerts из любого процесса (бот, воркеры),
+рассылает их процесс бота (alerts_loop) - дайджестами, по сообщению на пачку.
+"""
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import database
+from brands import find_brand
+from config import Config, logger
+from metrics import ALERT_MESSAGES, ALERT_ITEMS
+from utils import parse_price
+
+_WORD = re.compile(r"\w+")
+# Кана и иероглифы: пробелов между словами нет, поэтому ищем подстрокой
+_CJK = re.compile("[\u3040-\u30ff\u3400-\u9fff\uff66-\uff9f]+")
+_PRICE_RANGE = re.compile(r"^(\d*)-(\d*)$")
+
+def title_keys(title_lower):
+    """Ключи названия: слова, а у CJK-отрезков ещё символы и биграммы"""
+    keys = set(_WORD.findall(title_lower))
+    for run in _CJK.findall(title_lower):
+        keys.update(run)
+        keys.update(run[i:i + 2] for i in range(len(run) - 1))
+    return keys
+
+def _brand_key(brand):
+    return f"brand:{brand.lower()}"
+
+@dataclass
+class Subscription:
+    id: int
+    user_id: int
+    brand: Optional[str]
+    keywords: tuple
+    platform: Optional[str]
+    price_min: int = 0
+    price_max: Optional[int] = None
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(id=row['id'], user_id=row['user_id'], brand=row['brand'] or None,
+                   keywords=tuple((row['keywords'] or "").split()), platform=row['platform'] or None,
+                   price_min=row['price_min'] or 0, price_max=row['price_max'])
+
+    @property
+    def source(self):
+        """Название площадки, как его пишет парсер в item['source']"""
+        return Config.PLATFORMS.get(self.platform, {}).get('name', self.platform) if self.platform else None
+
+    @property
+    def anchor(self):
+        """Ключ индекса: бренд, иначе самое длинное слово (оно реже встречается)"""
+        if self.brand:
+            return _brand_key(self.brand)
+        keyword = max(self.keywords, key=len)
+        return keyword[:2] if _CJK.fullmatch(keyword) else keyword
+
+    def matches(self, brand, source, title_lower, keys, price):
+        if self.brand and (not brand or brand.lower() != self.brand.lower()):
+            return False
+        if self.platform and source != self.source:
+            return False
+        for keyword in self.keywords:
+            if keyword not in keys and not (_CJK.search(keyword) and keyword in title_lower):
+                return False
+        if self.price_min or self.price_max is not None:
+            if price is None or price < self.price_min:
+                return False
+            if self.price_max is not None and price > self.price_max:
+                return False
+        return True
+
+    def describe(self):
+        parts = []
+        if self.brand:
+            parts.append(f"🏷 {self.brand}")
+        if self.keywords:
+            parts.append(" ".join(self.keywords))
+        if self.platform:
+            parts.append(f"@{self.platform}")
+        if self.price_min or self.price_max is not None:
+            parts.append(f"{self.price_min or ''}-{self.price_max if self.price_max is not None else ''}")
+        return " ".join(parts)
+
+class MatchEngine:
+    """Инвертированный индекс подписок"""
+
+    def __init__(self, subscriptions=()):
+        self.index = {}
+        self.size = 0
+        for subscription in subscriptions:
+            self.add(subscription)
+
+    def add(self, subscription):
+        self.index.setdefault(subscription.anchor, []).append(subscription)
+        self.size += 1
+
+    def match(self, items):
+        """Пары (подписка, товар); на товар - не больше одной подписки каждого пользователя"""
+        matches = []
+        for item in items:
+            title_lower = (item.get('title') or "").lower()
+            keys = title_keys(title_lower)
+            brand = item.get('brand')
+            if not brand or brand == 'Unknown':
+                found = find_brand(title_lower)
+                brand = found[0] if found else None
+            if brand:
+                keys.add(_brand_key(brand))
+            price = parse_price(item.get('price'))
+            source = item.get('source')
+
+            notified = set()
+            for key in keys:
+                for subscription in self.index.get(key, ()):
+                    if subscription.user_id in notified:
+                        continue
+                    if subscription.matches(brand, source, title_lower, keys, price):
+                        notified.add(subscription.user_id)
+                        matches.append((subscription, item))
+        return matches
+
+# ==================== ИНДЕКС ПРОЦЕССА ====================
+_engine = MatchEngine()
+_engine_version = None
+_checked_at = 0.0
+
+def get_engine():
+    """Индекс подписок; перестраивается, если подписки изменились (в любом процессе)"""
+    global _engine, _engine_version, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < Config.SUBSCRIPTIONS_REFRESH:
+        return _engine
+    _checked_at = now
+    version = database.get_subscriptions_version()
+    if version is not None and version != _engine_version:
+        _engine = MatchEngine(Subscription.from_row(row) for row in database.get_subscriptions())
+        _engine_version = version
+        logger.info(f"🔔 Индекс подписок перестроен: {_engine.size} подписок, {len(_engine.index)} ключей")
+    return _engine
+
+def invalidate():
+    """Подписки изменились в этом процессе - перечитать при следующем сопоставлении"""
+    global _checked_at
+    _checked_at = 0.0
+
+def notify_new_items(items):
+    """Сопоставляет новые товары с подписками и ставит оповещения в очередь"""
+    if not Config.SUBSCRIPTIONS_ENABLED or not items:
+        return 0
+    engine = get_engine()
+    if not engine.size:
+        return 0
+    matches = engine.match(items)
+    queued = database.add_alerts([(sub.user_id, item['id'], sub.id) for sub, item in matches])
+    if queued:
+        logger.info(f"🔔 Новых оповещений: {queued} (товаров {len(items)})")
+    return queued
+
+# ==================== КОМАНДЫ ====================
+def parse_subscription(text):
+    """
+    "<бренд и/или слова> [@площадка] [от-до]" -> dict полей подписки.
+    Бросает ValueError с понятным пользователю текстом.
+    """
+    words, platform, price_min, price_max = [], None, 0, None
+    for token in text.split():
+        price = _PRICE_RANGE.match(token)
+        if token.startswith("@"):
+            platform = token[1:].lower()
+            if platform not in Config.PLATFORMS:
+                raise ValueError(f"Неизвестная площадка {token}. Есть: "
+                                 + ", ".join(f"@{p}" for p in Config.PLATFORMS))
+        elif price and (price.group(1) or price.group(2)):
+            price_min = int(price.group(1) or 0)
+            price_max = int(price.group(2)) if price.group(2) else None
+            if price_max is not None and price_max < price_min:
+                raise ValueError("Цена «до» меньше цены «от»")
+        else:
+            words.append(token)
+
+    query = " ".join(words).lower()
+    brand = None
+    found = find_brand(query)
+    if found:
+        # Вырезаем бренд целиком, соседние слова не задеваем
+        brand, start, end = found
+        query = query[:start] + " " + query[end:]
+    keywords = _WORD.findall(query)
+    if not brand and not keywords:
+        raise ValueError("Укажи бренд или ключевые слова")
+    return {"brand": brand, "keywords": " ".join(keywords), "platform": platform,
+            "price_min": price_min, "price_max": price_max}
+
+def subscribe(user_id, text):
+    """Создаёт подписку по тексту команды, возвращает Subscription"""
+    if len(database.get_subscriptions(user_id)) >= Config.SUBSCRIPTIONS_PER_USER:
+        raise ValueError(f"Не больше {Config.SUBSCRIPTIONS_PER_USER} подписок")
+    fields = parse_subscription(text)
+    subscription_id = database.add_subscription(user_id, **fields)
+    if subscription_id is None:
+        raise ValueError("Не удалось сохранить подписку")
+    invalidate()
+    return Subscription.from_row({"id": subscription_id, "user_id": user_id, **fields})
+
+def list_subscriptions(user_id):
+    return [Subscription.from_row(row) for row in database.get_subscriptions(user_id)]
+
+def unsubscribe(user_id, subscription_id):
+    removed = database.delete_subscription(user_id, subscription_id)
+    if removed:
+        invalidate()
+    return removed
+
+# ==================== РАССЫЛКА ====================
+# Оповещения копятся в alerts и уходят пользователю одним дайджестом: когда
+# их набралось DIGEST_MAX_ITEMS или самому старому исполнилось DIGEST_INTERVAL.
+# Товары дешевле личного порога (/priority) идут сразу отдельным сообщением.
+_DIGEST_FIELDS = ('title', 'price', 'source', 'url')
+
+def format_alert(alert):
+    return (f"🔥 **Срочно по подписке**\n\n"
+            f"{(alert.get('title') or '?')[:100]}\n"
+            f"💰 {alert.get('price') or '?'} · {alert.get('source') or ''}\n"
+            f"{alert.get('url') or ''}")
+
+def is_priority(alert):
+    threshold = alert.get('priority_price')
+    if threshold is None:
+        return False
+    price = parse_price(alert.get('price'))
+    return price is not None and price <= threshold
+
+def render_digest(digest_id, items, page):
+    """Текст и клавиатура страницы дайджеста"""
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+    size = Config.DIGEST_PAGE_SIZE
+    pages = max(1, (len(items) + size - 1) // size)
+    page = min(max(page, 0), pages - 1)
+    text = f"🔔 **Новое по подпискам: {len(items)}**"
+    if pages > 1:
+        text += f" (стр. {page + 1}/{pages})"
+    text += "\n\n"
+    for i, item in enumerate(items[page * size:(page + 1) * size], page * size + 1):
+        text += (f"{i}. {(item.get('title') or '?')[:60]}\n"
+                 f"💰 {item.get('price') or '?'} · {item.get('source') or ''}\n"
+                 f"{item.get('url') or ''}\n")
+
+    keyboard = None
+    if pages > 1:
+        builder = InlineKeyboardBuilder()
+        if page > 0:
+            builder.button(text="◀️ Назад", callback_data=f"digest:{digest_id}:{page - 1}")
+        if page < pages - 1:
+            builder.button(text="Ещё ▶️", callback_data=f"digest:{digest_id}:{page + 1}")
+        keyboard = builder.as_markup()
+    return text, keyboard
+
+def due_digests(alerts, now=None):
+    """
+    Делит неотправленные оповещения на срочные и дайджесты к отправке.
+    Возвращает (срочные, {user_id: [оповещения]}); остальные ждут следующего прохода.
+    """
+    now = now or time.time()
+    urgent, buffered = [], {}
+    for alert in alerts:
+        if is_priority(alert):
+            urgent.append(alert)
+        else:
+            buffered.setdefault(alert['user_id'], []).append(alert)
+
+    due = {}
+    for user_id, pending in buffered.items():
+        oldest = min(a['created_at'] or now for a in pending)
+        if len(pending) >= Config.DIGEST_MAX_ITEMS or now - oldest >= Config.DIGEST_INTERVAL:
+            due[user_id] = pending
+    return urgent, due
+
+async def deliver_alerts(outbox):
+    """
+    Отправляет срочные оповещения и созревшие дайджесты, возвращает число товаров.
+    Сообщения уходят параллельно, но каждое ждём до ответа Bot API: отправленными
+    помечаются только доставленные, остальные повторятся на следующем проходе.
+    """
+    loop = asyncio.get_running_loop()
+    alerts = await loop.run_in_executor(None, database.get_pending_alerts)
+    urgent, due = due_digests(alerts)
+
+    # (kind, alert_ids, корутина отправки)
+    messages = [("priority", [alert['alert_id']], outbox.send_message(alert['user_id'], format_alert(alert)))
+                for alert in urgent]
+
+    limit = Config.DIGEST_MAX_ITEMS
+    for user_id, pending in due.items():
+        for start in range(0, len(pending), limit):
+            chunk = pending[start:start + limit]
+            items = [{field: alert.get(field) for field in _DIGEST_FIELDS} for alert in chunk]
+            digest_id = await loop.run_in_executor(None, database.save_digest, user_id, items)
+            if digest_id is None:
+                break
+            text, keyboard = render_digest(digest_id, items, 0)
+            messages.append(("digest", [alert['alert_id'] for alert in chunk],
+                             outbox.send_message(user_id, text, reply_markup=keyboard,
+                                                 disable_web_page_preview=True)))
+
+    from aiogram.exceptions import TelegramForbiddenError
+
+    results = await asyncio.gather(*(send for _, _, send in messages), return_exceptions=True)
+    sent, undeliverable = [], []
+    for (kind, alert_ids, _), result in zip(messages, results):
+        if isinstance(result, TelegramForbiddenError):
+            # Бот заблокирован - повторять бессмысленно, снимаем оповещения с очереди
+            logger.warning(f"⚠️ Оповещения не доставить ({kind}, товаров {len(alert_ids)}): {result}")
+            undeliverable.extend(alert_ids)
+            continue
+        if isinstance(result, BaseException):
+            logger.warning(f"⚠️ Оповещение ({kind}, товаров {len(alert_ids)}) не отправлено: {result}")
+            continue
+        sent.extend(alert_ids)
+        ALERT_MESSAGES.labels(kind=kind).inc()
+        ALERT_ITEMS.labels(kind=kind).inc(len(alert_ids))
+
+    await loop.run_in_executor(None, database.mark_alerts_sent, sent + undeliverable)
+    if sent:
+        logger.info(f"🔔 Разослано товаров: {len(sent)} (срочных {len(urgent)}, дайджестов пользователям {len(due)})")
+    return len(sent)
+
+def set_priority(user_id, text):
+    """Порог срочных оповещений из текста команды: число или off. Бросает ValueError"""
+    text = text.strip().lower()
+    if text in ("off", "0", "выкл"):
+        price = None
+    else:
+        price = parse_price(text)
+        if price is None or price <= 0:
+            raise ValueError("Укажи цену числом или off")
+    if not database.set_priority_price(user_id, price):
+        raise ValueError("Не удалось сохранить порог")
+    return price
+
+async def alerts_loop(outbox, interval=None):
+    """Фоновая рассылка оповещений из процесса бота"""
+    interval = interval or Config.ALERT_POLL_INTERVAL
+    loop = asyncio.get_running_loop()
+    last_purge = 0
+    while True:
+        try:
+            await deliver_alerts(outbox)
+            if time.monotonic() - last_purge > Config.ALERT_PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                await loop.run_in_executor(None, database.purge_alerts, Config.ALERT_RETENTION)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка рассылки оповещений: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,169 @@
+"""
+telegram_queue.py - Очередь исходящих сообщений Telegram: лимиты, RetryAfter, склейка правок
+"""
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from config import Config, logger
+from metrics import TELEGRAM_SECONDS, TELEGRAM_ERRORS
+from utils import RateLimiter
+
+MAX_RETRIES = 3
+
+class MessageDispatcher:
+    """
+    Все исходящие вызовы Bot API идут через общую очередь:
+    - глобальный и поканальный token bucket;
+    - при 429 ждём retry_after и повторяем;
+    - частые правки одного сообщения склеиваются - уходит только последний текст.
+    Повторяет сигнатуры методов Bot, поэтому подставляется вместо bot.
+    """
+
+    def __init__(self, bot, global_rate=None, chat_rate=None, workers=4, max_chats=10000):
+        self.bot = bot
+        self.global_limiter = RateLimiter(global_rate or Config.TG_GLOBAL_RATE,
+                                          burst=int(global_rate or Config.TG_GLOBAL_RATE))
+        self.chat_rate = chat_rate or Config.TG_CHAT_RATE
+        self.chat_limiters = OrderedDict()
+        self.chat_locks = {}
+        self.max_chats = max_chats
+        self.queue = asyncio.Queue()
+        self.pending = {}
+        self.workers_count = workers
+        self.workers = []
+        self._seq = itertools.count()
+
+    async def start(self):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+        logger.info("✅ Очередь сообщений Telegram запущена")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    # ==================== ПУБЛИЧНЫЕ МЕТОДЫ ====================
+    async def edit_message_text(self, text, chat_id, message_id, wait=True, **kwargs):
+        """Правка текста; незаправленные правки того же сообщения заменяются новой"""
+        key = ("edit", chat_id, message_id)
+        return await self._enqueue(key, "edit_message_text", chat_id,
+                                   dict(text=text, chat_id=chat_id, message_id=message_id, **kwargs), wait)
+
+    async def send_message(self, chat_id, text, wait=True, **kwargs):
+        return await self._enqueue(None, "send_message", chat_id,
+                                   dict(chat_id=chat_id, text=text, **kwargs), wait)
+
+    async def send_photo(self, chat_id, photo, wait=True, **kwargs):
+        return await self._enqueue(None, "send_photo", chat_id,
+                                   dict(chat_id=chat_id, photo=photo, **kwargs), wait)
+
+    async def send_media_group(self, chat_id, media, wait=True, **kwargs):
+        return await self._enqueue(None, "send_media_group", chat_id,
+                                   dict(chat_id=chat_id, media=media, **kwargs), wait)
+
+    # ==================== ВНУТРЕННЕЕ ====================
+    async def _enqueue(self, key, method, chat_id, kwargs, wait):
+        future = asyncio.get_running_loop().create_future()
+        if key is None:
+            key = ("call", next(self._seq))
+
+        entry = self.pending.get(key)
+        if entry:
+            # Ещё не отправлено - просто подменяем аргументы
+            entry["kwargs"] = kwargs
+            entry["futures"].append(future)
+        else:
+            self.pending[key] = {"method": method, "chat_id": chat_id,
+                                 "kwargs": kwargs, "futures": [future]}
+            self.queue.put_nowait(key)
+
+        if not wait:
+            future.add_done_callback(_consume_exception)
+            return None
+        return await future
+
+    def _chat_limiter(self, chat_id):
+        limiter = self.chat_limiters.pop(chat_id, None) or RateLimiter(self.chat_rate, burst=3)
+        self.chat_limiters[chat_id] = limiter
+        if len(self.chat_limiters) > self.max_chats:
+            old_chat, _ = self.chat_limiters.popitem(last=False)
+            self.chat_locks.pop(old_chat, None)
+        return limiter
+
+    async def _worker(self):
+        while True:
+            key = await self.queue.get()
+            entry = self.pending.get(key)
+            if entry:
+                try:
+                    await self._deliver(key, entry["chat_id"])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Ошибка очереди Telegram: {e}")
+            self.queue.task_done()
+
+    async def _deliver(self, key, chat_id):
+        lock = self.chat_locks.setdefault(chat_id, asyncio.Lock())
+
+        async with lock:
+            # Забираем запись только под замком чата: пока ждали, её могли обновить
+            entry = self.pending.pop(key, None)
+            if not entry:
+                return
+            result, error = None, None
+
+            for attempt in range(MAX_RETRIES + 1):
+                await self._chat_limiter(chat_id).acquire()
+                await self.global_limiter.acquire()
+                try:
+                    result = await self._call(entry["method"], entry["kwargs"])
+                    error = None
+                    break
+                except TelegramRetryAfter as e:
+                    logger.warning(f"⏳ Flood control в чате {chat_id}: ждём {e.retry_after}с")
+                    error = e
+                    await asyncio.sleep(e.retry_after)
+                    newer = self.pending.pop(key, None)
+                    if newer:
+                        # Пока ждали, пришла более свежая версия - отправляем её
+                        newer["futures"] = entry["futures"] + newer["futures"]
+                        entry = newer
+                except TelegramBadRequest as e:
+                    if "message is not modified" in str(e):
+                        error = None
+                    else:
+                        error = e
+                    break
+                except Exception as e:
+                    error = e
+                    break
+
+            for future in entry["futures"]:
+                if future.done():
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def _call(self, method, kwargs):
+        """Вызов Bot API с замером задержки"""
+        start = time.perf_counter()
+        try:
+            return await getattr(self.bot, method)(**kwargs)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(method=method, error=type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_SECONDS.labels(method=method).observe(time.perf_counter() - start)
+
+def _consume_exception(future):
+    """Ошибки fire-and-forget отправок только логируем"""
+    if not future.cancelled() and future.exception():
+        logger.warning(f"⚠️ Сообщение не доставлено: {future.exception()}")
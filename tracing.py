@@ -0,0 +1,214 @@
+"""
+tracing.py - Лёгкая трассировка поиска: спаны через contextvars, экспорт в JSONL и/или OTLP
+
+Один поиск пользователя = один trace_id: run_parser_task -> run_parser -> поток
+парсера -> parse_mercari -> save_items -> add_item_with_brand. Контекст
+переходит в потоки через copy_context (in_context) и в воркер-процессы через
+payload задачи (inject / attach).
+"""
+
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from config import Config, logger
+
+# (trace_id, span_id) текущего спана
+_current = contextvars.ContextVar("trace_span", default=None)
+
+# ==================== СПАНЫ ====================
+@contextmanager
+def span(name, **attrs):
+    """
+    Спан вокруг блока кода (и sync, и async). Без активного трейса
+    начинает новый. Возвращает dict атрибутов - в него можно дописывать.
+    """
+    if not Config.TRACE_ENABLED:
+        yield attrs
+        return
+
+    parent = _current.get()
+    trace_id = parent[0] if parent else secrets.token_hex(16)
+    span_id = secrets.token_hex(8)
+    token = _current.set((trace_id, span_id))
+    start = time.time()
+    start_perf = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status = "error"
+        attrs["error"] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current.reset(token)
+        _exporter.export({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent[1] if parent else None,
+            "name": name,
+            "start": start,
+            "duration_ms": round((time.perf_counter() - start_perf) * 1000, 3),
+            "status": status,
+            "attrs": attrs,
+            "pid": os.getpid(),
+        })
+
+def traced(name):
+    """Декоратор: вызов функции (обычной или async) - отдельный спан"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_trace_id():
+    current = _current.get()
+    return current[0] if current else None
+
+def in_context(fn):
+    """fn, который выполнится в копии текущего контекста (для run_in_executor)"""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+def inject():
+    """Контекст трейса для передачи в другой процесс (payload задачи)"""
+    current = _current.get()
+    return {"trace_id": current[0], "span_id": current[1]} if current else None
+
+@contextmanager
+def attach(carrier):
+    """Продолжает трейс, пришедший из другого процесса"""
+    if not carrier:
+        yield
+        return
+    token = _current.set((carrier["trace_id"], carrier["span_id"]))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+# ==================== ЭКСПОРТ ====================
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def to_otlp(spans):
+    """Пачка спанов в OTLP/HTTP JSON (ExportTraceServiceRequest)"""
+    otlp_spans = []
+    for s in spans:
+        start_ns = int(s["start"] * 1e9)
+        otlp_span = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(s["duration_ms"] * 1e6)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s["attrs"].items()],
+            "status": {"code": 2 if s["status"] == "error" else 1},
+        }
+        if s["parent_id"]:
+            otlp_span["parentSpanId"] = s["parent_id"]
+        otlp_spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": Config.TRACE_SERVICE_NAME}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}],
+    }]}
+
+class SpanExporter:
+    """
+    Спаны копятся в очереди и пишутся фоновым потоком пачками,
+    чтобы горячий путь не ждал диск или сеть.
+    """
+
+    def __init__(self, batch_size=100, interval=1.0):
+        self.queue = queue.Queue(maxsize=10000)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def export(self, record):
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # трассировка не должна тормозить работу
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        if Config.TRACE_FILE:
+            try:
+                with open(Config.TRACE_FILE, "a", encoding="utf-8") as f:
+                    for record in batch:
+                        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось записать спаны: {e}")
+
+        if Config.TRACE_OTLP_URL:
+            try:
+                request = urllib.request.Request(
+                    Config.TRACE_OTLP_URL.rstrip("/") + "/v1/traces",
+                    data=json.dumps(to_otlp(batch), default=str).encode(),
+                    headers={"Content-Type": "application/json"},
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"⚠️ Коллектор трейсов недоступен: {e}")
+
+_exporter = SpanExporter()
@@ -2,9 +2,11 @@
 utils.py - Вспомогательные функции
 """
 
+import asyncio
 import hashlib
 import time
 import random
+import re
 import logging
 from urllib.parse import urljoin
 
@@ -40,4 +42,60 @@ def format_number(num):
     try:
         return f"{int(num):,}".replace(",", " ")
     except:
-        return str(num)
\ No newline at end of file
+        return str(num)
+
+class RateLimiter:
+    """
+    Асинхронный token bucket: не больше `rate` запросов в секунду
+    с допустимым всплеском `burst`.
+    """
+    
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = None
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    async def acquire(self):
+        """Ждёт, пока в ведре появится токен, и забирает его"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+def parse_price(text):
+    """
+    Достаёт число из строки цены ("¥12,800", "1 200 zł", "$35.50").
+    Возвращает int (дробная часть отбрасывается) или None.
+    """
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return int(text)
+    match = re.search(r"\d[\d\s,.]*", str(text))
+    if not match:
+        return None
+    number = re.sub(r"\s", "", match.group(0)).rstrip(",.")
+    # Десятичный разделитель - последний из '.'/',' если после него не 3 цифры
+    sep = max(number.rfind("."), number.rfind(","))
+    if sep != -1 and len(number) - sep - 1 != 3:
+        number = number[:sep]
+    digits = re.sub(r"[,.]", "", number)
+    return int(digits) if digits else None
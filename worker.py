@@ -0,0 +1,156 @@
+"""
+worker.py - Воркер-процесс: забирает задачи парсинга из общей очереди и пишет результаты в БД
+"""
+
+import asyncio
+import os
+import socket
+import time
+
+import job_queue
+import metrics
+import tracing
+from loop_monitor import start_loop_monitor
+from config import Config, logger
+from database import Database
+from simple_parsers import stream_parser
+
+def _compact_item(item):
+    """Поля товара, которые нужны боту для отчёта и оповещений"""
+    keys = ('id', 'title', 'price', 'url', 'img_url', 'source', 'brand',
+            'is_new', 'duplicate_of', 'cluster_id')
+    return {k: item[k] for k in keys if k in item}
+
+async def run_parse_job(job, worker_id, db):
+    """Выполняет задачу 'parse' и возвращает результат для бота"""
+    payload = job['payload']
+    platform = payload['platform']
+    query = payload['query']
+
+    results = []
+    saved = 0
+    pages = 0
+    last_beat = 0
+
+    async for event in stream_parser(platform, query,
+                                     payload.get('price_min', 0),
+                                     payload.get('price_max', 1000000),
+                                     payload.get('max_items', 20)):
+        if event["event"] == "page_fetched":
+            pages += 1
+        elif event["event"] == "items":
+            results.extend(event["items"])
+            saved += await db.save_items(event["items"], platform, query)
+        elif event["event"] == "done":
+            break
+
+        # Прогресс заодно продлевает аренду задачи
+        now = time.monotonic()
+        if now - last_beat >= Config.PROGRESS_INTERVAL:
+            last_beat = now
+            job_queue.heartbeat(job['id'], worker_id, job['attempt'],
+                                {"pages": pages, "found": len(results), "saved": saved})
+
+    return {"items": [_compact_item(item) for item in results], "saved": saved}
+
+async def run_image_hash_job(job, worker_id, db):
+    """Хеширует фото товаров, сохранённых процессом бота (своего конвейера у него нет)"""
+    import image_hash
+    if not image_hash.pipeline:
+        raise RuntimeError("хеширование фото выключено (IMAGE_HASH_ENABLED)")
+
+    items = job['payload']['items']
+    matches = 0
+    for item in items:
+        try:
+            if await image_hash.pipeline.process(item):
+                matches += 1
+        except Exception as e:
+            logger.debug(f"Ошибка хеширования фото {item.get('id')}: {e}")
+    return {"hashed": len(items), "matches": matches}
+
+JOB_HANDLERS = {
+    "parse": run_parse_job,
+    "image_hash": run_image_hash_job,
+}
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks = []
+
+async def _keep_lease(job, worker_id, work):
+    """
+    Продлевает аренду, пока задача выполняется (даже если прогресса нет).
+    Аренду потеряли (задачу отменили или забрал другой воркер) - прерываем работу.
+    """
+    while True:
+        await asyncio.sleep(Config.JOB_LEASE_SECONDS / 3)
+        if not job_queue.heartbeat(job['id'], worker_id, job['attempt']):
+            logger.warning(f"⚠️ {worker_id}: аренда задачи #{job['id']} потеряна, прерываю")
+            work.cancel()
+            return
+
+async def worker_loop(worker_id):
+    """Основной цикл воркера"""
+    db = Database()
+    logger.info(f"👷 Воркер {worker_id} запущен")
+
+    while True:
+        job = job_queue.claim(worker_id)
+        if not job:
+            await asyncio.sleep(Config.JOB_POLL_INTERVAL)
+            continue
+
+        handler = JOB_HANDLERS.get(job['kind'])
+        if not handler:
+            job_queue.finish(job['id'], worker_id, job['attempt'], error=f"неизвестный тип задачи {job['kind']}")
+            continue
+
+        logger.info(f"👷 {worker_id}: задача #{job['id']} ({job['kind']}), попытка {job['attempt']}")
+
+        async def run(job=job, handler=handler):
+            # Продолжаем трейс поиска, начатый в процессе бота
+            with tracing.attach(job['payload'].get('trace')), \
+                    tracing.span(f"job.{job['kind']}", job_id=job['id'], attempt=job['attempt']):
+                return await handler(job, worker_id, db)
+
+        work = asyncio.create_task(run())
+        lease = asyncio.create_task(_keep_lease(job, worker_id, work))
+        try:
+            await asyncio.wait({work})
+            # Отменена только работа (аренда потеряна) - результата нет, воркер продолжает
+            if not work.cancelled():
+                job_queue.finish(job['id'], worker_id, job['attempt'], result=work.result())
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"❌ {worker_id}: задача #{job['id']} упала: {e}")
+            job_queue.finish(job['id'], worker_id, job['attempt'], error=str(e)[:500])
+        finally:
+            lease.cancel()
+
+async def main():
+    worker_index = int(os.environ.get("WORKER_INDEX", 0))
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    metrics.install_shutdown()
+    background_tasks.append(asyncio.create_task(metrics.flush_loop()))
+    await start_loop_monitor()
+    
+    # Фоновые задачи, которые при наличии воркеров не нагружают процесс бота
+    if worker_index == 0 and Config.LIVENESS_ENABLED:
+        from liveness import liveness_loop
+        background_tasks.append(asyncio.create_task(liveness_loop()))
+
+    if Config.IMAGE_HASH_ENABLED:
+        import image_hash
+        import media_cache
+        if Config.MEDIA_CACHE_ENABLED:
+            media_cache.cache = media_cache.MediaCache()
+        image_hash.pipeline = image_hash.ImageHashPipeline()
+        await image_hash.pipeline.start()
+
+    await worker_loop(worker_id)
+
+if __name__ == "__main__":
+    asyncio.run(main())